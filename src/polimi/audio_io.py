@@ -0,0 +1,44 @@
+"""Audio ingestion shared by the VGGish and GhostVLAD feature extractors.
+
+Each input is decoded and resampled only once; the resulting mono waveform is then handed to both extractors.
+"""
+
+import io
+
+import numpy as np
+import soundfile as sf
+
+import params
+import resampling
+
+
+def load_waveform(audio, sample_rate=None, dtype=None):
+    """Decode an audio input into a mono waveform sampled at params.SAMPLE_RATE.
+
+    Args:
+      audio: Path to an audio file, file-like object, bytes with the content of an audio file or np.array with the
+        samples (either 1-D or 2-D with channels on the second axis). Integer samples are rescaled to [-1.0, +1.0].
+      sample_rate: Sample rate of audio when it is passed as np.array, ignored otherwise. Defaults to
+        params.SAMPLE_RATE.
+      dtype: Floating point type of the returned samples, defaults to params.FEATURES_DTYPE.
+
+    Returns:
+      1-D np.array of samples at params.SAMPLE_RATE.
+    """
+    dtype = np.dtype(params.FEATURES_DTYPE if dtype is None else dtype)
+    if isinstance(audio, np.ndarray):
+        data = audio
+        sr = params.SAMPLE_RATE if sample_rate is None else sample_rate
+        if np.issubdtype(data.dtype, np.integer):
+            data = data.astype(dtype) / dtype.type(-np.iinfo(data.dtype).min)  # Convert to [-1.0, +1.0]
+    else:
+        if isinstance(audio, (bytes, bytearray)):
+            audio = io.BytesIO(audio)
+        data, sr = sf.read(audio, dtype=dtype.name)
+    # Convert to mono
+    if len(data.shape) > 1:
+        data = np.mean(data, axis=1)
+    # Resample to the rate assumed by the feature extractors
+    if sr != params.SAMPLE_RATE:
+        data = resampling.resample(data, sr, params.SAMPLE_RATE)
+    return data.astype(dtype, copy=False)
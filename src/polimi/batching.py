@@ -0,0 +1,114 @@
+"""Micro-batching of the PATHOSnet classifiers.
+
+With many concurrent requests (e.g., several microphones served by the same process), classifying each utterance on
+its own runs every network with batches of a single utterance. A BatchingClassifier collects the requests of several
+threads for a few milliseconds and runs each network once on all of them.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import params
+
+
+class BatchingClassifier(object):
+    """PATHOSnet classifier batching the requests of concurrent threads.
+
+    Callers decode their audio and extract the network inputs (VGGish examples and GhostVLAD windows) in their own
+    thread, then hand them to a scheduler thread. The scheduler waits up to max_wait seconds after the first request
+    for other ones (at most max_batch_size in total), classifies the batch at once (see
+    pathosnet.PathosnetClassifier.predict_batch) and returns to each caller its own predictions, the same (up to
+    floating point errors) of the wrapped classifier.
+
+    Args:
+      classifier: pathosnet.PathosnetVoiceClassifier or pathosnet.PathosnetMultimodalClassifier, whose models run the
+        batches; the wrapper is called with the same arguments.
+      max_wait: Longest wait for other requests, in seconds, defaults to params.BATCH_MAX_WAIT.
+      max_batch_size: Largest number of requests in a batch, defaults to params.BATCH_MAX_SIZE.
+    """
+
+    def __init__(self, classifier, max_wait=None, max_batch_size=None):
+        self.classifier = classifier
+        self.max_wait = params.BATCH_MAX_WAIT if max_wait is None else max_wait
+        self.max_batch_size = params.BATCH_MAX_SIZE if max_batch_size is None else max_batch_size
+        self._requests = queue.Queue()
+        # Futures of the requests not answered yet, failed by close without waiting
+        self._pending = set()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._scheduler = threading.Thread(target=self._schedule, name='pathosnet-batching', daemon=True)
+        self._scheduler.start()
+
+    def __call__(self, audio, *args, sample_rate=None):
+        vggish_examples, ghostvlad_inputs = self.classifier.network_inputs(audio, sample_rate=sample_rate)
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("PATHOSnet batching classifier closed")
+            self._pending.add(future)
+            self._requests.put((vggish_examples, ghostvlad_inputs, args, future))
+        return future.result()
+
+    def warm_up(self, duration=1.):
+        """Warm up the models of the wrapped classifier (see pathosnet.PathosnetClassifier.warm_up)."""
+        self.classifier.warm_up(duration=duration)
+
+    def close(self, wait=True):
+        """Stop the scheduler thread; later calls raise RuntimeError.
+
+        Args:
+          wait: Whether to wait for the scheduler thread to stop, after classifying the requests already received;
+            otherwise (e.g., when the scheduler may be stuck on suspended models) the pending requests fail at once.
+        """
+        with self._lock:
+            self._closed = True
+            self._requests.put(None)
+        if wait:
+            self._scheduler.join()
+        else:
+            self._resolve(list(self._pending), error=RuntimeError("PATHOSnet batching classifier closed"))
+
+    def _schedule(self):
+        stopped = False
+        while not stopped:
+            request = self._requests.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self._requests.get(timeout=max(deadline - time.monotonic(), 0.))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopped = True
+                    break
+                batch.append(request)
+            self._run(batch)
+
+    def _run(self, batch):
+        batch = [request for request in batch if not request[3].done()]  # Failed by close
+        if not batch:
+            return
+        vggish_examples, ghostvlad_inputs, args, futures = zip(*batch)
+        try:
+            predictions = self.classifier.predict_batch(list(zip(vggish_examples, ghostvlad_inputs)), args)
+        except BaseException as e:
+            self._resolve(futures, error=e)
+            return
+        self._resolve(futures, predictions=predictions)
+
+    def _resolve(self, futures, predictions=None, error=None):
+        # Futures already failed by close are left as they are
+        with self._lock:
+            for i, future in enumerate(futures):
+                self._pending.discard(future)
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(predictions[i])
@@ -1,121 +1,193 @@
 from __future__ import absolute_import
 from __future__ import print_function
+import collections
 import os
 import sys
 import numpy as np
-import librosa
 import random
 
-import ghostvlad.ghostvlad.ghostvlad_model as model
-import ghostvlad.ghostvlad.toolkits as toolkits
+import ghostvlad.ghostvlad.utils as ut
+import inference
+import resampling
+import startup
 
 # ===========================================
-#        Parse the argument
+#        Network configuration
 # ===========================================
-import argparse
-parser = argparse.ArgumentParser()
-# set up training configuration.
-parser.add_argument('--gpu', default='', type=str)
-parser.add_argument('--resume', default=r'ghostvlad/pretrained_models/ghostvlad_weights.h5', type=str)
-parser.add_argument('--data_path', default='4persons', type=str)
-# set up network configuration.
-parser.add_argument('--net', default='resnet34s', choices=['resnet34s', 'resnet34l'], type=str)
-parser.add_argument('--ghost_cluster', default=2, type=int)
-parser.add_argument('--vlad_cluster', default=8, type=int)
-parser.add_argument('--bottleneck_dim', default=512, type=int)
-parser.add_argument('--aggregation_mode', default='gvlad', choices=['avg', 'vlad', 'gvlad'], type=str)
-# set up learning rate, training loss and optimizer.
-parser.add_argument('--loss', default='softmax', choices=['softmax', 'amsoftmax'], type=str)
-parser.add_argument('--test_type', default='normal', choices=['normal', 'hard', 'extend'], type=str)
-parser.add_argument('--csv_file', default='', type=str)
-parser.add_argument('--verbose', default='True', choices=['True', 'False'], type=str)
-
-global args_gv
-args_gv = parser.parse_args('')
+# Configuration of the GhostVlad network (see ghostvlad_model.vggvox_resnet2d_icassp), the defaults are the ones of the
+# pretrained model; tflite_compatible builds a graph that the TensorFlow Lite converter supports (see
+# ghostvlad_model.VladPooling), used for the export only
+GhostVladConfig = collections.namedtuple(
+    'GhostVladConfig', ['net', 'ghost_cluster', 'vlad_cluster', 'bottleneck_dim', 'aggregation_mode', 'loss',
+                        'optimizer', 'tflite_compatible'],
+    defaults=['resnet34s', 2, 8, 512, 'gvlad', 'softmax', 'adam', False])
 
 class FeaturesExtractor():
 
-    def __init__(self, ghostvlad_weights_path, verbose=False):
+    def __init__(self, ghostvlad_weights_path, max_batch_size=32, dtype=np.float32, optimize=False,
+                 shared_backbone=False, runtime_config=None, config=None, verbose=False):
+        self.max_batch_size = max_batch_size
+        self.config = config if config is not None else GhostVladConfig()
+        # Floating point type of spectrograms and extracted features, float32 matches the network
+        self.dtype = np.dtype(dtype)
         if verbose:
             print("\tInstantiating GhostVlad...")
-        toolkits.initialize_GPU(args_gv)
+        if not os.path.isfile(ghostvlad_weights_path):
+            raise IOError("No checkpoint found at '{}'".format(ghostvlad_weights_path))
+        # Either the Keras model with the h5 weights or an inference-only frozen graph (.pb)
+        self.network_eval = inference.load_model(ghostvlad_weights_path, lambda path: self.build_network(path, verbose),
+                                                 optimize=optimize, runtime_config=runtime_config, verbose=verbose)
+        # Predictions go through a backend function, cheaper than Model.predict on small inputs
+        self.predictor = inference.as_callable(self.network_eval)
+        # In shared backbone mode the convolutional trunk runs once on the whole spectrogram and only the pooling is
+        # applied window by window
+        self.shared_backbone = shared_backbone
+        if shared_backbone:
+            self.build_shared_backbone_networks()
+        if verbose:
+            print("\tGhostVlad instantiated successfully.")
+
+    def build_network(self, ghostvlad_weights_path, verbose=False):
+        import ghostvlad.ghostvlad.ghostvlad_model as model
+
+        # Devices and sessions are set by the caller (see runtime.RuntimeConfig), the network is built in the default
+        # graph
         params = {'dim': (257, None, 1), 'nfft': 512, 'min_slice': 720, 'win_length': 400,
                   'hop_length': 160, 'n_classes': 5994, 'sampling_rate': 16000, 'normalize': True,}
-        self.network_eval = model.vggvox_resnet2d_icassp(input_dim=params['dim'], num_class=params['n_classes'], mode='eval', args=args_gv)
+        network_eval = model.vggvox_resnet2d_icassp(input_dim=params['dim'], num_class=params['n_classes'], mode='eval', args=self.config)
 
         # load the model if the imag_model == real_model.
         # NOTE weights should be passed using the argument '--resume', this is a modified constructor.
-        if os.path.isfile(ghostvlad_weights_path):
-            if verbose:
-                print("\tLoading GhostVlad weights...")
-            self.network_eval.load_weights(os.path.join(ghostvlad_weights_path), by_name=True)
-            self.network_eval.trainable = False
-            if verbose:
-                print("\tGhostVlad weights loaded successfully.")
-        else:
-            raise IOError("No checkpoint found at '{}'".format(ghostvlad_weights_path))
         if verbose:
-            print("\tGhostVlad instantiated successfully.")
-
+            print("\tLoading GhostVlad weights...")
+        network_eval.load_weights(os.path.join(ghostvlad_weights_path), by_name=True)
+        network_eval.trainable = False
+        if verbose:
+            print("\tGhostVlad weights loaded successfully.")
+        return network_eval
+
+    def build_shared_backbone_networks(self, win_spec=30):
+        import keras
+        import ghostvlad.ghostvlad.ghostvlad_model as model
+
+        if not isinstance(self.network_eval, keras.models.Model):
+            raise ValueError("The shared backbone mode requires the Keras GhostVlad model")
+        # The trunk includes the layers before the pooling (x_fc and the cluster assignment convolutions span a single
+        # time step), the head the pooling and the following layers
+        layers = self.network_eval.layers
+        pooling = next(layer for layer in layers if isinstance(layer, model.VladPooling))
+        self.trunk_network = inference.as_callable(
+            keras.models.Model(self.network_eval.inputs, pooling.get_input_at(-1)))
+        head_inputs = [keras.layers.Input(batch_shape=keras.backend.int_shape(t)) for t in pooling.get_input_at(-1)]
+        x = pooling(head_inputs)
+        for layer in layers[layers.index(pooling) + 1:]:
+            x = layer(x)
+        self.head_network = inference.as_callable(keras.models.Model(head_inputs, x))
+        # Width and stride (on the time axis) of the trunk feature maps of a window
+        freq = self.network_eval.input_shape[1]
+        self.trunk_win = self.trunk_network.predict(np.zeros((1, freq, win_spec, 1), dtype=self.dtype))[0].shape[2]
+        self.trunk_stride = win_spec * 16 / self.trunk_network.predict(
+            np.zeros((1, freq, win_spec * 16, 1), dtype=self.dtype))[0].shape[2]
 
     # ===============================================
     #       code from Arsha for loading data.
     # ===============================================
-    def load_wav(self, vid_path, sr):
-        wav, sr_ret = librosa.load(vid_path, sr=sr)
-        assert sr_ret == sr
-
-        intervals = librosa.effects.split(wav, top_db=20)
-        wav_output = []
-        for sliced in intervals:
-            wav_output.extend(wav[sliced[0]:sliced[1]])
-        wav_output = np.array(wav_output)
+    def load_wav(self, vid_path, sr, return_intervals=False):
+        # Already decoded waveforms (expected to be mono and sampled at sr) are used as they are
+        if isinstance(vid_path, np.ndarray):
+            wav = vid_path
+        else:
+            # Decode at the native rate and use the shared (cached) polyphase resampler
+            wav, sr_ret = startup.import_librosa().load(vid_path, sr=None)
+            wav = resampling.resample(wav, sr_ret, sr)
+
+        # The intervals are the [start, end) samples of the input waveform kept by the VAD
+        wav_output, intervals = ut.trim_silence(wav, top_db=20)
+        if return_intervals:
+            return wav_output, intervals
         return wav_output
 
     def lin_spectogram_from_wav(self, wav, hop_length, win_length, n_fft=1024):
-        linear = librosa.stft(wav, n_fft=n_fft, win_length=win_length, hop_length=hop_length) # linear spectrogram
+        linear = startup.import_librosa().stft(wav, n_fft=n_fft, win_length=win_length, hop_length=hop_length) # linear spectrogram
         return linear.T
 
+    def load_spectrogram(self, audio_path, win_length=400, sr=16000, hop_length=160, n_fft=512):
+        wavs = self.load_wav(audio_path, sr=sr).astype(self.dtype, copy=False) # VAD
+
+        linear_spect = self.lin_spectogram_from_wav(wavs, hop_length, win_length, n_fft)
+        mag, _ = startup.import_librosa().magphase(linear_spect)  # magnitude
+        mag_T = mag.T
+        return mag_T
+
     def load_data(self, audio_path, win_length=400, sr=16000, hop_length=160, n_fft=512):
+        mag_T = self.load_spectrogram(audio_path, win_length=win_length, sr=sr, hop_length=hop_length, n_fft=n_fft)
+        return self.split_spectrogram(mag_T, sr=sr, hop_length=hop_length)
+
+    def window_spec(self, sr=16000, hop_length=160):
         win_time = 300
         win_spec = win_time//(1000//(sr//hop_length)) # win_length in spectrum
         hop_spec = win_spec//2
+        return win_spec, hop_spec
 
-        wavs = np.array([])
-        wav = self.load_wav(audio_path, sr=sr) # VAD
-        wavs = np.concatenate((wavs, wav))
+    def normalize_spectrogram(self, mag_T):
+        # preprocessing, subtract mean, divided by time-wise var
+        # The statistics are computed per time step, so normalising the whole spectrogram before the windowing gives
+        # the same result as normalising each window
+        spec_mag = np.asarray(mag_T, dtype=self.dtype)
+        mu = np.mean(spec_mag, 0, keepdims=True)
+        std = np.std(spec_mag, 0, keepdims=True)
+        return (spec_mag - mu) / (std + 1e-5)
+
+    def split_spectrogram(self, mag_T, sr=16000, hop_length=160):
+        win_spec, hop_spec = self.window_spec(sr=sr, hop_length=hop_length)
 
-        linear_spect = self.lin_spectogram_from_wav(wavs, hop_length, win_length, n_fft)
-        mag, _ = librosa.magphase(linear_spect)  # magnitude
-        mag_T = mag.T
         freq, time = mag_T.shape
-        spec_mag = mag_T
+        if time < win_spec:
+            return np.empty((0, freq, win_spec), dtype=self.dtype)
+        n_windows = 1 + (time - win_spec) // hop_spec
 
-        utterance_specs = []
+        spec_mag = self.normalize_spectrogram(mag_T)
 
-        cur_spec = 0
-        while(True):
-            if(cur_spec+win_spec>time):
-                break
-            spec_mag = mag_T[:, cur_spec:cur_spec+win_spec]
+        # Overlapping windows as a strided (n_windows, freq, win_spec) view, copied once into a contiguous batch
+        utterance_specs = np.lib.stride_tricks.as_strided(
+            spec_mag, shape=(n_windows, freq, win_spec),
+            strides=(spec_mag.strides[1] * hop_spec, spec_mag.strides[0], spec_mag.strides[1]), writeable=False)
+        return np.ascontiguousarray(utterance_specs)
 
-            # preprocessing, subtract mean, divided by time-wise var
-            mu = np.mean(spec_mag, 0, keepdims=True)
-            std = np.std(spec_mag, 0, keepdims=True)
-            spec_mag = (spec_mag - mu) / (std + 1e-5)
-            utterance_specs.append(spec_mag)
-            cur_spec += hop_spec
-        return utterance_specs
+    def embed(self, utterance_specs):
+        feats = []
+        if (len(utterance_specs) > 0):
+            # All windows share the same (freq, time) shape, so they can be stacked and fed to the network in
+            # batches of at most max_batch_size windows instead of one predict call per window
+            specs = np.expand_dims(np.asarray(utterance_specs, dtype=self.dtype), -1)
+            feats = self.predictor.predict(specs, batch_size=self.max_batch_size)
+            feats = feats.astype(self.dtype, copy=False)
+        return feats
 
+    def embed_shared_backbone(self, mag_T, sr=16000, hop_length=160):
+        # Run the trunk on the whole normalised spectrogram, then pool the windows of the feature maps corresponding to
+        # the spectrogram windows of split_spectrogram
+        win_spec, hop_spec = self.window_spec(sr=sr, hop_length=hop_length)
+        freq, time = mag_T.shape
+        if time < win_spec:
+            return []
+        n_windows = 1 + (time - win_spec) // hop_spec
+
+        spec_mag = self.normalize_spectrogram(mag_T)
+        feature_maps = self.trunk_network.predict(spec_mag[None, :, :, None])
+        starts = np.minimum(np.round(np.arange(n_windows) * hop_spec / self.trunk_stride).astype(int),
+                            feature_maps[0].shape[2] - self.trunk_win)
+        windows = [np.stack([f[0, :, start:start + self.trunk_win] for start in starts]) for f in feature_maps]
+        feats = self.head_network.predict(windows, batch_size=self.max_batch_size)
+        return feats.astype(self.dtype, copy=False)
 
     def features_extractor(self, audio_path):
-        utterance_specs = self.load_data(audio_path)
-        feats = []
-        for spec in utterance_specs:
-            spec = np.expand_dims(np.expand_dims(spec, 0), -1)
-            v = self.network_eval.predict(spec)
-            feats += [v]
-        if (len(feats) > 0):
-            feats = np.array(feats)[:,0,:].astype(float)
-            feats = np.array(feats).astype(float)
-        return feats
+        if self.shared_backbone:
+            return self.embed_shared_backbone(self.load_spectrogram(audio_path))
+        return self.embed(self.load_data(audio_path))
+
+    def features_from_spectrogram(self, mag_T):
+        # mag_T is an already VAD-trimmed linear magnitude spectrogram with shape (freq, time)
+        if self.shared_backbone:
+            return self.embed_shared_backbone(mag_T)
+        return self.embed(self.split_spectrogram(mag_T))
@@ -29,10 +29,14 @@ class VladPooling(keras.engine.Layer):
     '''
     This layer follows the NetVlad, GhostVlad
     '''
-    def __init__(self, mode, k_centers, g_centers=0, **kwargs):
+    def __init__(self, mode, k_centers, g_centers=0, tflite_compatible=False, **kwargs):
         self.k_centers = k_centers
         self.g_centers = g_centers
         self.mode = mode
+        # The TensorFlow Lite converter (TOCO) supports no products of two computed tensors and fuses the l2
+        # normalization in an op normalizing all the clusters together, hence the compatible graph aggregates the
+        # residuals cluster by cluster and normalizes them explicitly (same weights, slower in TensorFlow)
+        self.tflite_compatible = tflite_compatible
         super(VladPooling, self).__init__(**kwargs)
 
     def build(self, input_shape):
@@ -57,16 +61,24 @@ class VladPooling(keras.engine.Layer):
         A = exp_cluster_score / K.sum(exp_cluster_score, axis=-1, keepdims = True)
 
         # Now, need to compute the residual, self.cluster: clusters x D
-        A = K.expand_dims(A, -1)    # A : bz x W x H x clusters x 1
-        feat_broadcast = K.expand_dims(feat, -2)    # feat_broadcast : bz x W x H x 1 x D
-        feat_res = feat_broadcast - self.cluster    # feat_res : bz x W x H x clusters x D
-        weighted_res = tf.multiply(A, feat_res)     # weighted_res : bz x W x H x clusters x D
-        cluster_res = K.sum(weighted_res, [1, 2])
+        # The weighted residuals are aggregated without materialising them (bz x W x H x clusters x D):
+        # sum_i A_ik (feat_i - c_k) = (A^T feat)_k - (sum_i A_ik) c_k
+        A = K.reshape(A, [K.shape(A)[0], -1, self.k_centers + self.g_centers])   # A : bz x WH x clusters
+        feat = K.reshape(feat, [K.shape(feat)[0], -1, int(num_features)])       # feat : bz x WH x D
+        if self.tflite_compatible:
+            cluster_res = K.stack([K.sum(A[:, :, k:k + 1] * feat, 1) for k in range(self.k_centers + self.g_centers)],
+                                  1)                                            # cluster_res : bz x clusters x D
+        else:
+            cluster_res = tf.matmul(A, feat, transpose_a=True)                  # cluster_res : bz x clusters x D
+        cluster_res = cluster_res - K.expand_dims(K.sum(A, 1), -1) * self.cluster
 
         if self.mode == 'gvlad':
             cluster_res = cluster_res[:, :self.k_centers, :]
 
-        cluster_l2 = K.l2_normalize(cluster_res, -1)
+        if self.tflite_compatible:
+            cluster_l2 = cluster_res * K.pow(K.maximum(K.sum(K.square(cluster_res), -1, keepdims=True), 1e-12), -0.5)
+        else:
+            cluster_l2 = K.l2_normalize(cluster_res, -1)
         outputs = K.reshape(cluster_l2, [-1, int(self.k_centers) * int(num_features)])
         return outputs
 
@@ -84,6 +96,8 @@ def vggvox_resnet2d_icassp(input_dim=(257, 250, 1), num_class=8631, mode='train'
     ghost_clusters=args.ghost_cluster
     bottleneck_dim=args.bottleneck_dim
     aggregation = args.aggregation_mode
+    # (the command line arguments of the original scripts have no TensorFlow Lite option)
+    tflite_compatible = getattr(args, 'tflite_compatible', False)
     mgpu = len(keras.backend.tensorflow_backend._get_available_gpus())
 
     if net == 'resnet34s':
@@ -121,7 +135,8 @@ def vggvox_resnet2d_icassp(input_dim=(257, 250, 1), num_class=8631, mode='train'
                                          kernel_regularizer=keras.regularizers.l2(weight_decay),
                                          bias_regularizer=keras.regularizers.l2(weight_decay),
                                          name='vlad_center_assignment')(x)
-        x = VladPooling(k_centers=vlad_clusters, mode='vlad', name='vlad_pool')([x_fc, x_k_center])
+        x = VladPooling(k_centers=vlad_clusters, mode='vlad', tflite_compatible=tflite_compatible,
+                        name='vlad_pool')([x_fc, x_k_center])
 
     elif aggregation == 'gvlad':
         x_k_center = keras.layers.Conv2D(vlad_clusters+ghost_clusters, (7, 1),
@@ -131,7 +146,8 @@ def vggvox_resnet2d_icassp(input_dim=(257, 250, 1), num_class=8631, mode='train'
                                          kernel_regularizer=keras.regularizers.l2(weight_decay),
                                          bias_regularizer=keras.regularizers.l2(weight_decay),
                                          name='gvlad_center_assignment')(x)
-        x = VladPooling(k_centers=vlad_clusters, g_centers=ghost_clusters, mode='gvlad', name='gvlad_pool')([x_fc, x_k_center])
+        x = VladPooling(k_centers=vlad_clusters, g_centers=ghost_clusters, mode='gvlad',
+                        tflite_compatible=tflite_compatible, name='gvlad_pool')([x_fc, x_k_center])
 
     else:
         raise IOError('==> unknown aggregation mode')
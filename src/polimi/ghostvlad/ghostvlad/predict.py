@@ -27,10 +27,7 @@ parser.add_argument('--aggregation_mode', default='gvlad', choices=['avg', 'vlad
 parser.add_argument('--loss', default='softmax', choices=['softmax', 'amsoftmax'], type=str)
 parser.add_argument('--test_type', default='normal', choices=['normal', 'hard', 'extend'], type=str)
 
-global args
-args = parser.parse_args()
-
-def main():
+def main(args):
 
     # gpu configuration
     toolkits.initialize_GPU(args)
@@ -92,4 +89,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # Parsed only when run as a script, importing the module does not read the command line
+    main(parser.parse_args())
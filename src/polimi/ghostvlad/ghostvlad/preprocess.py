@@ -28,9 +28,6 @@ parser.add_argument('--aggregation_mode', default='gvlad', choices=['avg', 'vlad
 parser.add_argument('--loss', default='softmax', choices=['softmax', 'amsoftmax'], type=str)
 parser.add_argument('--test_type', default='normal', choices=['normal', 'hard', 'extend'], type=str)
 
-global args
-args = parser.parse_args()
-
 def similar(matrix):  # calc speaker-embeddings similarity in pretty format output.
     ids = matrix.shape[0]
     for i in range(ids):
@@ -52,11 +49,7 @@ def load_wav(vid_path, sr):
     wav, sr_ret = librosa.load(vid_path, sr=sr)
     assert sr_ret == sr
 
-    intervals = librosa.effects.split(wav, top_db=20)
-    wav_output = []
-    for sliced in intervals:
-      wav_output.extend(wav[sliced[0]:sliced[1]])
-    wav_output = np.array(wav_output)
+    wav_output, _ = ut.trim_silence(wav, top_db=20)
     return wav_output
 
 def lin_spectogram_from_wav(wav, hop_length, win_length, n_fft=1024):
@@ -97,7 +90,7 @@ def load_data(path, split=False, win_length=400, sr=16000, hop_length=160, n_fft
 
     return utterances_spec
 
-def main():
+def main(args):
 
     # gpu configuration
     toolkits.initialize_GPU(args)
@@ -179,4 +172,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # Parsed only when run as a script, importing the module does not read the command line
+    main(parser.parse_args())
@@ -1,12 +1,13 @@
 # Third Party
-import librosa
 import numpy as np
 
+import startup
+
 # ===============================================
 #       code from Arsha for loading data.
 # ===============================================
 def load_wav(vid_path, sr, mode='train'):
-    wav, sr_ret = librosa.load(vid_path, sr=sr)
+    wav, sr_ret = startup.import_librosa().load(vid_path, sr=sr)
     assert sr_ret == sr
     if mode == 'train':
         extended_wav = np.append(wav, wav)
@@ -18,15 +19,24 @@ def load_wav(vid_path, sr, mode='train'):
         return extended_wav
 
 
+def trim_silence(wav, top_db=20):
+    # Remove the silent parts of the waveform (VAD), returns also the [start, end) sample intervals that were kept
+    intervals = startup.import_librosa().effects.split(wav, top_db=top_db)
+    if len(intervals) == 0:
+        return wav[:0], intervals
+    wav_output = np.concatenate([wav[start:end] for start, end in intervals])
+    return wav_output, intervals
+
+
 def lin_spectogram_from_wav(wav, hop_length, win_length, n_fft=1024):
-    linear = librosa.stft(wav, n_fft=n_fft, win_length=win_length, hop_length=hop_length) # linear spectrogram
+    linear = startup.import_librosa().stft(wav, n_fft=n_fft, win_length=win_length, hop_length=hop_length) # linear spectrogram
     return linear.T
 
 
 def load_data(path, win_length=400, sr=16000, hop_length=160, n_fft=512, spec_len=250, mode='train'):
     wav = load_wav(path, sr=sr, mode=mode)
     linear_spect = lin_spectogram_from_wav(wav, hop_length, win_length, n_fft)
-    mag, _ = librosa.magphase(linear_spect)  # magnitude
+    mag, _ = startup.import_librosa().magphase(linear_spect)  # magnitude
     mag_T = mag.T
     freq, time = mag_T.shape
     if mode == 'train':
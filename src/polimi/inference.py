@@ -0,0 +1,530 @@
+"""Inference-only model artifacts.
+
+Keras models can be exported to frozen TensorFlow graphs: variables are folded into constants and only the nodes
+needed to compute the outputs (at inference time) are kept, so optimizer, loss, metric and regularization nodes are
+dropped. Frozen graphs are served through FrozenGraphModel, which exposes the same predict method of Keras models.
+
+Keras models themselves can be served through KerasFunctionModel, which binds the input and output tensors to a
+backend function once, skipping the per-call overhead of Model.predict (validation, batching logic and feed dicts).
+
+Frozen graphs can be further converted to TensorFlow Lite flat buffers, served through TFLiteModel with the
+lightweight tflite_runtime interpreter when it is installed (and the one bundled with TensorFlow otherwise).
+
+Before the export (or instead of it), optimize_for_inference rewrites a Keras model removing the layers that at
+inference time are either no-ops or affine transformations that can be merged into the neighbouring layer, while
+masked_sequence_model rewrites a sequence model to run on batches of zero-padded sequences of different lengths.
+"""
+
+import inspect
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+import params
+
+FROZEN_GRAPH_EXTENSION = '.pb'
+TFLITE_EXTENSION = '.tflite'
+# Post-training quantization modes of TensorFlow Lite exports:
+#   - dynamic: int8 weights, activations quantized on the fly (no calibration);
+#   - int8: int8 weights and activations, whose ranges are calibrated on representative inputs;
+#   - float16: float16 weights (TensorFlow >= 1.15).
+QUANTIZATION_MODES = ('dynamic', 'int8', 'float16')
+# The padding of masked sequences is set to -MASK_FILL_VALUE before max poolings, lower than any activation
+MASK_FILL_VALUE = 1e9
+
+
+def _signature_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def export_frozen_graph(model, path, session=None):
+    """Export a Keras model to a frozen inference-only graph.
+
+    The model should be built after setting the Keras learning phase to 0 (inference), so that no training branch
+    is left in the graph. The names of input and output tensors are saved in a JSON file next to the graph.
+
+    Args:
+      model: Keras model to export.
+      path: Path of the output graph file (.pb).
+      session: TensorFlow session hosting the model variables, defaults to the Keras one.
+    """
+    import tensorflow as tf
+    import keras.backend as K
+
+    session = session if session is not None else K.get_session()
+    output_nodes = [t.op.name for t in model.outputs]
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        session, session.graph.as_graph_def(), output_nodes)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=output_nodes)
+    with open(path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with open(_signature_path(path), 'w') as f:
+        json.dump({'inputs': [t.name for t in model.inputs], 'outputs': [t.name for t in model.outputs]}, f)
+
+
+def _predict_in_batches(run, x, batch_size, n_outputs):
+    # Run the model on the whole input if it fits a batch, otherwise on each batch concatenating the outputs
+    x = x if isinstance(x, list) else [x]
+    n = len(x[0])
+    if batch_size is None or n <= batch_size:
+        outputs = run(x)
+    else:
+        batches = [run([x_i[i:i + batch_size] for x_i in x]) for i in range(0, n, batch_size)]
+        outputs = [np.concatenate(outputs) for outputs in zip(*batches)]
+    return outputs[0] if n_outputs == 1 else outputs
+
+
+class KerasFunctionModel(object):
+    """Keras model served through a backend function bound to its input and output tensors.
+
+    predict mirrors the Keras one, without the per-call overhead of Model.predict; the wrapped model is available as
+    the model attribute. Instances can be shared among threads: the backend function builds its session callable at the
+    first call, which is serialised, while later calls run concurrently.
+    """
+
+    def __init__(self, model):
+        import keras.backend as K
+
+        self.model = model
+        self.inputs = list(model.inputs)
+        self.outputs = list(model.outputs)
+        # Models whose behaviour depends on the learning phase are run in inference mode, as Model.predict does
+        self._feed_learning_phase = model.uses_learning_phase and not isinstance(K.learning_phase(), int)
+        self._function = K.function(
+            self.inputs + ([K.learning_phase()] if self._feed_learning_phase else []), self.outputs)
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _run(self, x):
+        x = x + [0] if self._feed_learning_phase else x
+        if not self._ready:
+            with self._lock:
+                outputs = self._function(x)
+                self._ready = True
+            return outputs
+        return self._function(x)
+
+    def predict(self, x, batch_size=None):
+        return _predict_in_batches(self._run, x, batch_size, len(self.outputs))
+
+
+def as_callable(model):
+    """Wrap Keras models in KerasFunctionModel, other models (already bound to their tensors) are returned as they are.
+    """
+    import keras
+
+    return KerasFunctionModel(model) if isinstance(model, keras.models.Model) else model
+
+
+class FrozenGraphModel(object):
+    """Model served from a frozen graph exported with export_frozen_graph.
+
+    The graph is imported in the graph of the runtime configuration, if given, otherwise each model owns its graph;
+    predict mirrors the Keras one, so instances can replace Keras models in the classifiers. Each model runs in its own
+    session without the Grappler optimizations: they would copy the graph, weights included, several times at the first
+    call (e.g., 5 GB of peak memory for the 275 MB of VGGish), and the constants are already folded at the export.
+    """
+
+    def __init__(self, path, session_config=None, runtime_config=None, verbose=False):
+        import tensorflow as tf
+
+        if verbose:
+            print("\tLoading frozen graph {}...".format(path))
+        self.path = path
+        with open(_signature_path(path)) as f:
+            signature = json.load(f)
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        if runtime_config is not None:
+            # Import in the shared graph, under a unique name scope (taken as is thanks to the trailing slash, the
+            # name is already marked as used)
+            self.graph = runtime_config.graph
+            if session_config is None:
+                session_config = runtime_config.session_config()
+            scope = self.graph.unique_name(os.path.splitext(os.path.basename(path))[0]) + '/'
+        else:
+            self.graph = tf.Graph()
+            scope = ''
+        config = tf.ConfigProto()
+        if session_config is not None:
+            config.CopyFrom(session_config)
+        config.graph_options.rewrite_options.disable_meta_optimizer = True
+        self.session = tf.Session(graph=self.graph, config=config)
+        # Inputs and outputs are returned by the import itself, whatever the scope actually used
+        with self.graph.as_default():
+            tensors = tf.import_graph_def(graph_def, name=scope,
+                                          return_elements=signature['inputs'] + signature['outputs'])
+        self.inputs = tensors[:len(signature['inputs'])]
+        self.outputs = tensors[len(signature['inputs']):]
+        # Callable bound to inputs and outputs, avoiding to build fetches and feeds at each run
+        self._callable = self.session.make_callable(self.outputs, feed_list=self.inputs)
+        if verbose:
+            print("\tFrozen graph loaded successfully.")
+
+    def _run(self, x):
+        return self._callable(*x)
+
+    def predict(self, x, batch_size=None):
+        return _predict_in_batches(self._run, x, batch_size, len(self.outputs))
+
+
+def export_tflite(model, path, input_shapes=None, quantization=None, representative_data=None, session=None):
+    """Export a Keras model to a TensorFlow Lite flat buffer.
+
+    The model is first frozen with export_frozen_graph, hence the same requirements on the learning phase apply.
+    TensorFlow Lite needs fully defined shapes at conversion time and the converter fixes the shapes of every tensor
+    (e.g., those of the reshapes in Conv1D), hence the served model takes samples of the shapes given here only:
+    variable length models (e.g., PATHOSnet) are served as frozen graphs instead.
+
+    Args:
+      model: Keras model to export.
+      path: Path of the output flat buffer file (.tflite).
+      input_shapes: List with the shape (batch axis excluded) of each input, unknown dimensions of the model inputs
+        are set to 1 by default.
+      quantization: One of QUANTIZATION_MODES, None to keep float32 weights.
+      representative_data: Function returning an iterable of model inputs (lists with an array per input, each with a
+        single sample), used to calibrate the activation ranges in int8 quantization.
+      session: TensorFlow session hosting the model variables, defaults to the Keras one.
+    """
+    import tensorflow as tf
+
+    if quantization is not None and quantization not in QUANTIZATION_MODES:
+        raise ValueError("Unknown quantization mode '{}', expected one of {}".format(quantization, QUANTIZATION_MODES))
+    if quantization == 'int8' and representative_data is None:
+        raise ValueError("int8 quantization requires representative data to calibrate the activations")
+    if input_shapes is None:
+        input_shapes = [[1 if d is None else d for d in t.shape.as_list()[1:]] for t in model.inputs]
+    input_names = [t.op.name for t in model.inputs]
+    output_names = [t.op.name for t in model.outputs]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        graph_path = os.path.join(tmp_dir, 'model' + FROZEN_GRAPH_EXTENSION)
+        export_frozen_graph(model, graph_path, session=session)
+        converter = tf.lite.TFLiteConverter.from_frozen_graph(
+            graph_path, input_names, output_names,
+            input_shapes={name: [1] + list(shape) for name, shape in zip(input_names, input_shapes)})
+        if quantization is not None:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == 'int8':
+            converter.representative_dataset = tf.lite.RepresentativeDataset(
+                lambda: ([np.asarray(x_i, dtype=np.float32) for x_i in x] for x in representative_data()))
+        elif quantization == 'float16':
+            if not hasattr(converter.target_spec, 'supported_types'):
+                raise ValueError("float16 quantization requires TensorFlow >= 1.15")
+            converter.target_spec.supported_types = [tf.float16]
+        flat_buffer = converter.convert()
+    with open(path, 'wb') as f:
+        f.write(flat_buffer)
+    # The interpreter identifies tensors by the name of the operation producing them
+    with open(_signature_path(path), 'w') as f:
+        json.dump({'inputs': input_names, 'outputs': output_names}, f)
+
+
+class TFLiteModel(object):
+    """Model served from a TensorFlow Lite flat buffer exported with export_tflite.
+
+    The interpreter processes one sample at a time, of the shapes given at the export; predict mirrors the Keras one,
+    so instances can replace Keras models in the classifiers. Interpreters are not thread safe, hence concurrent calls
+    are serialised.
+    """
+
+    def __init__(self, path, num_threads=None, runtime_config=None, verbose=False):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        if verbose:
+            print("\tLoading TensorFlow Lite model {}...".format(path))
+        self.path = path
+        with open(_signature_path(path)) as f:
+            signature = json.load(f)
+        # The interpreter has its own thread pool, sized as the intra-op one of the runtime unless given
+        if num_threads is None and runtime_config is not None and runtime_config.intra_op_parallelism_threads > 0:
+            num_threads = runtime_config.intra_op_parallelism_threads
+        # (older interpreters, e.g. TensorFlow 1.14, have no num_threads and use their default pool)
+        if num_threads is not None and 'num_threads' in inspect.signature(Interpreter.__init__).parameters:
+            self.interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        else:
+            self.interpreter = Interpreter(model_path=path)
+        self.interpreter.allocate_tensors()
+        inputs = {d['name']: d for d in self.interpreter.get_input_details()}
+        outputs = {d['name']: d for d in self.interpreter.get_output_details()}
+        self.inputs = [inputs[name] for name in signature['inputs']]
+        self.outputs = [outputs[name] for name in signature['outputs']]
+        self._lock = threading.Lock()
+        if verbose:
+            print("\tTensorFlow Lite model loaded successfully.")
+
+    def _run(self, x):
+        with self._lock:
+            return self._invoke(x)
+
+    def _invoke(self, x):
+        for detail, x_i in zip(self.inputs, x):
+            if x_i.shape != tuple(detail['shape']):
+                raise ValueError("Input '{}' of {} has shape {}, the model was exported for {}".format(
+                    detail['name'], self.path, x_i.shape, tuple(detail['shape'])))
+        for detail, x_i in zip(self.inputs, x):
+            self.interpreter.set_tensor(detail['index'], x_i.astype(detail['dtype'], copy=False))
+        self.interpreter.invoke()
+        return [self.interpreter.get_tensor(detail['index']) for detail in self.outputs]
+
+    def _empty_outputs(self):
+        # Outputs of an empty batch, with the (per sample) shapes of the output tensors
+        return [np.zeros((0,) + tuple(d['shape'][1:]), dtype=d['dtype']) for d in self.outputs]
+
+    def predict(self, x, batch_size=None):
+        x = [np.asarray(x_i) for x_i in x] if isinstance(x, list) else np.asarray(x)
+        if len(x[0] if isinstance(x, list) else x) == 0:
+            # Interpreters cannot run empty batches (e.g., the VGGish examples of audio shorter than one), unlike
+            # TensorFlow sessions
+            outputs = self._empty_outputs()
+            return outputs[0] if len(self.outputs) == 1 else outputs
+        return _predict_in_batches(self._run, x, 1, len(self.outputs))
+
+
+def model_nbytes(model):
+    """Memory taken by the weights of a model (Keras model, KerasFunctionModel or inference-only artifact), in bytes.
+
+    The size of inference-only artifacts is the one of their files, which hold the weights as constants.
+    """
+    import keras.backend as K
+
+    if isinstance(model, KerasFunctionModel):
+        model = model.model
+    if isinstance(model, (FrozenGraphModel, TFLiteModel)):
+        return os.path.getsize(model.path)
+    return int(sum(np.prod(K.int_shape(w)) * np.dtype(K.dtype(w)).itemsize for w in model.weights))
+
+
+# Inference-only artifacts, by file extension
+MODEL_BACKENDS = {
+    FROZEN_GRAPH_EXTENSION: FrozenGraphModel,
+    TFLITE_EXTENSION: TFLiteModel,
+}
+
+
+def _model_node(model, layer):
+    # Node connecting the layer inside the model graph (layers may be called also outside of it)
+    for node_index, node in enumerate(layer._inbound_nodes):
+        if layer.name + '_ib-' + str(node_index) in model._network_nodes:
+            return node
+    raise ValueError("Layer {} is not connected in model {}".format(layer.name, model.name))
+
+
+def _fold_batch_normalization(kernel, bias, batch_normalization):
+    # y = gamma * (conv(x) + bias - mean) / sqrt(var + eps) + beta, the scale is applied on output channels (last axis)
+    weights = batch_normalization.get_weights()
+    gamma = weights.pop(0) if batch_normalization.scale else 1.
+    beta = weights.pop(0) if batch_normalization.center else 0.
+    moving_mean, moving_variance = weights
+    scale = gamma / np.sqrt(moving_variance + batch_normalization.epsilon)
+    return kernel * scale, (bias - moving_mean) * scale + beta
+
+
+def optimize_for_inference(model, verbose=False):
+    """Rewrite a Keras model for inference.
+
+    The following rewrites are applied:
+      - dropout layers are removed, since they are identities at inference time;
+      - batch normalization layers following a convolution (or dense layer) without activation are folded into the
+        kernel and the bias of that layer;
+      - the PATHOSnet temperature scaling (the Lambda layer named params.TEMPERATURE_LAYER_NAME) is folded into the
+        kernel of the dense layer following it.
+    The other layers are shared with the input model.
+
+    Args:
+      model: Keras model to optimise.
+      verbose: Whether to be verbose or not.
+
+    Returns:
+      New Keras model computing (up to floating point errors) the same outputs of model in inference mode.
+    """
+    from keras.layers import BatchNormalization, Conv1D, Conv2D, Dense, Dropout, InputLayer, Input, Lambda, \
+        SpatialDropout1D, SpatialDropout2D
+    from keras.models import Model
+
+    if verbose:
+        print("\tOptimising {} for inference...".format(model.name))
+    nodes = {layer.name: _model_node(model, layer) for layer in model.layers}
+    consumers = {layer.name: 0 for layer in model.layers}
+    for node in nodes.values():
+        for inbound_layer in node.inbound_layers:
+            consumers[inbound_layer.name] += 1
+
+    skipped = {layer.name for layer in model.layers if isinstance(layer, (Dropout, SpatialDropout1D, SpatialDropout2D))}
+    folded = {}  # Layer name -> kernel and bias with the folded operations
+
+    def source(layer):
+        # Layer feeding the given one once the removed layers are bypassed, if it feeds only the given one
+        src = nodes[layer.name].inbound_layers
+        while len(src) == 1 and src[0].name in skipped and consumers[src[0].name] == 1:
+            src = nodes[src[0].name].inbound_layers
+        return src[0] if len(src) == 1 and consumers[src[0].name] == 1 else None
+
+    def kernel_and_bias(layer):
+        if layer.name in folded:
+            return folded[layer.name]
+        weights = layer.get_weights()
+        return weights[0], weights[1] if layer.use_bias else np.zeros(weights[0].shape[-1], dtype=weights[0].dtype)
+
+    for layer in model.layers:
+        src = source(layer) if not isinstance(layer, InputLayer) else None
+        if isinstance(layer, BatchNormalization):
+            if isinstance(src, (Conv1D, Conv2D, Dense)) and src.get_config()['activation'] == 'linear' and \
+                    layer.axis in (-1, len(layer.input_shape) - 1) and \
+                    src.get_config().get('data_format', 'channels_last') == 'channels_last':
+                folded[src.name] = _fold_batch_normalization(*kernel_and_bias(src), batch_normalization=layer)
+                skipped.add(layer.name)
+        elif isinstance(layer, Dense):
+            if isinstance(src, Lambda) and src.name == params.TEMPERATURE_LAYER_NAME:
+                kernel, bias = kernel_and_bias(layer)
+                folded[layer.name] = (kernel / params.TEMPERATURE, bias)
+                skipped.add(src.name)
+    if verbose:
+        print("\t{} layers removed, {} layers folded.".format(len(skipped), len(folded)))
+
+    # Rebuild the graph
+    tensors = {}  # Input model tensor id -> output model tensor
+    for layer in model.layers:
+        node = nodes[layer.name]
+        if isinstance(layer, InputLayer):
+            outputs = Input(batch_shape=layer.batch_input_shape, dtype=layer.dtype, name=layer.name)
+        else:
+            inputs = [tensors[id(t)] for t in node.input_tensors]
+            inputs = inputs[0] if len(inputs) == 1 else inputs
+            if layer.name in skipped:
+                outputs = inputs
+            elif layer.name in folded:
+                config = layer.get_config()
+                config.update(name=layer.name + '_folded', use_bias=True)
+                folded_layer = layer.__class__.from_config(config)
+                outputs = folded_layer(inputs)
+                folded_layer.set_weights(list(folded[layer.name]))
+            else:
+                outputs = layer(inputs)
+        outputs = outputs if isinstance(outputs, list) else [outputs]
+        for tensor, new_tensor in zip(node.output_tensors, outputs):
+            tensors[id(tensor)] = new_tensor
+
+    optimized_model = Model([tensors[id(t)] for t in model.inputs], [tensors[id(t)] for t in model.outputs],
+                            name=model.name + '_optimized')
+    if verbose:
+        print("\t{} optimised successfully.".format(model.name))
+    return optimized_model
+
+
+def masked_sequence_model(model, verbose=False):
+    """Rewrite a Keras sequence model (e.g., PATHOSnet) to run on batches of zero-padded sequences of different lengths.
+
+    The rewritten model takes, after the inputs of model, a mask for each sequence input (inputs with shape
+    (batch, time, features)): a float array with shape (batch, time, 1), 1 on the steps of the sequence and 0 on the
+    padding. The padding is set to zero before each convolution and to MASK_FILL_VALUE before each max pooling, as the
+    implicit padding of the unpadded sequences, and it is left out of the global poolings, so the outputs match (up to
+    floating point errors) the ones of model on each unpadded sequence.
+    Supported layers on sequences are convolutions with stride 1 and 'same' or 'causal' padding, max poolings with
+    'same' padding and pool size equal to the stride (at most 2, for larger pools the padding TensorFlow adds before
+    the sequence depends on its length), global average and max poolings and the layers working step by step (batch
+    normalization, activations, dropout, dense layers and merges). The layers are shared with the input model.
+
+    Args:
+      model: Keras model to rewrite.
+      verbose: Whether to be verbose or not.
+
+    Returns:
+      New Keras model, with the mask inputs after the ones of model.
+    """
+    import keras.backend as K
+    from keras.layers import Activation, Add, Average, BatchNormalization, Concatenate, Conv1D, Dense, Dropout, \
+        GlobalAveragePooling1D, GlobalMaxPooling1D, Input, InputLayer, Lambda, Maximum, MaxPooling1D, Minimum, \
+        Multiply, SpatialDropout1D, Subtract
+    from keras.models import Model
+
+    step_wise_layers = (Activation, Add, Average, BatchNormalization, Dense, Dropout, Maximum, Minimum, Multiply,
+                        SpatialDropout1D, Subtract)
+
+    def fill(x, mask):
+        return Lambda(lambda t: t[0] * t[1] - (1. - t[1]) * MASK_FILL_VALUE)([x, mask])
+
+    if verbose:
+        print("\tMasking {} sequences...".format(model.name))
+    nodes = {layer.name: _model_node(model, layer) for layer in model.layers}
+    tensors = {}  # Input model tensor id -> output model tensor
+    masks = {}  # Input model tensor id -> mask of the output model tensor, for sequences
+    pooled_masks = {}  # Mask id and pool size -> pooled mask, so that parallel poolings (e.g., shortcuts) share it
+    for layer in model.layers:
+        node = nodes[layer.name]
+        output_mask = None
+        if isinstance(layer, InputLayer):
+            outputs = Input(batch_shape=layer.batch_input_shape, dtype=layer.dtype, name=layer.name)
+            if len(layer.batch_input_shape) == 3:
+                output_mask = Input(shape=(None, 1), name=layer.name + '_mask')
+        else:
+            inputs = [tensors[id(t)] for t in node.input_tensors]
+            input_masks = [masks.get(id(t)) for t in node.input_tensors]
+            mask = input_masks[0]
+            if all(m is None for m in input_masks):
+                outputs = layer(inputs[0] if len(inputs) == 1 else inputs)
+            elif any(m is not mask for m in input_masks):
+                raise ValueError("Layer {} merges sequences with different masks".format(layer.name))
+            elif isinstance(layer, Conv1D) and layer.strides == (1,) and layer.padding in ('same', 'causal'):
+                outputs = layer(Multiply()([inputs[0], mask]))
+                output_mask = mask
+            elif isinstance(layer, MaxPooling1D) and layer.padding == 'same' and layer.pool_size == layer.strides and \
+                    layer.pool_size[0] <= 2:
+                outputs = layer(fill(inputs[0], mask))
+                key = (id(mask), layer.pool_size)
+                if key not in pooled_masks:
+                    pooled_masks[key] = MaxPooling1D(layer.pool_size, layer.strides, padding='same')(mask)
+                output_mask = pooled_masks[key]
+            elif isinstance(layer, GlobalAveragePooling1D):
+                outputs = Lambda(lambda t: K.sum(t[0] * t[1], axis=1) / K.sum(t[1], axis=1))([inputs[0], mask])
+            elif isinstance(layer, GlobalMaxPooling1D):
+                outputs = Lambda(lambda x: K.max(x, axis=1))(fill(inputs[0], mask))
+            elif isinstance(layer, step_wise_layers) or (isinstance(layer, Concatenate) and layer.axis in (-1, 2)):
+                outputs = layer(inputs[0] if len(inputs) == 1 else inputs)
+                output_mask = mask
+            else:
+                raise ValueError("Layer {} ({}) is not supported on masked sequences".format(
+                    layer.name, layer.__class__.__name__))
+        outputs = outputs if isinstance(outputs, list) else [outputs]
+        for tensor, new_tensor in zip(node.output_tensors, outputs):
+            tensors[id(tensor)] = new_tensor
+            if output_mask is not None:
+                masks[id(tensor)] = output_mask
+
+    mask_inputs = [masks[id(t)] for t in model.inputs if id(t) in masks]
+    masked_model = Model([tensors[id(t)] for t in model.inputs] + mask_inputs,
+                         [tensors[id(t)] for t in model.outputs], name=model.name + '_masked')
+    if verbose:
+        print("\t{} masked successfully ({} sequence inputs).".format(model.name, len(mask_inputs)))
+    return masked_model
+
+
+def load_model(weights_path, build_fn, optimize=False, runtime_config=None, verbose=False):
+    """Load a model for inference.
+
+    Args:
+      weights_path: Path to either the h5 weights of the Keras model or an inference-only artifact, whose extension
+        (one of the keys of MODEL_BACKENDS) selects the backend serving it.
+      build_fn: Function building the Keras model given the weights path, used when weights_path is h5 weights.
+      optimize: Whether to apply optimize_for_inference to the Keras model.
+      runtime_config: runtime.RuntimeConfig hosting the model; Keras models are built in the default graph, hence the
+        caller should build them inside the runtime scope.
+      verbose: Whether to be verbose or not.
+
+    Returns:
+      An object with a Keras-like predict method.
+    """
+    extension = os.path.splitext(weights_path)[1]
+    if extension in MODEL_BACKENDS:
+        return MODEL_BACKENDS[extension](weights_path, runtime_config=runtime_config, verbose=verbose)
+    model = build_fn(weights_path)
+    if optimize:
+        model = optimize_for_inference(model, verbose=verbose)
+    return model
@@ -15,8 +15,20 @@
 
 """Defines routines to compute mel spectrogram features from audio waveform."""
 
+import functools
+import threading
+
 import numpy as np
 
+try:
+  from scipy.fft import rfft as _rfft  # Keeps single precision inputs in single precision
+except ImportError:
+  _rfft = np.fft.rfft
+
+# Longest buffer of windowed frames kept by a FeaturePlan for each thread (60 s
+# of audio with a 10 ms hop)
+MAX_BUFFERED_FRAMES = 6000
+
 
 def frame(data, window_length, hop_length):
   """Convert array into a sequence of successive possibly overlapping frames.
@@ -68,6 +80,13 @@ def periodic_hann(window_length):
                              np.arange(window_length)))
 
 
+@functools.lru_cache(maxsize=None)
+def _cached_periodic_hann(window_length):
+  window = periodic_hann(window_length)
+  window.flags.writeable = False
+  return window
+
+
 def stft_magnitude(signal, fft_length,
                    hop_length=None,
                    window_length=None):
@@ -87,7 +106,7 @@ def stft_magnitude(signal, fft_length,
   # Apply frame window to each frame. We use a periodic Hann (cosine of period
   # window_length) instead of the symmetric Hann of np.hanning (period
   # window_length-1).
-  window = periodic_hann(window_length)
+  window = _cached_periodic_hann(window_length)
   windowed_frames = frames * window
   return np.abs(np.fft.rfft(windowed_frames, int(fft_length)))
 
@@ -189,6 +208,140 @@ def spectrogram_to_mel_matrix(num_mel_bins=20,
   return mel_weights_matrix
 
 
+class FeaturePlan(object):
+  """Precomputed constants to compute log mel spectrograms with a given setup.
+
+  The analysis window and the mel weights matrix are computed once at
+  construction, while the buffer of windowed frames is kept across calls (one
+  per thread) and grown only when a longer signal is processed, up to
+  max_buffered_frames frames: longer signals get a buffer of their own, released
+  after the call, so that a single long input does not pin its memory for the
+  life of the thread.  All the computations are carried out with the floating
+  point type of the plan.  Use get_plan to retrieve a shared instance.
+  """
+
+  def __init__(self,
+               audio_sample_rate,
+               window_length_samples,
+               hop_length_samples,
+               fft_length,
+               num_mel_bins=20,
+               lower_edge_hertz=125.0,
+               upper_edge_hertz=3800.0,
+               dtype=np.float64,
+               max_buffered_frames=MAX_BUFFERED_FRAMES):
+    self.audio_sample_rate = audio_sample_rate
+    self.window_length_samples = window_length_samples
+    self.hop_length_samples = hop_length_samples
+    self.fft_length = fft_length
+    self.dtype = np.dtype(dtype)
+    self.max_buffered_frames = max_buffered_frames
+    self.window = periodic_hann(window_length_samples).astype(self.dtype)
+    self.mel_weights_matrix = spectrogram_to_mel_matrix(
+        num_mel_bins=num_mel_bins,
+        num_spectrogram_bins=fft_length // 2 + 1,
+        audio_sample_rate=audio_sample_rate,
+        lower_edge_hertz=lower_edge_hertz,
+        upper_edge_hertz=upper_edge_hertz).astype(self.dtype)
+    self.window.flags.writeable = False
+    self.mel_weights_matrix.flags.writeable = False
+    self._buffers = threading.local()
+
+  def _frames_buffer(self, num_frames):
+    if num_frames > self.max_buffered_frames:
+      return np.empty((num_frames, self.window_length_samples),
+                      dtype=self.dtype)
+    buffer = getattr(self._buffers, 'frames', None)
+    if buffer is None or buffer.shape[0] < num_frames:
+      buffer = np.empty((num_frames, self.window_length_samples),
+                        dtype=self.dtype)
+      self._buffers.frames = buffer
+    return buffer[:num_frames]
+
+  def stft_magnitude(self, signal):
+    """See stft_magnitude, with the setup of this plan."""
+    frames = frame(signal, self.window_length_samples, self.hop_length_samples)
+    windowed_frames = self._frames_buffer(frames.shape[0])
+    np.multiply(frames, self.window, out=windowed_frames, casting='same_kind')
+    return np.abs(_rfft(windowed_frames, int(self.fft_length))).astype(
+        self.dtype, copy=False)
+
+  def magnitude_to_log_mel(self, spectrogram, log_offset=0.0):
+    """See magnitude_to_log_mel, with the setup of this plan."""
+    mel_spectrogram = np.dot(np.asarray(spectrogram, dtype=self.dtype),
+                             self.mel_weights_matrix)
+    mel_spectrogram += log_offset
+    return np.log(mel_spectrogram, out=mel_spectrogram)
+
+  def log_mel_spectrogram(self, data, log_offset=0.0):
+    """See log_mel_spectrogram, with the setup of this plan."""
+    return self.magnitude_to_log_mel(self.stft_magnitude(data),
+                                     log_offset=log_offset)
+
+
+@functools.lru_cache(maxsize=None)
+def get_plan(audio_sample_rate=8000,
+             window_length_secs=0.025,
+             hop_length_secs=0.010,
+             fft_length=None,
+             num_mel_bins=20,
+             lower_edge_hertz=125.0,
+             upper_edge_hertz=3800.0,
+             dtype='float64'):
+  """Return the (cached) FeaturePlan for the given setup.
+
+  Args:
+    audio_sample_rate: The sampling rate of the waveforms to analyse.
+    window_length_secs: Duration of each window to analyze.
+    hop_length_secs: Advance between successive analysis windows.
+    fft_length: Size of the FFT to apply, defaults to the smallest power of 2
+      not shorter than the window.
+    num_mel_bins: How many bands in the resulting mel spectrum.
+    lower_edge_hertz: Lower bound on the frequencies to be included in the mel
+      spectrum.
+    upper_edge_hertz: The desired top edge of the highest frequency band.
+    dtype: Floating point type of the computations.
+
+  Returns:
+    A FeaturePlan instance, shared by all the callers with the same setup.
+  """
+  window_length_samples = int(round(audio_sample_rate * window_length_secs))
+  hop_length_samples = int(round(audio_sample_rate * hop_length_secs))
+  if fft_length is None:
+    fft_length = 2 ** int(np.ceil(np.log(window_length_samples) / np.log(2.0)))
+  return FeaturePlan(audio_sample_rate,
+                     window_length_samples,
+                     hop_length_samples,
+                     fft_length,
+                     num_mel_bins=num_mel_bins,
+                     lower_edge_hertz=lower_edge_hertz,
+                     upper_edge_hertz=upper_edge_hertz,
+                     dtype=dtype)
+
+
+def magnitude_to_log_mel(spectrogram,
+                         audio_sample_rate=8000,
+                         log_offset=0.0,
+                         **kwargs):
+  """Convert an STFT magnitude to a log magnitude mel-frequency spectrogram.
+
+  Args:
+    spectrogram: 2D np.array of (num_frames, num_spectrogram_bins) STFT
+      magnitudes, as returned by stft_magnitude.
+    audio_sample_rate: The sampling rate of the analysed waveform.
+    log_offset: Add this to values when taking log to avoid -Infs.
+    **kwargs: Additional arguments to pass to spectrogram_to_mel_matrix.
+
+  Returns:
+    2D np.array of (num_frames, num_mel_bins) consisting of log mel filterbank
+    magnitudes for successive frames.
+  """
+  mel_spectrogram = np.dot(spectrogram, spectrogram_to_mel_matrix(
+      num_spectrogram_bins=spectrogram.shape[1],
+      audio_sample_rate=audio_sample_rate, **kwargs))
+  return np.log(mel_spectrogram + log_offset)
+
+
 def log_mel_spectrogram(data,
                         audio_sample_rate=8000,
                         log_offset=0.0,
@@ -197,6 +350,9 @@ def log_mel_spectrogram(data,
                         **kwargs):
   """Convert waveform to a log magnitude mel-frequency spectrogram.
 
+  The constants of the computation are taken from the cached FeaturePlan of
+  the given setup (see get_plan).
+
   Args:
     data: 1D np.array of waveform data.
     audio_sample_rate: The sampling rate of data.
@@ -209,15 +365,8 @@ def log_mel_spectrogram(data,
     2D np.array of (num_frames, num_mel_bins) consisting of log mel filterbank
     magnitudes for successive frames.
   """
-  window_length_samples = int(round(audio_sample_rate * window_length_secs))
-  hop_length_samples = int(round(audio_sample_rate * hop_length_secs))
-  fft_length = 2 ** int(np.ceil(np.log(window_length_samples) / np.log(2.0)))
-  spectrogram = stft_magnitude(
-      data,
-      fft_length=fft_length,
-      hop_length=hop_length_samples,
-      window_length=window_length_samples)
-  mel_spectrogram = np.dot(spectrogram, spectrogram_to_mel_matrix(
-      num_spectrogram_bins=spectrogram.shape[1],
-      audio_sample_rate=audio_sample_rate, **kwargs))
-  return np.log(mel_spectrogram + log_offset)
+  plan = get_plan(audio_sample_rate=audio_sample_rate,
+                  window_length_secs=window_length_secs,
+                  hop_length_secs=hop_length_secs,
+                  **kwargs)
+  return plan.log_mel_spectrogram(data, log_offset=log_offset)
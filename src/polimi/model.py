@@ -2,8 +2,16 @@ from keras.layers import Add, BatchNormalization, Input, Dense, Activation, Conc
     GlobalAveragePooling1D, SpatialDropout1D, Conv2D, MaxPool2D, Flatten, Lambda
 from keras.models import Model
 from keras.optimizers import RMSprop
+import h5py
+import json
 import params
 
+# Names of the VGGish fully connected layers, a factorized layer is preceded by a linear one named with the suffix
+# '_low_rank' projecting its inputs on the rank dimensions
+VGGISH_DENSE_LAYER_NAMES = ('vggish_fc1', 'vggish_fc2', 'vggish_fc3')
+# Attribute of the weights files hosting the ranks of the VGGish fully connected layers
+VGGISH_DENSE_RANKS_ATTRIBUTE = 'vggish_dense_ranks'
+
 
 def SimpleBlock(inputs, hidden_features=128, kernel_dim=3):
     x = inputs
@@ -37,7 +45,7 @@ def ResBlock(inputs, hidden_features=128, kernel_dim=3):
     return x
 
 
-def get_pathosnet_voice(pathosnet_weights_path=None, verbose=False):
+def get_pathosnet_voice(pathosnet_weights_path=None, compile_model=False, verbose=False):
     if verbose:
         print("\tInstantiating PATHOSnet Voice...")
 
@@ -77,7 +85,7 @@ def get_pathosnet_voice(pathosnet_weights_path=None, verbose=False):
 
     # Features Concatenation from models -------------------------------------------------------------------------------
     x = Concatenate(axis=1)([x_vggish, x_ghost])
-    x = Lambda(lambda h: h / params.TEMPERATURE)(x)
+    x = Lambda(lambda h: h / params.TEMPERATURE, name=params.TEMPERATURE_LAYER_NAME)(x)
 
     # OUTPUT
     outputs = Dense(4, activation="softmax")(x)
@@ -91,14 +99,16 @@ def get_pathosnet_voice(pathosnet_weights_path=None, verbose=False):
         model.trainable = False
         if verbose:
             print("\tPATHOSnet weights loaded successfully.")
-    model.compile(loss='categorical_crossentropy', optimizer=RMSprop(lr=0.001, rho=0.9, decay=0.0),
-                  metrics=['categorical_accuracy'])
+    # The optimizer and the metrics are needed only for training
+    if compile_model:
+        model.compile(loss='categorical_crossentropy', optimizer=RMSprop(lr=0.001, rho=0.9, decay=0.0),
+                      metrics=['categorical_accuracy'])
     if verbose:
         print("\tPATHOSnet instantiated successfully.")
     return model
 
 
-def get_pathosnet_multimodal(pathosnet_weights_path=None, verbose=False):
+def get_pathosnet_multimodal(pathosnet_weights_path=None, compile_model=False, verbose=False):
     if verbose:
         print("\tInstantiating PATHOSnet Multimodal...")
 
@@ -169,7 +179,7 @@ def get_pathosnet_multimodal(pathosnet_weights_path=None, verbose=False):
 
     # Features Concatenation from models -------------------------------------------------------------------------------
     x = Concatenate(axis=1)([x_vggish, x_ghost])
-    x = Lambda(lambda h: h / params.TEMPERATURE)(x)
+    x = Lambda(lambda h: h / params.TEMPERATURE, name=params.TEMPERATURE_LAYER_NAME)(x)
 
     # OUTPUT
     outputs = Dense(4, activation="softmax")(x)
@@ -183,16 +193,48 @@ def get_pathosnet_multimodal(pathosnet_weights_path=None, verbose=False):
         model.trainable = False
         if verbose:
             print("\tPATHOSnet weights loaded successfully.")
-    model.compile(loss='categorical_crossentropy', optimizer=RMSprop(lr=0.001, rho=0.9, decay=0.0),
-                  metrics=['categorical_accuracy'])
+    # The optimizer and the metrics are needed only for training
+    if compile_model:
+        model.compile(loss='categorical_crossentropy', optimizer=RMSprop(lr=0.001, rho=0.9, decay=0.0),
+                      metrics=['categorical_accuracy'])
     if verbose:
         print("\tPATHOSnet instantiated successfully.")
     return model
 
 
-def get_vggish(vggish_weights_path, verbose=False):
+def LowRankDense(inputs, units, activation=None, rank=None, name=None):
+    x = inputs
+
+    # Full rank (kernel: inputs x units) or factorized (inputs x rank, rank x units) layer
+    if rank is not None:
+        x = Dense(rank, use_bias=False, name=name + '_low_rank')(x)
+    x = Dense(units, activation=activation, name=name)(x)
+
+    return x
+
+
+def get_vggish_dense_ranks(vggish_weights_path):
+    # Ranks of the fully connected layers stored in a VGGish weights file, None for the full rank layers
+    with h5py.File(vggish_weights_path, 'r') as f:
+        if VGGISH_DENSE_RANKS_ATTRIBUTE not in f.attrs:
+            return (None,) * len(VGGISH_DENSE_LAYER_NAMES)
+        return tuple(json.loads(f.attrs[VGGISH_DENSE_RANKS_ATTRIBUTE]))
+
+
+def save_vggish_weights(vggish, vggish_weights_path, dense_ranks=None):
+    vggish.save_weights(vggish_weights_path)
+    with h5py.File(vggish_weights_path, 'a') as f:
+        f.attrs[VGGISH_DENSE_RANKS_ATTRIBUTE] = json.dumps(
+            list(dense_ranks) if dense_ranks is not None else [None] * len(VGGISH_DENSE_LAYER_NAMES))
+
+
+def get_vggish(vggish_weights_path=None, dense_ranks=None, verbose=False):
     if verbose:
         print("\tInstantiating VGGish...")
+    # The ranks of the fully connected layers are read from the weights file, unless given
+    if dense_ranks is None:
+        dense_ranks = get_vggish_dense_ranks(vggish_weights_path) if vggish_weights_path is not None else \
+            (None,) * len(VGGISH_DENSE_LAYER_NAMES)
     kernel = 3
     inputs = Input(shape=(96, 64, 1))
     x = Conv2D(64, kernel, strides=1, padding='same', activation='relu',trainable=False)(inputs)
@@ -206,17 +248,18 @@ def get_vggish(vggish_weights_path, verbose=False):
     x = Conv2D(512, kernel, strides=1, padding='same', activation='relu',trainable=False, name="vgg_to_train")(x)
     x = MaxPool2D(pool_size=2, strides=2, padding='same')(x)
     x = Flatten()(x)
-    x = Dense(4096, activation="relu")(x)
-    x = Dense(4096, activation="relu")(x)
-    outputs = Dense(128, activation="softmax")(x)
+    x = LowRankDense(x, 4096, activation="relu", rank=dense_ranks[0], name=VGGISH_DENSE_LAYER_NAMES[0])
+    x = LowRankDense(x, 4096, activation="relu", rank=dense_ranks[1], name=VGGISH_DENSE_LAYER_NAMES[1])
+    outputs = LowRankDense(x, 128, activation="softmax", rank=dense_ranks[2], name=VGGISH_DENSE_LAYER_NAMES[2])
     vggish = Model(inputs, outputs)
     # vggish = vggish_keras.get_vggish_keras()
-    if verbose:
-        print("\tLoading VGGish weights...")
-    vggish.load_weights(vggish_weights_path)
-    vggish.trainable = False
-    if verbose:
-        print("\tVGGish weights loaded successfully.")
+    if vggish_weights_path is not None:
+        if verbose:
+            print("\tLoading VGGish weights...")
+        vggish.load_weights(vggish_weights_path)
+        vggish.trainable = False
+        if verbose:
+            print("\tVGGish weights loaded successfully.")
     if verbose:
         print("\tVGGish instantiated successfully.")
     return vggish
@@ -16,6 +16,8 @@
 """Global parameters for the VGGish model.
 """
 
+import os
+
 # Architectural constants.
 NUM_FRAMES = 96  # Frames in input mel-spectrogram patch.
 NUM_BANDS = 64  # Frequency bands in input mel-spectrogram patch.
@@ -55,9 +57,50 @@ PATHOSnet parameters
 """
 
 TEMPERATURE = 96.0
+TEMPERATURE_LAYER_NAME = 'temperature'
 
 LABELS = ['Happiness', 'Anger', 'Sadness', 'Neutral']
 BINARY_LABELS = ['Positive', 'Negative']
 
 LABELS_CONVERSION_DICT = {'Positive': ['Happiness', 'Neutral'], 'Negative': ['Anger', 'Sadness']}
 BINARY_CONVERSION_DICT = {'Happiness': 'Positive', 'Anger': 'Negative', 'Sadness': 'Negative', 'Neutral': 'Positive'}
+
+"""
+Feature pipeline parameters
+"""
+
+# Floating point type used by the feature extraction pipeline (waveforms, spectrograms and network inputs).
+# Set it to 'float64' to reproduce the original double precision computations, e.g. for reproducibility checks.
+FEATURES_DTYPE = 'float32'
+
+# Quality/speed tier of the polyphase resampler used when the audio is not sampled at SAMPLE_RATE
+# (one of 'fast', 'default' and 'best', see resampling.QUALITY_TIERS)
+RESAMPLING_QUALITY = 'default'
+
+"""
+TensorFlow runtime parameters
+"""
+
+# Threads of the TensorFlow pools running the ops (intra-op) and the independent ops (inter-op) of the models,
+# 0 lets TensorFlow use all the cores; keep them low when the process runs other CPU bound threads (e.g., librosa)
+INTRA_OP_PARALLELISM_THREADS = 0
+INTER_OP_PARALLELISM_THREADS = 0
+# Whether to hide GPUs from TensorFlow
+CPU_ONLY = True
+
+"""
+Startup parameters
+"""
+
+# Directory where numba caches the functions it compiles (e.g., the librosa ones), so that they are not compiled again
+# after each restart; None keeps the numba default (next to the sources of the package, often not writable)
+NUMBA_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pathosnet', 'numba')
+
+"""
+Batching parameters
+"""
+
+# Longest wait (in seconds) of the batching scheduler for other requests after the first one of a batch, and largest
+# number of requests (utterances) in a batch (see batching.BatchingClassifier)
+BATCH_MAX_WAIT = 0.01
+BATCH_MAX_SIZE = 8
@@ -1,78 +1,264 @@
-from model import get_pathosnet_multimodal, get_pathosnet_voice, get_vggish
-from ghostvlad.ghostvlad.ghostvlad_features_extractor import FeaturesExtractor
+import audio_io
+import registry as registry_module
+import spectrogram
 import utils 
 import params
 import numpy as np
 
 
-def pathosnet_multimodal_classifier(pathosnet_weights_path, word_embeddings_path,
-                                    vggish_weights_path, ghostvlad_weights_path, verbose=False):
+def _extract_network_inputs(waveform, ghostvlad, shared_stft=False):
+    if shared_stft:
+        # Single STFT for both networks, GhostVLAD frames are selected from it according to the VAD
+        vggish_examples, ghostvlad_spectrogram = spectrogram.extract_spectrograms(waveform)
+    else:
+        vggish_examples = utils.waveform_to_examples(waveform, params.SAMPLE_RATE, dtype=waveform.dtype)
+        ghostvlad_spectrogram = ghostvlad.load_spectrogram(waveform)
+    # GhostVLAD windows, or already the GhostVLAD features in shared backbone mode (the trunk runs on the whole
+    # spectrogram)
+    if ghostvlad.shared_backbone:
+        return vggish_examples, ghostvlad.embed_shared_backbone(ghostvlad_spectrogram)
+    return vggish_examples, ghostvlad.split_spectrogram(ghostvlad_spectrogram)
 
-    # Load models
-    pathosnet = get_pathosnet_multimodal(pathosnet_weights_path=pathosnet_weights_path, verbose=verbose)
-    vggish = get_vggish(vggish_weights_path, verbose=verbose)
-    ghostvlad = FeaturesExtractor(ghostvlad_weights_path, verbose=verbose)
-    embedder = utils.Embedder(word_embeddings_path)
 
-    # Use closures to keep models loaded
-    def classifier(audio_file_path, transcription):
-        # Prepare the data
-        # GhostVlad features
-        input_ghost = ghostvlad.features_extractor(audio_file_path)
-        if (len(input_ghost) == 0):
-            input_ghost = np.zeros((1, 512))
-        input_ghost = np.expand_dims(input_ghost, axis=0)
-        # VGGish features
-        input_vggish = vggish.predict(np.expand_dims(utils.wavfile_to_examples(audio_file_path), axis=-1))
-        if (len(input_vggish) == 0):
-            input_vggish = np.zeros((1, 128))
-        input_vggish = np.expand_dims(input_vggish, axis=0)
-        # Word embeddings
-        input_text = np.asarray(utils.extract_text_features(transcription, embedder))
-        if (len(input_text) == 0):
-            input_text = np.zeros((1, 300))
-        input_text = np.expand_dims(input_text, axis=0)
+def as_sequence(features, size):
+    # Batch of a single sequence, with a zero vector in place of an empty sequence (e.g., audio shorter than a window)
+    if (len(features) == 0):
+        features = np.zeros((1, size), dtype=params.FEATURES_DTYPE)
+    return np.expand_dims(features, axis=0)
 
-        # Perform the classification
-        prediction = pathosnet.predict([input_vggish, input_text, input_ghost, input_text])[0]
 
-        multilabel_prediction = dict(zip(params.LABELS, prediction))
-        binary_prediction = {k: sum([multilabel_prediction[l] for l in params.LABELS_CONVERSION_DICT[k]])
-                             for k in params.BINARY_LABELS}
+def _predict_concatenated(predict, inputs, size):
+    # Run predict once on the concatenated inputs and split its outputs back, input by input
+    lengths = [len(x) for x in inputs]
+    if sum(lengths) == 0:
+        return [np.zeros((0, size), dtype=params.FEATURES_DTYPE) for _ in inputs]
+    outputs = predict(np.concatenate(inputs))
+    return np.split(outputs, np.cumsum(lengths)[:-1])
+
+
+def _bucket_length(length):
+    # Sequences are padded to the next power of two, hence at most doubled
+    return 1 << (length - 1).bit_length()
+
+
+def _pad_sequences(sequences, length):
+    # Zero-padded batch of sequences (each with shape (1, time, features)) and mask, with shape (batch, length, 1)
+    batch = np.zeros((len(sequences), length, sequences[0].shape[2]), dtype=sequences[0].dtype)
+    mask = np.zeros((len(sequences), length, 1), dtype=params.FEATURES_DTYPE)
+    for i, sequence in enumerate(sequences):
+        batch[i, :sequence.shape[1]] = sequence[0]
+        mask[i, :sequence.shape[1]] = 1.
+    return batch, mask
 
-        return multilabel_prediction, binary_prediction
 
-    return classifier
+class PathosnetClassifier(object):
+    """Base PATHOSnet classifier, safe to share among threads.
 
+    The models run in the graph and the session of the runtime configuration, entered at each call, so the classifier
+    can be called from any thread. Concurrent calls overlap: while a call extracts features (in numpy and librosa),
+    others can run the networks; TensorFlow sessions are thread safe and the model wrappers in inference serialise
+    only the operations that are not (e.g., TensorFlow Lite interpreters).
 
-def pathosnet_voice_classifier(pathosnet_weights_path, vggish_weights_path, ghostvlad_weights_path, verbose=False):
+    Args:
+      pathosnet: PATHOSnet model, any object with a Keras-like predict method.
+      vggish: VGGish model, any object with a Keras-like predict method.
+      ghostvlad: GhostVlad FeaturesExtractor.
+      runtime_config: runtime.RuntimeConfig hosting the models.
+      shared_stft: Whether to compute the STFT once for both feature extractors.
+      masked_pathosnet: PATHOSnet model running on zero-padded sequences (see inference.masked_sequence_model), used
+        to batch utterances of different lengths; None batches only utterances with the same sequence lengths.
+    """
 
-    # Load models
-    pathosnet = get_pathosnet_voice(pathosnet_weights_path=pathosnet_weights_path, verbose=verbose)
-    vggish = get_vggish(vggish_weights_path, verbose=verbose)
-    ghostvlad = FeaturesExtractor(ghostvlad_weights_path, verbose=verbose)
+    def __init__(self, pathosnet, vggish, ghostvlad, runtime_config, shared_stft=False, masked_pathosnet=None):
+        self.pathosnet = pathosnet
+        self.vggish = vggish
+        self.ghostvlad = ghostvlad
+        self.runtime_config = runtime_config
+        self.shared_stft = shared_stft
+        self.masked_pathosnet = masked_pathosnet
 
-    # Use closures to keep models loaded
-    def classifier(audio_file_path):
+    def network_inputs(self, audio, sample_rate=None):
+        """VGGish examples and GhostVLAD windows (GhostVLAD features in shared backbone mode) of an audio.
+
+        Can be called from any thread: the GhostVLAD networks that run in shared backbone mode are run in the scope of
+        the runtime configuration.
+        """
+        # Decode the audio once and share the waveform between the feature extractors
+        waveform = audio_io.load_waveform(audio, sample_rate=sample_rate)
+        with self.runtime_config.scope():
+            return _extract_network_inputs(waveform, self.ghostvlad, shared_stft=self.shared_stft)
+
+    def audio_features(self, audio, sample_rate=None):
         # Prepare the data
-        # GhostVlad features
-        input_ghost = ghostvlad.features_extractor(audio_file_path)
-        if (len(input_ghost) == 0):
-            input_ghost = np.zeros((1, 512))
-        input_ghost = np.expand_dims(input_ghost, axis=0)
-        # VGGish features
-        input_vggish = vggish.predict(np.expand_dims(utils.wavfile_to_examples(audio_file_path), axis=-1))
-        if (len(input_vggish) == 0):
-            input_vggish = np.zeros((1, 128))
-        input_vggish = np.expand_dims(input_vggish, axis=0)
+        vggish_examples, ghostvlad_inputs = self.network_inputs(audio, sample_rate=sample_rate)
+        input_vggish = self.vggish.predict(np.expand_dims(vggish_examples, axis=-1))
+        input_ghost = ghostvlad_inputs if self.ghostvlad.shared_backbone else self.ghostvlad.embed(ghostvlad_inputs)
+        # VGGish and GhostVlad features
+        return as_sequence(input_vggish, 128), as_sequence(input_ghost, 512)
+
+    def predict_batch(self, network_inputs, args):
+        """Predictions of a batch of utterances.
+
+        VGGish and GhostVLAD run once on the examples and the windows of the whole batch, PATHOSnet once per bucket of
+        utterances with similar sequence lengths (see pathosnet_predictions).
+
+        Args:
+          network_inputs: VGGish examples and GhostVLAD windows of each utterance (see network_inputs).
+          args: Other arguments of the classifier for each utterance (e.g., the transcription), as tuples.
+
+        Returns:
+          List of multilabel and binary predictions, one for each utterance.
+        """
+        with self.runtime_config.scope():
+            vggish_examples, ghostvlad_inputs = zip(*network_inputs)
+            input_vggish = _predict_concatenated(lambda x: self.vggish.predict(np.expand_dims(x, axis=-1)),
+                                                 vggish_examples, 128)
+            # In shared backbone mode the GhostVLAD features are already extracted
+            input_ghost = ghostvlad_inputs if self.ghostvlad.shared_backbone else \
+                _predict_concatenated(self.ghostvlad.embed, ghostvlad_inputs, 512)
+            return self.pathosnet_predictions([self.model_inputs(as_sequence(v, 128), as_sequence(g, 512), *a)
+                                               for v, g, a in zip(input_vggish, input_ghost, args)])
 
+    def pathosnet_predictions(self, model_inputs):
+        """Run PATHOSnet on a batch of utterances, given the model inputs of each of them.
+
+        PATHOSnet runs on sequences (ending in global average poolings), hence utterances are grouped by the lengths of
+        their sequences: with the masked model, by bucket, each sequence zero-padded to the next power of two of its
+        length, otherwise by the exact lengths.
+        """
+        groups = {}
+        for i, inputs in enumerate(model_inputs):
+            lengths = tuple(x.shape[1] for x in inputs)
+            key = tuple(_bucket_length(n) for n in lengths) if self.masked_pathosnet is not None else lengths
+            groups.setdefault(key, []).append(i)
+
+        predictions = [None] * len(model_inputs)
+        with self.runtime_config.scope():
+            for key, indices in groups.items():
+                sequences = list(zip(*[model_inputs[i] for i in indices]))
+                if all(len({x.shape for x in sequence}) == 1 for sequence in sequences):
+                    # Same lengths, no padding needed
+                    outputs = self.pathosnet.predict([np.concatenate(sequence) for sequence in sequences])
+                else:
+                    batches, masks = zip(*[_pad_sequences(sequence, length)
+                                           for sequence, length in zip(sequences, key)])
+                    outputs = self.masked_pathosnet.predict(list(batches) + list(masks))
+                for i, prediction in zip(indices, outputs):
+                    predictions[i] = self.label_predictions(prediction)
+        return predictions
+
+    def warm_up(self, duration=1.):
+        """Classify a short noise once, paying the first call costs (numba compilation, TensorFlow graph
+        initialisation) before serving requests."""
+        # Low level noise, so that the voice activity detection keeps it and every step of the pipeline runs
+        waveform = np.random.RandomState(0).uniform(-0.1, 0.1, size=int(duration * params.SAMPLE_RATE)).astype(
+            params.FEATURES_DTYPE)
+        self(*self._warm_up_args(waveform), sample_rate=params.SAMPLE_RATE)
+
+    def predictions(self, inputs):
         # Perform the classification
-        prediction = pathosnet.predict([input_vggish, input_ghost])[0]
+        return self.label_predictions(self.pathosnet.predict(inputs)[0])
 
+    def label_predictions(self, prediction):
+        """Multilabel and binary predictions (dictionaries: label -> score) from a PATHOSnet output row."""
         multilabel_prediction = dict(zip(params.LABELS, prediction))
         binary_prediction = {k: sum([multilabel_prediction[l] for l in params.LABELS_CONVERSION_DICT[k]])
                              for k in params.BINARY_LABELS}
 
         return multilabel_prediction, binary_prediction
 
-    return classifier
+
+class PathosnetMultimodalClassifier(PathosnetClassifier):
+    """PATHOSnet classifier on voice and transcription, safe to share among threads (see PathosnetClassifier).
+
+    Args:
+      embedder: utils.Embedder with the word embeddings of the transcriptions.
+      The others are the PathosnetClassifier ones.
+    """
+
+    def __init__(self, pathosnet, vggish, ghostvlad, embedder, runtime_config, shared_stft=False,
+                 masked_pathosnet=None):
+        super(PathosnetMultimodalClassifier, self).__init__(pathosnet, vggish, ghostvlad, runtime_config,
+                                                            shared_stft=shared_stft, masked_pathosnet=masked_pathosnet)
+        self.embedder = embedder
+
+    def __call__(self, audio, transcription, sample_rate=None):
+        with self.runtime_config.scope():
+            input_vggish, input_ghost = self.audio_features(audio, sample_rate=sample_rate)
+
+            return self.predictions(self.model_inputs(input_vggish, input_ghost, transcription))
+
+    def model_inputs(self, input_vggish, input_ghost, transcription):
+        # Word embeddings
+        input_text = as_sequence(np.asarray(utils.extract_text_features(transcription, self.embedder),
+                                             dtype=params.FEATURES_DTYPE), 300)
+        return [input_vggish, input_text, input_ghost, input_text]
+
+    def classify_batch(self, audios, transcriptions, sample_rate=None):
+        """Classify a batch of utterances at once (see PathosnetClassifier.predict_batch)."""
+        return self.predict_batch([self.network_inputs(audio, sample_rate=sample_rate) for audio in audios],
+                                  [(transcription,) for transcription in transcriptions])
+
+    def _warm_up_args(self, waveform):
+        return waveform, []
+
+
+class PathosnetVoiceClassifier(PathosnetClassifier):
+    """PATHOSnet classifier on voice, safe to share among threads (see PathosnetClassifier)."""
+
+    def __call__(self, audio, sample_rate=None):
+        with self.runtime_config.scope():
+            input_vggish, input_ghost = self.audio_features(audio, sample_rate=sample_rate)
+
+            return self.predictions(self.model_inputs(input_vggish, input_ghost))
+
+    def model_inputs(self, input_vggish, input_ghost):
+        return [input_vggish, input_ghost]
+
+    def classify_batch(self, audios, sample_rate=None):
+        """Classify a batch of utterances at once (see PathosnetClassifier.predict_batch)."""
+        return self.predict_batch([self.network_inputs(audio, sample_rate=sample_rate) for audio in audios],
+                                  [() for _ in audios])
+
+    def _warm_up_args(self, waveform):
+        return (waveform,)
+
+
+def _resolve_registry(registry, runtime_config):
+    # Models come from the given registry, from a new one on the given runtime or from the default one
+    if registry is None:
+        return registry_module.ModelRegistry(runtime_config) if runtime_config is not None else \
+            registry_module.get_registry()
+    if runtime_config is not None and runtime_config is not registry.runtime_config:
+        raise ValueError("The runtime configuration differs from the one of the model registry")
+    return registry
+
+
+def pathosnet_multimodal_classifier(pathosnet_weights_path, word_embeddings_path,
+                                    vggish_weights_path, ghostvlad_weights_path, shared_stft=False, optimize=False,
+                                    shared_backbone=False, runtime_config=None, registry=None, verbose=False):
+    registry = _resolve_registry(registry, runtime_config)
+    pathosnet = registry.pathosnet(pathosnet_weights_path, 'multimodal', optimize=optimize, verbose=verbose)
+    masked_pathosnet = registry.masked_pathosnet(pathosnet_weights_path, 'multimodal', optimize=optimize,
+                                                 verbose=verbose)
+    vggish = registry.vggish(vggish_weights_path, optimize=optimize, verbose=verbose)
+    ghostvlad = registry.ghostvlad(ghostvlad_weights_path, optimize=optimize, shared_backbone=shared_backbone,
+                                   verbose=verbose)
+    embedder = registry.embedder(word_embeddings_path)
+
+    return PathosnetMultimodalClassifier(pathosnet, vggish, ghostvlad, embedder, registry.runtime_config,
+                                         shared_stft=shared_stft, masked_pathosnet=masked_pathosnet)
+
+
+def pathosnet_voice_classifier(pathosnet_weights_path, vggish_weights_path, ghostvlad_weights_path, shared_stft=False,
+                               optimize=False, shared_backbone=False, runtime_config=None, registry=None,
+                               verbose=False):
+    registry = _resolve_registry(registry, runtime_config)
+    pathosnet = registry.pathosnet(pathosnet_weights_path, 'voice', optimize=optimize, verbose=verbose)
+    masked_pathosnet = registry.masked_pathosnet(pathosnet_weights_path, 'voice', optimize=optimize, verbose=verbose)
+    vggish = registry.vggish(vggish_weights_path, optimize=optimize, verbose=verbose)
+    ghostvlad = registry.ghostvlad(ghostvlad_weights_path, optimize=optimize, shared_backbone=shared_backbone,
+                                   verbose=verbose)
+
+    return PathosnetVoiceClassifier(pathosnet, vggish, ghostvlad, registry.runtime_config, shared_stft=shared_stft,
+                                    masked_pathosnet=masked_pathosnet)
@@ -0,0 +1,134 @@
+import os
+import sys
+from argparse import ArgumentParser
+
+import keras.backend as K
+import pandas as pd
+
+import audio_io
+import inference
+import params
+import utils
+from model import get_pathosnet_multimodal, get_pathosnet_voice, get_vggish
+
+
+def _calibration_data(csv_file, data_path, audio_file_path_col_name, size, ghostvlad):
+    # VGGish examples and GhostVLAD windows (with the channel axis) of the first audio files listed in the CSV file
+    data_df = pd.read_csv(csv_file)
+    vggish_inputs, ghostvlad_inputs = [], []
+    for audio_file_path in data_df[audio_file_path_col_name][:size]:
+        waveform = audio_io.load_waveform(os.path.join(data_path, audio_file_path), dtype='float32')
+        vggish_inputs.extend(utils.waveform_to_examples(waveform, params.SAMPLE_RATE, dtype='float32')[..., None])
+        ghostvlad_inputs.extend(ghostvlad.load_data(waveform)[..., None])
+    return vggish_inputs, ghostvlad_inputs
+
+
+def main(arguments):
+    # Read command line arguments   ------------------------------------------------------------------------------------
+    args_parser = ArgumentParser()
+    # Model paths arguments
+    args_parser.add_argument('--model_weights_path', type=str, required=True,
+                             help="Path to the h5 file hosting PATHOSnet model weights.")
+    args_parser.add_argument('--vggish_weights_path', type=str, required=True,
+                             help="Path to the h5 file hosting VGGish model weights.")
+    args_parser.add_argument('--ghostvlad_weights_path', type=str, required=True,
+                             help="Path to the h5 file hosting GhostVlad model weights.")
+    # Model related arguments
+    args_parser.add_argument('--modality', type=str, default='multimodal', choices=['multimodal', 'voice'],
+                             help="Modality of the PATHOSnet model.")
+    args_parser.add_argument('--optimize', action='store_true',
+                             help="Whether to fold batch normalization and temperature scaling before the export.")
+    # Output arguments
+    args_parser.add_argument('--format', type=str, default='frozen_graph', choices=['frozen_graph', 'tflite'],
+                             help="Format of the exported models.")
+    args_parser.add_argument('--output_dir', type=str, required=True,
+                             help="Path to the directory where the exported models are saved.")
+    # Quantization arguments
+    args_parser.add_argument('--quantization', type=str, choices=inference.QUANTIZATION_MODES,
+                             help="Post-training quantization of the VGGish weights (TensorFlow Lite format only).")
+    args_parser.add_argument('--quantize_ghostvlad', action='store_true',
+                             help="Whether to apply the quantization also to the GhostVlad weights.")
+    args_parser.add_argument('--calibration_csv_file', type=str,
+                             help="Path to the csv file (in the format of pathosnet_test.py) listing the audio files "
+                                  "used to calibrate int8 quantization.")
+    args_parser.add_argument('--data_path', type=str, default='.',
+                             help="Path to the main directory hosting the calibration audio files.")
+    args_parser.add_argument('--audio_file_path_col_name', type=str, default='audio_file_path',
+                             help="Name of the column hosting the audio file path in the data frame.")
+    args_parser.add_argument('--calibration_size', type=int, default=50,
+                             help="Number of audio files used for calibration.")
+    # Misc arguments
+    args_parser.add_argument('--verbose', type=bool, default=False,
+                             help="Whether to be verbose or not.")
+
+    args = args_parser.parse_args(arguments)
+    if args.quantization is not None and args.format != 'tflite':
+        args_parser.error("--quantization requires --format tflite")
+    if args.quantization == 'int8' and args.calibration_csv_file is None:
+        args_parser.error("int8 quantization requires --calibration_csv_file")
+
+    # Build the graphs in inference mode, this way no training branch (e.g., dropout) is exported
+    K.set_learning_phase(0)
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    # Export models  ---------------------------------------------------------------------------------------------------
+    from ghostvlad.ghostvlad.ghostvlad_features_extractor import FeaturesExtractor, GhostVladConfig
+
+    if args.modality == 'multimodal':
+        pathosnet = get_pathosnet_multimodal(pathosnet_weights_path=args.model_weights_path, verbose=args.verbose)
+    else:
+        pathosnet = get_pathosnet_voice(pathosnet_weights_path=args.model_weights_path, verbose=args.verbose)
+    # Each model is paired with the input shapes used to convert it to TensorFlow Lite: VGGish examples and GhostVLAD
+    # windows have fixed shapes, while PATHOSnet sequences have variable length and it is exported as a frozen graph
+    # in both formats (the backend is selected per model from the file extension)
+    ghostvlad_config = GhostVladConfig(tflite_compatible=args.format == 'tflite')
+    ghostvlad = FeaturesExtractor(args.ghostvlad_weights_path, config=ghostvlad_config, verbose=args.verbose)
+    models = {
+        os.path.splitext(os.path.basename(args.model_weights_path))[0]: (pathosnet, None),
+        os.path.splitext(os.path.basename(args.vggish_weights_path))[0]: (
+            get_vggish(args.vggish_weights_path, verbose=args.verbose), [(96, 64, 1)]),
+        os.path.splitext(os.path.basename(args.ghostvlad_weights_path))[0]: (ghostvlad.network_eval, [(257, 30, 1)])
+    }
+    # Quantization settings (mode and calibration inputs) of each model
+    quantization = {name: (None, None) for name in models}
+    if args.quantization is not None:
+        vggish_inputs, ghostvlad_inputs = [], []
+        if args.quantization == 'int8':
+            if args.verbose:
+                print("Computing calibration data...")
+            vggish_inputs, ghostvlad_inputs = _calibration_data(
+                args.calibration_csv_file, args.data_path, args.audio_file_path_col_name, args.calibration_size,
+                ghostvlad)
+            if args.verbose:
+                print("Calibration data computed ({} VGGish examples, {} GhostVlad windows).\n".format(
+                    len(vggish_inputs), len(ghostvlad_inputs)))
+        quantization[os.path.splitext(os.path.basename(args.vggish_weights_path))[0]] = (
+            args.quantization, lambda: ([x[None]] for x in vggish_inputs))
+        if args.quantize_ghostvlad:
+            quantization[os.path.splitext(os.path.basename(args.ghostvlad_weights_path))[0]] = (
+                args.quantization, lambda: ([x[None]] for x in ghostvlad_inputs))
+    for name, (model, input_shapes) in models.items():
+        if args.optimize:
+            model = inference.optimize_for_inference(model, verbose=args.verbose)
+        tflite = args.format == 'tflite' and input_shapes is not None
+        if tflite:
+            path = os.path.join(args.output_dir, name + inference.TFLITE_EXTENSION)
+        else:
+            path = os.path.join(args.output_dir, name + inference.FROZEN_GRAPH_EXTENSION)
+        if args.verbose:
+            print("Exporting {}...".format(path))
+        if tflite:
+            inference.export_tflite(model, path, input_shapes=input_shapes, quantization=quantization[name][0],
+                                    representative_data=quantization[name][1])
+        else:
+            inference.export_frozen_graph(model, path)
+        if args.verbose:
+            print("Model saved in {} file.\n".format(path))
+
+    return 0
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -13,6 +13,62 @@ from sklearn.metrics import confusion_matrix, precision_recall_fscore_support, r
 from pathosnet import pathosnet_multimodal_classifier, pathosnet_voice_classifier
 
 
+def analyse(classifier, data_df, data_path, modality, audio_file_path_col_name='audio_file_path',
+            transcription_col_name='transcription', label_col_name='emotion_label', batch_size=1, verbose=False):
+    # Classify the items listed in the data frame and collect targets and predictions in a results data frame
+    output_data = []
+    if verbose:
+        print("Starting analysis of {} files...".format(data_df.shape[0]))
+    # Get arguments
+    items_args = []
+    for _, row in data_df.iterrows():
+        input_args = (os.path.join(data_path, row[audio_file_path_col_name]),)
+        if modality == 'multimodal':
+            input_args = input_args + (row[transcription_col_name],)
+        items_args.append(input_args)
+    # Extract dictionaries with label proabilities, one item at a time or in batches of items
+    predictions = []
+    for start in range(0, len(items_args), batch_size):
+        if verbose:
+            print("Analysisng items {}-{}/{}.".format(
+                start + 1, min(start + batch_size, len(items_args)), data_df.shape[0]))
+        if batch_size == 1:
+            predictions.append(classifier(*items_args[start]))
+        else:
+            predictions += classifier.classify_batch(*zip(*items_args[start:start + batch_size]))
+    for input_args, (_, row), (multilabel_prediction, binary_prediction) in zip(items_args, data_df.iterrows(),
+                                                                               predictions):
+        output_data.append(input_args +
+                           (row[label_col_name], sorted(multilabel_prediction,
+                                                        key=lambda k: -multilabel_prediction[k])[0]) +
+                           tuple(multilabel_prediction.values()) +
+                           (params.BINARY_CONVERSION_DICT[row[label_col_name]],
+                            sorted(binary_prediction, key=lambda k: -binary_prediction[k])[0]) +
+                           tuple(binary_prediction.values()))
+
+    if verbose:
+        print("Analysis finished.\n")
+
+    output_df_columns = ['File path'] + (['Trascription'] if modality == 'multimodal' else []) + \
+                        ['Target label', 'Predicted label'] + [l + ' probability' for l in params.LABELS] + \
+                        ['Target binary label', 'Predicted binary label'] + \
+                        [l + ' probability' for l in params.BINARY_LABELS]
+    return pd.DataFrame(data=output_data, columns=output_df_columns)
+
+
+def summary_scores(analysis_df):
+    # Accuracy, weighted accuracy and AUC of the multi-label and binary predictions in a results data frame
+    scores = {}
+    for name, labels, target_col_name in [('multi-label', params.LABELS, 'Target label'),
+                                          ('binary', params.BINARY_LABELS, 'Target binary label')]:
+        y_hat = analysis_df[[l + ' probability' for l in labels]].to_numpy()
+        y = (analysis_df[target_col_name].to_numpy().reshape(-1, 1) == np.array(labels)).astype(np.float)
+        scores[name] = {'accuracy': accuracy_score(np.argmax(y, axis=-1), np.argmax(y_hat, axis=-1)),
+                        'weighted accuracy': balanced_accuracy_score(np.argmax(y, axis=-1), np.argmax(y_hat, axis=-1)),
+                        'auc of roc score': roc_auc_score(y, y_hat, multi_class='ovr')}
+    return scores
+
+
 def main(arguments):
     # Read command line arguments   ------------------------------------------------------------------------------------
     args_parser = ArgumentParser()
@@ -40,9 +96,21 @@ def main(arguments):
     # Model related arguments
     args_parser.add_argument('--modality', type=str, default='multimodal', choices=['multimodal', 'voice'],
                              help="Modality to use in the analysis.")
+    args_parser.add_argument('--ghostvlad_shared_backbone', action='store_true',
+                             help="Whether to run the GhostVlad trunk once per utterance (shared backbone mode).")
+    # Baseline comparison arguments
+    args_parser.add_argument('--baseline_results_file', type=str,
+                             help="Path to the csv file with the results of a baseline run (e.g., with the original "
+                                  "weights), the change of the test scores with respect to it is reported.")
+    args_parser.add_argument('--max_score_drop', type=float,
+                             help="Maximum drop of accuracy, weighted accuracy or AUC with respect to the baseline, "
+                                  "the test fails (non-zero exit status) if exceeded.")
     # Output arguments
     args_parser.add_argument('--output_id', type=str, required=True,
                              help="Additional identifier for the output files to recognize the experiment.")
+    # Batching arguments
+    args_parser.add_argument('--batch_size', type=int, default=1,
+                             help="Number of items classified at once (see PathosnetClassifier.predict_batch).")
     # Misc arguments
     args_parser.add_argument('--verbose', type=bool, default=False,
                              help="Whether to be verbose or not.")
@@ -64,35 +132,19 @@ def main(arguments):
         classifier_args = classifier_args + (args.word_embeddings_path,)
     classifier_args = classifier_args + (args.vggish_weights_path,  args.ghostvlad_weights_path)
     if args.modality == 'multimodal':
-        classifier = pathosnet_multimodal_classifier(*classifier_args, verbose=args.verbose)
+        classifier = pathosnet_multimodal_classifier(*classifier_args, shared_backbone=args.ghostvlad_shared_backbone,
+                                                     verbose=args.verbose)
     else:
-        classifier = pathosnet_voice_classifier(*classifier_args, verbose=args.verbose)
+        classifier = pathosnet_voice_classifier(*classifier_args, shared_backbone=args.ghostvlad_shared_backbone,
+                                                verbose=args.verbose)
     if args.verbose:
         print("Model loaded.\n")
 
     # Perform analysis  ------------------------------------------------------------------------------------------------
-    output_data = []
-    if args.verbose:
-        print("Starting analysis of {} files...".format(data_df.shape[0]))
-    for index, row in data_df.iterrows():
-        if args.verbose:
-            print("Analysisng item {}/{}.".format(index + 1, data_df.shape[0]))
-        # Get arguments
-        input_args = (os.path.join(args.data_path, row[args.audio_file_path_col_name]),)
-        if args.modality == 'multimodal':
-            input_args = input_args + (row[args.transcription_col_name],)
-        # Extract dictionary with label proabilities
-        multilabel_prediction, binary_prediction = classifier(*input_args)
-        output_data.append(input_args +
-                           (row[args.label_col_name], sorted(multilabel_prediction,
-                                                             key=lambda k: -multilabel_prediction[k])[0]) +
-                           tuple(multilabel_prediction.values()) +
-                           (params.BINARY_CONVERSION_DICT[row[args.label_col_name]],
-                            sorted(binary_prediction, key=lambda k: -binary_prediction[k])[0]) +
-                           tuple(binary_prediction.values()))
-
-    if args.verbose:
-        print("Analysis finished.\n")
+    analysis_df = analyse(classifier, data_df, args.data_path, args.modality,
+                          audio_file_path_col_name=args.audio_file_path_col_name,
+                          transcription_col_name=args.transcription_col_name, label_col_name=args.label_col_name,
+                          batch_size=args.batch_size, verbose=args.verbose)
 
     # Save results   ---------------------------------------------------------------------------------------------------
     if args.verbose:
@@ -103,11 +155,6 @@ def main(arguments):
     while os.path.isfile(output_df_path_):
         output_df_path_ = output_df_path + '_' + str(i) + '.csv'
     output_df_path = output_df_path_
-    output_df_columns = ['File path'] + (['Trascription'] if args.modality == 'multimodal' else []) + \
-                        ['Target label', 'Predicted label'] + [l + ' probability' for l in params.LABELS] + \
-                        ['Target binary label', 'Predicted binary label'] + \
-                        [l + ' probability' for l in params.BINARY_LABELS]
-    analysis_df = pd.DataFrame(data=output_data, columns=output_df_columns)
     analysis_df.to_csv(path_or_buf=output_df_path, index=False)
     if args.verbose:
         print("Results saved in {} file.\n".format(output_df_path))
@@ -184,8 +231,27 @@ def main(arguments):
     if args.verbose:
         print("Test scores computed and saved in {} file.\n".format(output_scores_path))
 
+    # Compare with baseline   ------------------------------------------------------------------------------------------
+
+    if args.baseline_results_file is not None:
+        baseline_scores = summary_scores(pd.read_csv(args.baseline_results_file))
+        scores = summary_scores(analysis_df)
+        score_changes = {name: {score: scores[name][score] - baseline_scores[name][score] for score in scores[name]}
+                         for name in scores}
+        with open(output_scores_path, 'a') as f:
+            f.write("CHANGE W.R.T. BASELINE ----------------------------------------------\n\n")
+            f.write(str(score_changes))
+            f.write("\n\n")
+            f.write("---------------------------------------------------------------------\n\n")
+        print("Change of the test scores w.r.t. {}: {}".format(args.baseline_results_file, score_changes))
+        if args.max_score_drop is not None:
+            max_drop = -min(change for changes in score_changes.values() for change in changes.values())
+            if max_drop > args.max_score_drop:
+                print("Maximum score drop {:.4f} exceeds the allowed {:.4f}.".format(max_drop, args.max_score_drop))
+                return 1
+
     return 0
 
 
 if __name__ == '__main__':
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv[1:]))
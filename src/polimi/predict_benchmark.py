@@ -0,0 +1,68 @@
+import sys
+import time
+from argparse import ArgumentParser
+
+import keras.backend as K
+import numpy as np
+import pandas as pd
+
+import inference
+from model import get_pathosnet_multimodal, get_pathosnet_voice, get_vggish
+
+
+def _call_times(predict, x, repetitions):
+    predict(x)  # Warm up
+    times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        predict(x)
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def main(arguments):
+    # Read command line arguments   ------------------------------------------------------------------------------------
+    args_parser = ArgumentParser()
+    args_parser.add_argument('--repetitions', type=int, default=100,
+                             help="Number of calls measured for each model.")
+    args_parser.add_argument('--sequence_length', type=int, default=20,
+                             help="Length of the PATHOSnet input sequences.")
+    args_parser.add_argument('--ghostvlad_windows', type=int, default=1,
+                             help="Number of GhostVlad windows per call.")
+
+    args = args_parser.parse_args(arguments)
+
+    K.set_learning_phase(0)
+
+    # Models with random weights (the overhead does not depend on them) and single sample inputs  ---------------------
+    from ghostvlad.ghostvlad.ghostvlad_features_extractor import GhostVladConfig
+    from ghostvlad.ghostvlad.ghostvlad_model import vggvox_resnet2d_icassp
+
+    random_state = np.random.RandomState(0)
+    sequence = lambda dim: random_state.normal(size=(1, args.sequence_length, dim)).astype(np.float32)
+    models = {
+        'PATHOSnet voice': (get_pathosnet_voice(), [sequence(128), sequence(512)]),
+        'PATHOSnet multimodal': (get_pathosnet_multimodal(), [sequence(128), sequence(300), sequence(512), sequence(300)]),
+        'VGGish': (get_vggish(), random_state.uniform(size=(1, 96, 64, 1)).astype(np.float32)),
+        'GhostVlad': (vggvox_resnet2d_icassp(input_dim=(257, None, 1), num_class=5994, mode='eval',
+                                             args=GhostVladConfig()),
+                      random_state.normal(size=(args.ghostvlad_windows, 257, 30, 1)).astype(np.float32)),
+    }
+
+    # Measure per call times  ------------------------------------------------------------------------------------------
+    results = []
+    for name, (model, x) in models.items():
+        predict_times = _call_times(model.predict, x, args.repetitions)
+        function_times = _call_times(inference.KerasFunctionModel(model).predict, x, args.repetitions)
+        results.append({'model': name,
+                        'Model.predict median (ms)': np.median(predict_times) * 1e3,
+                        'KerasFunctionModel.predict median (ms)': np.median(function_times) * 1e3,
+                        'saved per call (ms)': (np.median(predict_times) - np.median(function_times)) * 1e3,
+                        'speed-up': np.median(predict_times) / np.median(function_times)})
+    print(pd.DataFrame(results).to_string(index=False, float_format='{:.3f}'.format))
+
+    return 0
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
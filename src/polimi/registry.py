@@ -0,0 +1,137 @@
+"""Registry of the models loaded by the classifiers.
+
+A ModelRegistry loads each network (and word embeddings) once per weights path and hands the same instance to every
+classifier built from it, so a process serving both the voice and the multimodal PATHOSnet holds a single VGGish and a
+single GhostVLAD. Models live in the graph of the registry runtime configuration: when it is reset (e.g., to reload the
+models), the registry drops them and loads new ones at the next request. Word embeddings involve no TensorFlow: they
+can be preloaded once for every registry of the process (see preload_embedder).
+"""
+
+import os
+import threading
+
+import params
+import runtime
+
+_registry = None
+_embedders = {}  # (Path, dtype) -> preloaded word embeddings
+
+
+class ModelRegistry(object):
+    """Models shared by the classifiers, keyed by weights path and loading options.
+
+    Args:
+      runtime_config: runtime.RuntimeConfig hosting the models, defaults to runtime.get_runtime().
+    """
+
+    def __init__(self, runtime_config=None):
+        self.runtime_config = runtime_config if runtime_config is not None else runtime.get_runtime()
+        self._models = {}
+        self._graph = None
+        self._lock = threading.Lock()
+
+    def _get(self, key, load_fn):
+        with self._lock:
+            if self._graph is not self.runtime_config.graph:
+                # New graph (or first request), previously loaded models are gone
+                self._models = {}
+                self._graph = self.runtime_config.graph
+            if key not in self._models:
+                with self.runtime_config.scope():
+                    self._models[key] = load_fn()
+            return self._models[key]
+
+    def pathosnet(self, weights_path, modality, optimize=False, verbose=False):
+        import inference
+        from model import get_pathosnet_multimodal, get_pathosnet_voice
+
+        build_fn = get_pathosnet_multimodal if modality == 'multimodal' else get_pathosnet_voice
+        # Keras models are bound to backend functions, cheaper than Model.predict on small inputs
+        return self._get(('pathosnet', modality, os.path.abspath(weights_path), optimize),
+                         lambda: inference.as_callable(inference.load_model(
+                             weights_path, lambda path: build_fn(pathosnet_weights_path=path, verbose=verbose),
+                             optimize=optimize, runtime_config=self.runtime_config, verbose=verbose)))
+
+    def masked_pathosnet(self, weights_path, modality, optimize=False, verbose=False):
+        """PATHOSnet model on zero-padded sequences (see inference.masked_sequence_model), sharing the layers of the
+        pathosnet one; None for inference-only artifacts."""
+        import inference
+
+        pathosnet = self.pathosnet(weights_path, modality, optimize=optimize, verbose=verbose)
+        if not isinstance(pathosnet, inference.KerasFunctionModel):
+            return None
+        return self._get(('masked_pathosnet', modality, os.path.abspath(weights_path), optimize),
+                         lambda: inference.as_callable(inference.masked_sequence_model(pathosnet.model,
+                                                                                       verbose=verbose)))
+
+    def vggish(self, weights_path, optimize=False, verbose=False):
+        import inference
+        from model import get_vggish
+
+        return self._get(('vggish', os.path.abspath(weights_path), optimize),
+                         lambda: inference.as_callable(inference.load_model(
+                             weights_path, lambda path: get_vggish(path, verbose=verbose), optimize=optimize,
+                             runtime_config=self.runtime_config, verbose=verbose)))
+
+    def ghostvlad(self, weights_path, optimize=False, shared_backbone=False, verbose=False):
+        from ghostvlad.ghostvlad.ghostvlad_features_extractor import FeaturesExtractor
+
+        return self._get(('ghostvlad', os.path.abspath(weights_path), optimize, shared_backbone),
+                         lambda: FeaturesExtractor(weights_path, dtype=params.FEATURES_DTYPE, optimize=optimize,
+                                                   shared_backbone=shared_backbone,
+                                                   runtime_config=self.runtime_config, verbose=verbose))
+
+    def embedder(self, word_embeddings_path):
+        import utils
+
+        key = ('embedder', os.path.abspath(word_embeddings_path), str(params.FEATURES_DTYPE))
+        return self._get(key, lambda: _embedders[key[1:]] if key[1:] in _embedders else
+                         utils.Embedder(word_embeddings_path))
+
+    def memory_usage(self):
+        """Memory taken by the weights of each loaded model, in bytes.
+
+        Returns:
+          Dictionary: (model kind, weights path, loading options...): tuple -> size: int. GhostVLAD sizes refer to the
+          whole network (the shared backbone networks reuse its weights), word embeddings sizes to the embedding matrix;
+          masked PATHOSnet models are left out, since they share the weights of the PATHOSnet ones.
+        """
+        import inference
+
+        with self._lock:
+            models = dict(self._models) if self._graph is self.runtime_config.graph else {}
+        usage = {}
+        for key, model in models.items():
+            if key[0] == 'masked_pathosnet':
+                continue  # Layers (and weights) of the pathosnet model
+            if key[0] == 'ghostvlad':
+                usage[key] = inference.model_nbytes(model.network_eval)
+            elif key[0] == 'embedder':
+                usage[key] = model.embedding.nbytes
+            else:
+                usage[key] = inference.model_nbytes(model)
+        return usage
+
+
+def preload_embedder(word_embeddings_path):
+    """Load word embeddings for every registry of the process, instead of one copy each.
+
+    E.g., the process forking the PATHOSnet workers in prefork mode (see workers) preloads them, so the workers share
+    the embedding matrix copy-on-write.
+    """
+    import utils
+
+    key = (os.path.abspath(word_embeddings_path), str(params.FEATURES_DTYPE))
+    if key not in _embedders:
+        _embedders[key] = utils.Embedder(word_embeddings_path)
+    return _embedders[key]
+
+
+def get_registry():
+    """Default registry, on the default runtime (see runtime.get_runtime)."""
+    global _registry
+
+    runtime_config = runtime.get_runtime()
+    if _registry is None or _registry.runtime_config is not runtime_config:
+        _registry = ModelRegistry(runtime_config)
+    return _registry
@@ -0,0 +1,64 @@
+"""Waveform resampling with rational polyphase filters.
+
+The anti-aliasing FIR filter of each (source rate, target rate, quality) combination is designed once and cached, so
+that the common microphone rates (e.g., 44.1 kHz and 48 kHz) pay the filter design cost only at the first request.
+"""
+
+import functools
+import math
+
+import numpy as np
+
+import params
+
+# Quality tiers: (zero crossings of the windowed sinc on each side, Kaiser window beta, cutoff relative to Nyquist)
+QUALITY_TIERS = {
+    'fast': (5, 5.0, 0.9),
+    'default': (10, 5.0, 1.0),  # Same filter scipy.signal.resample_poly designs by default
+    'best': (64, 14.77, 0.945),  # Close to the 'kaiser_best' filter of resampy
+}
+
+
+@functools.lru_cache(maxsize=None)
+def polyphase_filter(up, down, quality='default'):
+    """Design the anti-aliasing low-pass filter to resample by up / down.
+
+    Args:
+      up: Upsampling factor.
+      down: Downsampling factor.
+      quality: One of the keys of QUALITY_TIERS.
+
+    Returns:
+      1-D np.array with the (read-only) filter coefficients.
+    """
+    from scipy import signal  # Imported at the first resampling, audio at params.SAMPLE_RATE never needs it
+
+    if quality not in QUALITY_TIERS:
+        raise ValueError("Unknown resampling quality '{}', expected one of {}".format(quality, sorted(QUALITY_TIERS)))
+    zero_crossings, beta, rolloff = QUALITY_TIERS[quality]
+    max_rate = max(up, down)
+    h = signal.firwin(2 * zero_crossings * max_rate + 1, rolloff / max_rate, window=('kaiser', beta))
+    h.flags.writeable = False
+    return h
+
+
+def resample(data, sample_rate, target_rate=params.SAMPLE_RATE, quality=None):
+    """Resample a waveform with a rational polyphase filter.
+
+    Args:
+      data: 1-D np.array with the samples to resample.
+      sample_rate: Sample rate of data.
+      target_rate: Sample rate of the output.
+      quality: One of the keys of QUALITY_TIERS, defaults to params.RESAMPLING_QUALITY.
+
+    Returns:
+      1-D np.array with the resampled waveform, of the same type of data.
+    """
+    if sample_rate == target_rate:
+        return data
+    g = math.gcd(int(sample_rate), int(target_rate))
+    up, down = int(target_rate) // g, int(sample_rate) // g
+    from scipy import signal
+
+    h = polyphase_filter(up, down, params.RESAMPLING_QUALITY if quality is None else quality)
+    return signal.resample_poly(data, up, down, window=h).astype(data.dtype, copy=False)
@@ -0,0 +1,84 @@
+"""TensorFlow runtime configuration.
+
+A RuntimeConfig owns the graph and the session hosting all the models of a classifier, created with explicit thread
+pool sizes and device settings instead of whatever default graph and session Keras picks. Models are built and run
+inside its scope, from any thread.
+"""
+
+import contextlib
+import functools
+
+import params
+
+_runtime = None
+
+
+class RuntimeConfig(object):
+    """Graph and session shared by the models, with their TensorFlow configuration.
+
+    Args:
+      intra_op_parallelism_threads: Threads used to run a single op, defaults to params.INTRA_OP_PARALLELISM_THREADS.
+      inter_op_parallelism_threads: Threads used to run independent ops, defaults to
+        params.INTER_OP_PARALLELISM_THREADS.
+      cpu_only: Whether to hide GPUs from TensorFlow, defaults to params.CPU_ONLY.
+    """
+
+    def __init__(self, intra_op_parallelism_threads=None, inter_op_parallelism_threads=None, cpu_only=None):
+        self.intra_op_parallelism_threads = params.INTRA_OP_PARALLELISM_THREADS \
+            if intra_op_parallelism_threads is None else intra_op_parallelism_threads
+        self.inter_op_parallelism_threads = params.INTER_OP_PARALLELISM_THREADS \
+            if inter_op_parallelism_threads is None else inter_op_parallelism_threads
+        self.cpu_only = params.CPU_ONLY if cpu_only is None else cpu_only
+        self.graph = None
+        self.session = None
+        self.reset()
+
+    def session_config(self):
+        import tensorflow as tf
+
+        config = tf.ConfigProto(intra_op_parallelism_threads=self.intra_op_parallelism_threads,
+                                inter_op_parallelism_threads=self.inter_op_parallelism_threads,
+                                allow_soft_placement=True)
+        if self.cpu_only:
+            config.device_count['GPU'] = 0
+        else:
+            config.gpu_options.allow_growth = True
+        return config
+
+    def reset(self):
+        """Replace graph and session with new (empty) ones, e.g. to reload the models."""
+        import tensorflow as tf
+
+        if self.session is not None:
+            self.session.close()
+        self.graph = tf.Graph()
+        self.session = tf.Session(graph=self.graph, config=self.session_config())
+
+    @contextlib.contextmanager
+    def scope(self):
+        """Make graph and session the default ones (per thread) for building or running the models."""
+        with self.graph.as_default(), self.session.as_default():
+            yield self
+
+    def scoped(self, fn):
+        """Wrap a function to run it inside scope."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.scope():
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def configure(**kwargs):
+    """Create the runtime used by default by the classifiers, see RuntimeConfig for the arguments."""
+    global _runtime
+
+    if _runtime is not None:
+        _runtime.session.close()
+    _runtime = RuntimeConfig(**kwargs)
+    return _runtime
+
+
+def get_runtime():
+    """Default runtime, configured from params on first use unless configure was called."""
+    return _runtime if _runtime is not None else configure()
@@ -0,0 +1,96 @@
+"""Single-pass STFT front end shared by the VGGish and GhostVLAD feature extractors.
+
+The magnitude STFT of an utterance is computed once (periodic Hann window of 400 samples, hop of 160 samples and FFT
+of 512 points at 16 kHz, the analysis used by both networks). VGGish log-mel patches are derived from all of its
+frames, while the GhostVLAD linear spectrogram keeps only the frames whose analysis window lies entirely inside the
+non-silent intervals found by the voice activity detection, rather than re-analysing the trimmed waveform.
+
+Note that, compared to FeaturesExtractor.load_data, the GhostVLAD frames are taken on the VGGish frame grid (frames
+start at multiples of the hop instead of being centred on them) and that the frames spanning the junction of two
+non-silent intervals of the trimmed waveform are not generated. Frames hence differ slightly from the original ones,
+within the bounds checked by test_ghostvlad_spectrogram_matches_features_extractor (see test/test_spectrogram.py).
+"""
+
+import numpy as np
+
+import params
+import startup
+import utils
+
+GHOSTVLAD_TOP_DB = 20  # Threshold (in dB below peak) used by the GhostVLAD voice activity detection
+
+
+def magnitude_spectrogram(waveform, dtype=None):
+    """Compute the magnitude STFT shared by both feature extractors.
+
+    Args:
+      waveform: 1-D np.array with the samples of the utterance at params.SAMPLE_RATE.
+      dtype: Floating point type of the computations, defaults to params.FEATURES_DTYPE.
+
+    Returns:
+      2-D np.array of shape (num_frames, fft_length // 2 + 1).
+    """
+    return utils.feature_plan(dtype).stft_magnitude(waveform)
+
+
+def vggish_examples(spectrogram):
+    """Compute VGGish input examples from the magnitude STFT.
+
+    Args:
+      spectrogram: Output of magnitude_spectrogram.
+
+    Returns:
+      See utils.waveform_to_examples.
+    """
+    log_mel = utils.feature_plan(spectrogram.dtype).magnitude_to_log_mel(spectrogram, log_offset=params.LOG_OFFSET)
+    return utils.log_mel_to_examples(log_mel)
+
+
+def voiced_frames_mask(num_frames, intervals):
+    """Select the STFT frames whose analysis window is entirely contained in a non-silent interval.
+
+    Args:
+      num_frames: Number of frames of the magnitude STFT.
+      intervals: 2-D np.array of shape (num_intervals, 2) with the [start, end) samples of each non-silent interval.
+
+    Returns:
+      1-D boolean np.array of length num_frames.
+    """
+    plan = utils.feature_plan()
+    starts = np.arange(num_frames) * plan.hop_length_samples
+    mask = np.zeros(num_frames, dtype=bool)
+    for start, end in intervals:
+        mask |= (starts >= start) & (starts + plan.window_length_samples <= end)
+    return mask
+
+
+def ghostvlad_spectrogram(spectrogram, waveform, top_db=GHOSTVLAD_TOP_DB, intervals=None):
+    """Derive the VAD-trimmed GhostVLAD linear spectrogram from the magnitude STFT.
+
+    Args:
+      spectrogram: Output of magnitude_spectrogram.
+      waveform: 1-D np.array with the samples the spectrogram was computed from, used for voice activity detection.
+      top_db: Threshold (in dB below peak) to consider a region as silent.
+      intervals: Non-silent intervals of waveform, if already available (e.g. from FeaturesExtractor.load_wav with
+        return_intervals=True), in which case the voice activity detection is skipped.
+
+    Returns:
+      2-D np.array of shape (fft_length // 2 + 1, num_voiced_frames), the layout of FeaturesExtractor spectrograms.
+    """
+    if intervals is None:
+        intervals = startup.import_librosa().effects.split(waveform, top_db=top_db)
+    mask = voiced_frames_mask(spectrogram.shape[0], intervals)
+    return spectrogram[mask].T
+
+
+def extract_spectrograms(waveform):
+    """Compute both VGGish examples and GhostVLAD spectrogram with a single STFT.
+
+    Args:
+      waveform: 1-D np.array with the samples of the utterance at params.SAMPLE_RATE.
+
+    Returns:
+      Tuple with the VGGish examples and the GhostVLAD linear spectrogram.
+    """
+    spectrogram = magnitude_spectrogram(waveform, dtype=waveform.dtype)
+    return vggish_examples(spectrogram), ghostvlad_spectrogram(spectrogram, waveform)
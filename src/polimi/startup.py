@@ -0,0 +1,39 @@
+"""Startup helpers.
+
+Importing the PATHOSnet modules does not import TensorFlow, Keras or librosa: the former are imported when the models
+are built (see registry and runtime), librosa when the feature extraction first needs it, through import_librosa.
+librosa compiles part of its functions with numba at first use; import_librosa points numba at a persistent cache
+directory (params.NUMBA_CACHE_DIR) beforehand, so that the compiled functions are reused after a restart.
+"""
+
+import functools
+import os
+import sys
+
+import params
+
+
+def configure_numba_cache(cache_dir=None):
+    """Set the directory where numba caches the compiled functions.
+
+    Args:
+      cache_dir: Cache directory, defaults to params.NUMBA_CACHE_DIR; None (in both) leaves the numba default. A
+        NUMBA_CACHE_DIR environment variable, if set, takes precedence.
+    """
+    cache_dir = params.NUMBA_CACHE_DIR if cache_dir is None else cache_dir
+    if cache_dir is None or 'NUMBA_CACHE_DIR' in os.environ:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ['NUMBA_CACHE_DIR'] = cache_dir
+    # numba reads its configuration when imported
+    if 'numba' in sys.modules:
+        sys.modules['numba'].config.reload_config()
+
+
+@functools.lru_cache(maxsize=None)
+def import_librosa():
+    """Import librosa (once), after configuring the numba cache."""
+    configure_numba_cache()
+    import librosa
+
+    return librosa
@@ -0,0 +1,90 @@
+import json
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+
+def _run_stages(args):
+    # Time the startup stages in this (fresh) process, reported as a JSON line on the standard output
+    times = {}
+    start = time.perf_counter()
+    import params
+    if args.numba_cache_dir is not None:
+        params.NUMBA_CACHE_DIR = args.numba_cache_dir
+    from pathosnet import pathosnet_multimodal_classifier, pathosnet_voice_classifier
+    times['import (s)'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if args.modality == 'multimodal':
+        classifier = pathosnet_multimodal_classifier(args.model_weights_path, args.word_embeddings_path,
+                                                     args.vggish_weights_path, args.ghostvlad_weights_path)
+    else:
+        classifier = pathosnet_voice_classifier(args.model_weights_path, args.vggish_weights_path,
+                                                args.ghostvlad_weights_path)
+    times['models loading (s)'] = time.perf_counter() - start
+
+    # The first call pays for numba compilation (unless cached) and TensorFlow graph initialisation, the second one
+    # is a regular call
+    for name in ['first call (s)', 'second call (s)']:
+        start = time.perf_counter()
+        classifier.warm_up()
+        times[name] = time.perf_counter() - start
+    print(json.dumps(times))
+
+
+def main(arguments):
+    # Read command line arguments   ------------------------------------------------------------------------------------
+    args_parser = ArgumentParser()
+    # Model paths arguments
+    args_parser.add_argument('--model_weights_path', type=str, required=True,
+                             help="Path to the h5 file hosting PATHOSnet model weights.")
+    args_parser.add_argument('--vggish_weights_path', type=str, required=True,
+                             help="Path to the h5 file hosting VGGish model weights.")
+    args_parser.add_argument('--ghostvlad_weights_path', type=str, required=True,
+                             help="Path to the h5 file hosting GhostVlad model weights.")
+    args_parser.add_argument('--word_embeddings_path', type=str,
+                             help="Path to the file hosting the word embeddings, used only by the multimodal model.")
+    args_parser.add_argument('--modality', type=str, default='multimodal', choices=['multimodal', 'voice'],
+                             help="Modality of the PATHOSnet model.")
+    # Benchmark arguments
+    args_parser.add_argument('--repetitions', type=int, default=5,
+                             help="Number of measured process startups.")
+    args_parser.add_argument('--numba_cache_dir', type=str,
+                             help="Directory of the numba cache (defaults to params.NUMBA_CACHE_DIR), pass an empty "
+                                  "directory to measure the first startup after the installation.")
+    args_parser.add_argument('--run_stages', action='store_true',
+                             help="Time the stages in this process (used internally by the benchmark).")
+
+    args = args_parser.parse_args(arguments)
+    if args.modality == 'multimodal' and args.word_embeddings_path is None:
+        args_parser.error("the multimodal model requires --word_embeddings_path")
+
+    if args.run_stages:
+        _run_stages(args)
+        return 0
+
+    # Measure startups in new processes  -------------------------------------------------------------------------------
+    results = []
+    for repetition in range(args.repetitions):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, __file__, '--run_stages'] + arguments, check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        total = time.perf_counter() - start
+        results.append(dict(json.loads(output.strip().splitlines()[-1]), **{'process total (s)': total}))
+        print("Startup {}/{}: {:.2f} s".format(repetition + 1, args.repetitions, total))
+
+    # The first startup may populate the numba cache, hence it is reported apart from the median of the others
+    results_df = pd.DataFrame(results, index=['startup {}'.format(i + 1) for i in range(len(results))])
+    if len(results) > 1:
+        results_df.loc['median (startups 2-{})'.format(len(results))] = results_df.iloc[1:].apply(np.median)
+    print(results_df.to_string(float_format='{:.3f}'.format))
+
+    return 0
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,10 +1,10 @@
 """Compute input examples for VGGish from audio waveform."""
 
 import numpy as np
-import resampy
 
 import mel_features
 import params
+import resampling
 import csv
 import io
 
@@ -25,7 +25,24 @@ except ImportError:
     raise NotImplementedError('WAV file reading requires soundfile package.')
 
 
-def waveform_to_examples(data, sample_rate):
+def feature_plan(dtype=None):
+  """Returns the cached mel_features.FeaturePlan with the VGGish setup.
+
+  Args:
+    dtype: Floating point type of the computations, defaults to
+      params.FEATURES_DTYPE.
+  """
+  return mel_features.get_plan(
+      audio_sample_rate=params.SAMPLE_RATE,
+      window_length_secs=params.STFT_WINDOW_LENGTH_SECONDS,
+      hop_length_secs=params.STFT_HOP_LENGTH_SECONDS,
+      num_mel_bins=params.NUM_MEL_BINS,
+      lower_edge_hertz=params.MEL_MIN_HZ,
+      upper_edge_hertz=params.MEL_MAX_HZ,
+      dtype=np.dtype(params.FEATURES_DTYPE if dtype is None else dtype).name)
+
+
+def waveform_to_examples(data, sample_rate, dtype=None):
   """Converts audio waveform into an array of examples for VGGish.
 
   Args:
@@ -34,6 +51,8 @@ def waveform_to_examples(data, sample_rate):
       Each sample is generally expected to lie in the range [-1.0, +1.0],
       although this is not required.
     sample_rate: Sample rate of data.
+    dtype: Floating point type of the computations, defaults to
+      params.FEATURES_DTYPE.
 
   Returns:
     3-D np.array of shape [num_examples, num_frames, num_bands] which represents
@@ -41,25 +60,32 @@ def waveform_to_examples(data, sample_rate):
     spectrogram, covering num_frames frames of audio and num_bands mel frequency
     bands, where the frame length is params.STFT_HOP_LENGTH_SECONDS.
   """
+  dtype = np.dtype(params.FEATURES_DTYPE if dtype is None else dtype)
   # Convert to mono.
   if len(data.shape) > 1:
-    data = np.mean(data, axis=1)
+    data = np.mean(data, axis=1, dtype=dtype)
   # Resample to the rate assumed by VGGish.
   if sample_rate != params.SAMPLE_RATE:
-    data = resampy.resample(data, sample_rate, params.SAMPLE_RATE)
+    data = resampling.resample(data, sample_rate, params.SAMPLE_RATE)
 
   # Compute log mel spectrogram features.
-  log_mel = mel_features.log_mel_spectrogram(
-      data,
-      audio_sample_rate=params.SAMPLE_RATE,
-      log_offset=params.LOG_OFFSET,
-      window_length_secs=params.STFT_WINDOW_LENGTH_SECONDS,
-      hop_length_secs=params.STFT_HOP_LENGTH_SECONDS,
-      num_mel_bins=params.NUM_MEL_BINS,
-      lower_edge_hertz=params.MEL_MIN_HZ,
-      upper_edge_hertz=params.MEL_MAX_HZ)
+  log_mel = feature_plan(dtype).log_mel_spectrogram(
+      data, log_offset=params.LOG_OFFSET)
 
   # Frame features into examples.
+  return log_mel_to_examples(log_mel)
+
+
+def log_mel_to_examples(log_mel):
+  """Frames a log mel spectrogram into an array of examples for VGGish.
+
+  Args:
+    log_mel: 2-D np.array of shape [num_frames, num_bands], with frames spaced
+      by params.STFT_HOP_LENGTH_SECONDS.
+
+  Returns:
+    See waveform_to_examples.
+  """
   features_sample_rate = 1.0 / params.STFT_HOP_LENGTH_SECONDS
   example_window_length = int(round(
       params.EXAMPLE_WINDOW_SECONDS * features_sample_rate))
@@ -72,20 +98,23 @@ def waveform_to_examples(data, sample_rate):
   return log_mel_examples
 
 
-def wavfile_to_examples(wav_file):
+def wavfile_to_examples(wav_file, dtype=None):
   """Convenience wrapper around waveform_to_examples() for a common WAV format.
 
   Args:
     wav_file: String path to a file, or a file-like object. The file
     is assumed to contain WAV audio data with signed 16-bit PCM samples.
+    dtype: Floating point type of the computations, defaults to
+      params.FEATURES_DTYPE.
 
   Returns:
     See waveform_to_examples.
   """
   wav_data, sr = wav_read(wav_file)
   assert wav_data.dtype == np.int16, 'Bad sample type: %r' % wav_data.dtype
-  samples = wav_data / 32768.0  # Convert to [-1.0, +1.0]
-  return waveform_to_examples(samples, sr)
+  dtype = np.dtype(params.FEATURES_DTYPE if dtype is None else dtype)
+  samples = wav_data.astype(dtype) / dtype.type(32768.0)  # Convert to [-1.0, +1.0]
+  return waveform_to_examples(samples, sr, dtype=dtype)
 
 
 
@@ -95,9 +124,9 @@ def wavfile_to_examples(wav_file):
 ############################################
 
 class Embedder():
-    def __init__(self, path):
+    def __init__(self, path, dtype=None):
         embedding, id2word, word2id = load_vec(path)
-        self.embedding = embedding
+        self.embedding = embedding.astype(params.FEATURES_DTYPE if dtype is None else dtype, copy=False)
         self.word2id = word2id
         self.id2word = id2word
     def getEmbedding(self, word):
@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import keras.backend as K
+import numpy as np
+import pandas as pd
+from keras.layers import Conv2D, Dense
+
+import runtime
+from model import VGGISH_DENSE_LAYER_NAMES, get_vggish, get_vggish_dense_ranks, save_vggish_weights
+
+
+def factorize_dense(kernel, rank, svd=None):
+    # Truncated SVD of the kernel (inputs x units), split into the kernels of two stacked layers:
+    # (inputs x rank), with the singular values, and (rank x units)
+    u, s, vt = svd if svd is not None else np.linalg.svd(kernel, full_matrices=False)
+    return u[:, :rank] * s[:rank], vt[:rank]
+
+
+def compressed_vggish(vggish, ranks, svds=None):
+    # VGGish with the fully connected layers factorized to the given ranks (None keeps a layer full rank), the
+    # convolutional weights are copied from the original model
+    svds = svds if svds is not None else {}
+    compressed = get_vggish(dense_ranks=ranks)
+    for layer, original_layer in zip(compressed.layers, vggish.layers):
+        if isinstance(original_layer, Dense):
+            break
+        layer.set_weights(original_layer.get_weights())
+    for name, rank in zip(VGGISH_DENSE_LAYER_NAMES, ranks):
+        kernel, bias = vggish.get_layer(name).get_weights()
+        if rank is None:
+            compressed.get_layer(name).set_weights([kernel, bias])
+        else:
+            low_rank_kernel, kernel = factorize_dense(kernel, rank, svd=svds.get(name))
+            compressed.get_layer(name + '_low_rank').set_weights([low_rank_kernel])
+            compressed.get_layer(name).set_weights([kernel, bias])
+    return compressed
+
+
+def _flops(model):
+    # Floating point operations (a multiply-accumulate counts as two) of convolutional and fully connected layers,
+    # per example
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, Conv2D):
+            flops += 2 * np.prod(layer.output_shape[1:]) * np.prod(layer.kernel_size) * layer.input_shape[-1]
+        elif isinstance(layer, Dense):
+            flops += 2 * layer.input_shape[-1] * layer.units
+    return int(flops)
+
+
+def _latency(model, x, repetitions):
+    model.predict(x)  # Warm up
+    times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        model.predict(x)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main(arguments):
+    # Read command line arguments   ------------------------------------------------------------------------------------
+    args_parser = ArgumentParser()
+    # Model paths arguments
+    args_parser.add_argument('--vggish_weights_path', type=str, required=True,
+                             help="Path to the h5 file hosting VGGish model weights.")
+    # Compression arguments
+    args_parser.add_argument('--ranks', type=int, nargs='+', required=True,
+                             help="Ranks of the factorized fully connected layers, a weights file is written for "
+                                  "each of them (layers where the factorization does not save parameters are kept).")
+    # Benchmark arguments
+    args_parser.add_argument('--batch_size', type=int, default=32,
+                             help="Number of examples in the batch used to measure the latency.")
+    args_parser.add_argument('--repetitions', type=int, default=10,
+                             help="Number of repetitions of the latency measurement.")
+    # Evaluation arguments (optional)
+    args_parser.add_argument('--csv_file', type=str,
+                             help="Path to the csv file hosting the information about the test data, used to "
+                                  "evaluate PATHOSnet with each compressed VGGish (see pathosnet_test.py).")
+    args_parser.add_argument('--data_path', type=str, default='.',
+                             help="Path to the main directory hosting the data to label.")
+    args_parser.add_argument('--audio_file_path_col_name', type=str, default='audio_file_path',
+                             help="Name of the column hosting the audio file path in the data frame.")
+    args_parser.add_argument('--transcription_col_name', type=str, default='transcription',
+                             help="Name of the column hosting the transcription in the data frame.")
+    args_parser.add_argument('--label_col_name', type=str, default='emotion_label',
+                             help="Name of the column hosting the label in the data frame.")
+    args_parser.add_argument('--model_weights_path', type=str,
+                             help="Path to the h5 file hosting PATHOSnet model weights.")
+    args_parser.add_argument('--ghostvlad_weights_path', type=str,
+                             help="Path to the h5 file hosting GhostVlad model weights.")
+    args_parser.add_argument('--word_embeddings_path', type=str,
+                             help="Path to the file hosting the word embeddings, used only in multimodal analysis.")
+    args_parser.add_argument('--modality', type=str, default='multimodal', choices=['multimodal', 'voice'],
+                             help="Modality to use in the analysis.")
+    # Output arguments
+    args_parser.add_argument('--output_dir', type=str, required=True,
+                             help="Path to the directory where the compressed weights and the report are saved.")
+    # Misc arguments
+    args_parser.add_argument('--verbose', type=bool, default=False,
+                             help="Whether to be verbose or not.")
+
+    args = args_parser.parse_args(arguments)
+    if args.csv_file is not None and (args.model_weights_path is None or args.ghostvlad_weights_path is None):
+        args_parser.error("the evaluation requires --model_weights_path and --ghostvlad_weights_path")
+    if any(rank is not None for rank in get_vggish_dense_ranks(args.vggish_weights_path)):
+        args_parser.error("the VGGish weights are already factorized")
+
+    K.set_learning_phase(0)
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    # Compress and benchmark  ------------------------------------------------------------------------------------------
+    vggish = get_vggish(args.vggish_weights_path, verbose=args.verbose)
+    x = np.random.RandomState(0).uniform(size=(args.batch_size,) + vggish.input_shape[1:]).astype(np.float32)
+    y = vggish.predict(x)
+    # The SVD of each kernel is computed once and truncated at the different ranks
+    svds = {}
+    for name in VGGISH_DENSE_LAYER_NAMES:
+        if args.verbose:
+            print("Computing SVD of {}...".format(name))
+        svds[name] = np.linalg.svd(vggish.get_layer(name).get_weights()[0], full_matrices=False)
+
+    report = [{'rank': None, 'weights path': args.vggish_weights_path, 'parameters': vggish.count_params(),
+               'memory (MB)': vggish.count_params() * 4 / 2 ** 20, 'FLOPs per example': _flops(vggish),
+               'latency (s)': _latency(vggish, x, args.repetitions), 'mean absolute output error': 0.}]
+    for rank in args.ranks:
+        ranks = []
+        for name in VGGISH_DENSE_LAYER_NAMES:
+            n_inputs, units = vggish.get_layer(name).get_weights()[0].shape
+            ranks.append(rank if rank * (n_inputs + units) < n_inputs * units else None)
+        compressed = compressed_vggish(vggish, ranks, svds=svds)
+        path = os.path.join(args.output_dir, '{}_rank_{}.h5'.format(
+            os.path.splitext(os.path.basename(args.vggish_weights_path))[0], rank))
+        save_vggish_weights(compressed, path, dense_ranks=ranks)
+        report.append({'rank': rank, 'weights path': path, 'parameters': compressed.count_params(),
+                       'memory (MB)': compressed.count_params() * 4 / 2 ** 20, 'FLOPs per example': _flops(compressed),
+                       'latency (s)': _latency(compressed, x, args.repetitions),
+                       'mean absolute output error': float(np.mean(np.abs(compressed.predict(x) - y)))})
+        if args.verbose:
+            print("VGGish with ranks {} saved in {} file.\n".format(ranks, path))
+
+    # Evaluate  --------------------------------------------------------------------------------------------------------
+    if args.csv_file is not None:
+        from pathosnet import pathosnet_multimodal_classifier, pathosnet_voice_classifier
+        from pathosnet_test import analyse, summary_scores
+
+        data_df = pd.read_csv(args.csv_file)
+        for entry in report:
+            # Start each evaluation from an empty graph
+            runtime.get_runtime().reset()
+            if args.modality == 'multimodal':
+                classifier = pathosnet_multimodal_classifier(
+                    args.model_weights_path, args.word_embeddings_path, entry['weights path'],
+                    args.ghostvlad_weights_path, verbose=args.verbose)
+            else:
+                classifier = pathosnet_voice_classifier(
+                    args.model_weights_path, entry['weights path'], args.ghostvlad_weights_path, verbose=args.verbose)
+            scores = summary_scores(analyse(
+                classifier, data_df, args.data_path, args.modality,
+                audio_file_path_col_name=args.audio_file_path_col_name,
+                transcription_col_name=args.transcription_col_name, label_col_name=args.label_col_name,
+                verbose=args.verbose))
+            for name, name_scores in scores.items():
+                for score, value in name_scores.items():
+                    entry[name + ' ' + score] = value
+
+    # Save report  -----------------------------------------------------------------------------------------------------
+    report_df = pd.DataFrame(report)
+    report_path = os.path.join(args.output_dir, 'vggish_compression_report.csv')
+    report_df.to_csv(path_or_buf=report_path, index=False)
+    print(report_df.to_string(index=False))
+    if args.verbose:
+        print("\nReport saved in {} file.".format(report_path))
+
+    return 0
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,437 @@
+"""PATHOSnet inference worker processes.
+
+TensorFlow 1.x sessions and the numpy/librosa feature extraction (bound to the GIL in part of its computation) use
+only a fraction of the cores of a machine from a single process. A WorkerPool starts several worker processes (this
+script), each loading its own PATHOSnet classifier, and distributes the utterances to them over ZeroMQ:
+  - the pool binds a PUSH socket for each worker, connected to the PULL socket of the worker; all the utterances of a
+    key (e.g., the sensor group of a user) go to the same worker, hence they are classified in order;
+  - the pool binds a single PULL socket, collecting the results from the PUSH sockets of the workers.
+Messages are JSON objects: requests {"id": ..., "args": [...]} carry the arguments of the classifier (e.g., audio
+file path and transcription), results {"id": ..., "multilabel": {...}, "binary": {...}} its predictions (or
+{"id": ..., "error": ...}); each worker sends {"ready": ..., "pid": ...} once its models are loaded.
+
+In prefork mode a single process preloads what the workers can share (the Python modules, TensorFlow included, the
+word embeddings and the numba compilations), then forks the workers: their pages are shared copy-on-write until
+written, instead of being loaded N times. TensorFlow sessions (and their thread pools) do not survive a fork, hence
+each worker still builds its networks, and TensorFlow keeps its own copy of their weights, after forking (TensorFlow
+Lite models are memory mapped, their weights are shared by the page cache in any mode). WorkerPool.memory_usage reports
+the memory of each process.
+
+WorkerPool.restart can restart a single worker (e.g., the one of a user whose classification timed out), failing only
+its pending requests; in prefork mode the preloading process forks a new worker in place of the terminated one.
+"""
+
+import gc
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+from argparse import ArgumentParser
+from concurrent.futures import Future, TimeoutError
+
+import zmq
+
+# Polling period of the sockets (in milliseconds), to check whether the pool (or the worker parent) is still running
+POLL_PERIOD = 1000
+
+
+class WorkerPool(object):
+    """Pool of PATHOSnet worker processes, whose classify method can be called from any thread.
+
+    Args:
+      num_workers: Number of worker processes.
+      modality: Modality of the PATHOSnet classifier, either 'multimodal' or 'voice'.
+      classifier_args: Positional arguments (paths) of pathosnet.pathosnet_multimodal_classifier or
+        pathosnet.pathosnet_voice_classifier, according to the modality.
+      intra_op_parallelism_threads: Threads of the TensorFlow intra-op pool of each worker.
+      inter_op_parallelism_threads: Threads of the TensorFlow inter-op pool of each worker.
+      cpu_only: Whether to hide GPUs from the TensorFlow runtime of each worker, defaults to params.CPU_ONLY.
+      start_timeout: Longest wait for the workers to load their models, in seconds.
+      prefork: Whether to fork the workers from a process preloading the modules and the word embeddings, rather than
+        starting independent processes (Unix only).
+    """
+
+    def __init__(self, num_workers, modality, classifier_args, intra_op_parallelism_threads=1,
+                 inter_op_parallelism_threads=1, cpu_only=None, start_timeout=600., prefork=False):
+        self.num_workers = num_workers
+        self.prefork = prefork
+        self.worker_args = ['--modality', modality, '--classifier_args'] + [str(a) for a in classifier_args] + \
+            ['--intra_op_parallelism_threads', str(intra_op_parallelism_threads),
+             '--inter_op_parallelism_threads', str(inter_op_parallelism_threads)] + \
+            ([] if cpu_only is None else ['--cpu_only', str(int(cpu_only))])
+        self.start_timeout = start_timeout
+        # Inter-process endpoints, in a private directory
+        self._endpoints_dir = tempfile.mkdtemp(prefix='pathosnet-workers-')
+        self._context = zmq.Context()
+        self._results = self._context.socket(zmq.PULL)
+        self._results_endpoint = 'ipc://' + os.path.join(self._endpoints_dir, 'results')
+        self._results.bind(self._results_endpoint)
+        self._requests = []
+        self._requests_endpoints = []
+        for i in range(num_workers):
+            socket = self._context.socket(zmq.PUSH)
+            self._requests_endpoints.append('ipc://' + os.path.join(self._endpoints_dir, 'requests-{}'.format(i)))
+            socket.bind(self._requests_endpoints[-1])
+            self._requests.append(socket)
+        # ZeroMQ sockets are not thread safe, requests are sent under the lock of their worker socket (futures are
+        # registered and resolved under the pool lock)
+        self._lock = threading.Lock()
+        self._send_locks = [threading.Lock() for _ in range(num_workers)]
+        self._pending = {}  # Request id -> worker index, Future
+        self._next_id = 0
+        self._processes = []
+        self._ready = [threading.Event() for _ in range(num_workers)]
+        self._pids = [None] * num_workers
+        self._closed = False
+        self._collector = threading.Thread(target=self._collect, name='pathosnet-workers', daemon=True)
+        self._collector.start()
+        self._start_workers()
+
+    def worker_index(self, key):
+        """Index of the worker classifying the utterances of a key (stable across restarts)."""
+        return zlib.crc32(key.encode('utf-8')) % self.num_workers
+
+    def classify(self, key, *args, timeout=None):
+        """Classify an utterance in the worker of its key.
+
+        Args:
+          key: Affinity key of the utterance (e.g., the sensor group of the user).
+          args: Arguments of the classifier (audio file path and, for the multimodal one, transcription).
+          timeout: Longest wait for the result, in seconds (concurrent.futures.TimeoutError is raised then).
+
+        Returns:
+          The multilabel and binary predictions of the classifier.
+        """
+        worker_index = self.worker_index(key)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        future = Future()
+        while True:
+            # Requests are sent only to ready workers, a restarting one would not receive them
+            if not self._ready[worker_index].wait(timeout=None if deadline is None else
+                                                  max(deadline - time.monotonic(), 0.)):
+                raise TimeoutError()
+            if self._closed:
+                raise RuntimeError("PATHOSnet workers closed")
+            if not self._worker_running(worker_index):
+                raise RuntimeError("PATHOSnet worker {} exited".format(worker_index))
+            with self._lock:
+                if not self._ready[worker_index].is_set():
+                    continue  # Restarted in the meantime
+                request_id = self._next_id
+                self._next_id += 1
+                self._pending[request_id] = (worker_index, future)
+                break
+        try:
+            # A PUSH socket blocks while its worker is not connected (e.g., it exited after the check above): fail the
+            # request instead
+            with self._send_locks[worker_index]:
+                try:
+                    self._requests[worker_index].send_json({'id': request_id, 'args': list(args)}, flags=zmq.NOBLOCK)
+                except zmq.ZMQError as e:
+                    raise RuntimeError("PATHOSnet worker {} is not receiving requests".format(worker_index)) from e
+            return future.result(timeout=None if deadline is None else max(deadline - time.monotonic(), 0.))
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def memory_usage(self):
+        """Memory of the worker processes and, in prefork mode, of the preloading one (Linux only).
+
+        Returns:
+          Dictionary: process name: str -> memory: dict (see process_memory); the processes that are not running (e.g.,
+          a restarting worker, or all of them once the pool is stopped) are not included.
+        """
+        pids = {'worker {}'.format(i): pid for i, pid in enumerate(list(self._pids)) if pid is not None}
+        processes = self._processes  # Replaced by a restart in the meantime
+        if self.prefork and processes and processes[0].poll() is None:
+            pids['preloader'] = processes[0].pid
+        usage = {}
+        for name, pid in pids.items():
+            try:
+                usage[name] = process_memory(pid)
+            except (OSError, KeyError):
+                pass  # Exited in the meantime (a process not reaped yet has no mappings)
+        return usage
+
+    def memory_saved(self):
+        """Memory saved by the pages shared among the processes (see memory_usage), in bytes: the resident set sizes
+        count the pages shared by n processes n times, the proportional set sizes once in total."""
+        usage = self.memory_usage().values()
+        return sum(memory['rss'] for memory in usage) - sum(memory['pss'] for memory in usage)
+
+    def restart(self, worker_index=None):
+        """Stop workers, failing their pending requests, and start new ones.
+
+        Args:
+          worker_index: Index of the worker to restart (see worker_index), the other ones keep serving their requests;
+            None restarts all of them.
+        """
+        if worker_index is None or not self._processes or (self.prefork and self._processes[0].poll() is not None):
+            self._stop_workers()
+            self._start_workers()
+            return
+        with self._lock:
+            self._ready[worker_index].clear()
+            pid, self._pids[worker_index] = self._pids[worker_index], None  # Set by the ready message of the new worker
+            if self.prefork:
+                # The preloader forks a new worker in place of the terminated one
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            else:
+                self._processes[worker_index].terminate()
+                self._processes[worker_index].wait()
+                self._processes[worker_index] = subprocess.Popen(
+                    self._command([worker_index], [self._requests_endpoints[worker_index]]))
+            self._fail_pending({worker_index}, RuntimeError("PATHOSnet worker {} restarted".format(worker_index)))
+        self._wait_ready([worker_index])
+
+    def close(self):
+        """Stop the workers and release the sockets."""
+        self._stop_workers()
+        self._closed = True
+        for event in self._ready:
+            event.set()  # Wake up the requests waiting for a worker, they fail
+        self._collector.join()
+        for socket in self._requests + [self._results]:
+            socket.close(linger=0)
+        self._context.term()
+        shutil.rmtree(self._endpoints_dir, ignore_errors=True)
+
+    def _start_workers(self):
+        if self.prefork:
+            # A single process, forking all the workers
+            commands = [self._command(range(self.num_workers), self._requests_endpoints) + ['--prefork']]
+        else:
+            commands = [self._command([i], [endpoint]) for i, endpoint in enumerate(self._requests_endpoints)]
+        self._processes = [subprocess.Popen(command) for command in commands]
+        self._wait_ready(range(self.num_workers))
+
+    def _worker_running(self, worker_index):
+        # Whether the process of a worker (the preloader forking it, in prefork mode) is running
+        processes = self._processes  # Replaced by a restart in the meantime
+        if not processes:
+            return False
+        return (processes[0] if self.prefork else processes[worker_index]).poll() is None
+
+    def _wait_ready(self, worker_indices):
+        deadline = time.monotonic() + self.start_timeout
+        for i in worker_indices:
+            while not self._ready[i].wait(timeout=POLL_PERIOD / 1000.):
+                if any(process.poll() is not None for process in self._processes) or time.monotonic() > deadline:
+                    self._stop_workers()
+                    raise RuntimeError("PATHOSnet worker {} did not start".format(i))
+
+    def _command(self, worker_indices, requests_endpoints):
+        return [sys.executable, os.path.abspath(__file__), '--worker_index'] + [str(i) for i in worker_indices] + \
+            ['--requests_endpoint'] + list(requests_endpoints) + \
+            ['--results_endpoint', self._results_endpoint, '--parent_pid', str(os.getpid())] + self.worker_args
+
+    def _stop_workers(self):
+        with self._lock:
+            for event in self._ready:
+                event.clear()
+            self._pids = [None] * self.num_workers
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.wait()
+        self._processes = []
+        with self._lock:
+            self._fail_pending(range(self.num_workers), RuntimeError("PATHOSnet workers stopped"))
+
+    def _fail_pending(self, worker_indices, error):
+        # Fail the pending requests of the given workers, under the lock
+        for worker_index, future in list(self._pending.values()):
+            if worker_index in worker_indices and not future.done():
+                future.set_exception(error)
+
+    def _collect(self):
+        # Resolve the futures of the requests with the results of the workers
+        while not self._closed:
+            if not self._results.poll(POLL_PERIOD):
+                continue
+            message = self._results.recv_json()
+            if 'ready' in message:
+                self._pids[message['ready']] = message['pid']
+                self._ready[message['ready']].set()
+                continue
+            with self._lock:
+                _, future = self._pending.get(message['id'], (None, None))
+                if future is None or future.done():
+                    continue  # Timed out or failed by a restart
+                if 'error' in message:
+                    future.set_exception(RuntimeError(message['error']))
+                else:
+                    future.set_result((message['multilabel'], message['binary']))
+
+
+def process_memory(pid):
+    """Memory of a process, read from /proc/<pid>/smaps_rollup (Linux only).
+
+    Returns:
+      Dictionary: 'rss' (resident set size), 'pss' (proportional set size, where each page shared by n processes
+      counts 1/n), 'shared' and 'private' (resident pages shared with other processes or not) -> size in bytes: int.
+    """
+    path = '/proc/{}/smaps_rollup'.format(pid)
+    if not os.path.exists(path):
+        path = '/proc/{}/smaps'.format(pid)  # Kernels older than 4.14, with an entry for each mapping
+    fields = {}
+    with open(path) as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.rstrip().endswith(' kB'):
+                fields[name] = fields.get(name, 0) + int(value.split()[0]) * 1024
+    return {'rss': fields['Rss'], 'pss': fields['Pss'], 'shared': fields['Shared_Clean'] + fields['Shared_Dirty'],
+            'private': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+def run_preloader(args):
+    # Preload what the workers share, fork them, then wait until the parent process exits (or the preloader is
+    # terminated, stopping the workers as well)
+    import numpy as np
+
+    # Modules of the workers; importing Keras (hence TensorFlow) creates no session yet
+    import keras
+    import pathosnet
+    import params
+    import registry
+    import spectrogram
+
+    if args.modality == 'multimodal':
+        registry.preload_embedder(args.classifier_args[1])
+    # Compile the numba functions of the feature extraction
+    spectrogram.extract_spectrograms(np.random.RandomState(0).uniform(-0.1, 0.1, size=params.SAMPLE_RATE).astype(
+        params.FEATURES_DTYPE))
+    # Exclude the objects loaded so far from the garbage collection, which would write them (hence copy their pages)
+    # in each worker
+    gc.freeze()
+
+    workers = {}  # PID -> worker index and requests endpoint
+
+    def fork_worker(worker_index, requests_endpoint):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            status = 0
+            try:
+                run_worker(worker_index, requests_endpoint, os.getppid(), args)
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+        workers[pid] = worker_index, requests_endpoint
+
+    def stop_workers(signum=None, frame=None):
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass  # Reaped by the main loop in the meantime
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    for worker_index, requests_endpoint in zip(args.worker_index, args.requests_endpoint):
+        fork_worker(worker_index, requests_endpoint)
+    failed = False
+    while os.getppid() == args.parent_pid and not failed:
+        time.sleep(POLL_PERIOD / 1000.)
+        while workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            worker_index, requests_endpoint = workers.pop(pid)
+            if os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGTERM:
+                fork_worker(worker_index, requests_endpoint)  # Terminated by WorkerPool.restart
+            else:
+                failed = True  # Stop all the workers, the next WorkerPool.restart starts them again
+    stop_workers()
+
+
+def run_worker(worker_index, requests_endpoint, parent_pid, args):
+    # Load the classifier, then serve the requests until the parent process exits (or the worker is terminated)
+    import pathosnet
+    import runtime
+
+    runtime_config = runtime.configure(intra_op_parallelism_threads=args.intra_op_parallelism_threads,
+                                       inter_op_parallelism_threads=args.inter_op_parallelism_threads,
+                                       cpu_only=None if args.cpu_only is None else bool(args.cpu_only))
+    if args.modality == 'multimodal':
+        classifier = pathosnet.pathosnet_multimodal_classifier(*args.classifier_args, runtime_config=runtime_config)
+    else:
+        classifier = pathosnet.pathosnet_voice_classifier(*args.classifier_args, runtime_config=runtime_config)
+    classifier.warm_up()
+
+    context = zmq.Context()
+    requests = context.socket(zmq.PULL)
+    requests.connect(requests_endpoint)
+    results = context.socket(zmq.PUSH)
+    results.connect(args.results_endpoint)
+    results.send_json({'ready': worker_index, 'pid': os.getpid()})
+    while os.getppid() == parent_pid:
+        if not requests.poll(POLL_PERIOD):
+            continue
+        request = requests.recv_json()
+        try:
+            multilabel_prediction, binary_prediction = classifier(*request['args'])
+            results.send_json({'id': request['id'],
+                               'multilabel': {k: float(v) for k, v in multilabel_prediction.items()},
+                               'binary': {k: float(v) for k, v in binary_prediction.items()}})
+        except Exception as e:
+            results.send_json({'id': request['id'], 'error': repr(e)})
+    results.close(linger=0)
+    requests.close(linger=0)
+    context.term()
+
+
+def main(arguments):
+    # Read command line arguments   ------------------------------------------------------------------------------------
+    args_parser = ArgumentParser(description="PATHOSnet inference worker, started by WorkerPool.")
+    # Worker arguments
+    args_parser.add_argument('--worker_index', type=int, nargs='+', required=True,
+                             help="Index of the worker in the pool, one for each forked worker in prefork mode.")
+    args_parser.add_argument('--requests_endpoint', type=str, nargs='+', required=True,
+                             help="ZeroMQ endpoint of the requests, one for each forked worker in prefork mode.")
+    args_parser.add_argument('--results_endpoint', type=str, required=True,
+                             help="ZeroMQ endpoint of the results.")
+    args_parser.add_argument('--parent_pid', type=int, required=True,
+                             help="PID of the process hosting the pool, the worker exits with it.")
+    args_parser.add_argument('--prefork', action='store_true',
+                             help="Preload the shared models and fork the workers, rather than serving one.")
+    # Classifier arguments
+    args_parser.add_argument('--modality', type=str, required=True, choices=['multimodal', 'voice'],
+                             help="Modality of the PATHOSnet model.")
+    args_parser.add_argument('--classifier_args', type=str, nargs='+', required=True,
+                             help="Positional arguments (paths) of the classifier constructor.")
+    args_parser.add_argument('--intra_op_parallelism_threads', type=int, default=1,
+                             help="Threads of the TensorFlow intra-op pool.")
+    args_parser.add_argument('--inter_op_parallelism_threads', type=int, default=1,
+                             help="Threads of the TensorFlow inter-op pool.")
+    args_parser.add_argument('--cpu_only', type=int, choices=[0, 1], default=None,
+                             help="Whether to hide GPUs from TensorFlow (1) or not (0), defaults to params.CPU_ONLY.")
+
+    args = args_parser.parse_args(arguments)
+    if len(args.worker_index) != len(args.requests_endpoint):
+        args_parser.error("--worker_index and --requests_endpoint require the same number of values")
+    if not args.prefork and len(args.worker_index) > 1:
+        args_parser.error("several workers require --prefork")
+
+    # Serve requests   -------------------------------------------------------------------------------------------------
+    if args.prefork:
+        run_preloader(args)
+    else:
+        run_worker(args.worker_index[0], args.requests_endpoint[0], args.parent_pid, args)
+
+    return 0
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,121 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import soundfile as sf
+
+import params
+from workers import WorkerPool
+
+
+def _noise_files(path, num_files, duration):
+    # Low level noise of the given duration (so that the voice activity detection keeps it), one file per utterance
+    random_state = np.random.RandomState(0)
+    audio_file_paths = []
+    for i in range(num_files):
+        audio_file_paths.append(os.path.join(path, 'noise_{}.wav'.format(i)))
+        sf.write(audio_file_paths[-1], random_state.uniform(-0.1, 0.1, size=int(duration * params.SAMPLE_RATE)),
+                 params.SAMPLE_RATE)
+    return audio_file_paths
+
+
+def _run_users(pool, audio_file_paths, num_users, modality):
+    # Each user (a thread) classifies its utterances one after the other, as the service does
+    def run_user(user):
+        latencies = []
+        for audio_file_path in audio_file_paths[user::num_users]:
+            start = time.perf_counter()
+            pool.classify('user-{}'.format(user), *((audio_file_path, 'hola') if modality == 'multimodal' else
+                                                    (audio_file_path,)))
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=num_users) as executor:
+        return [latency for latencies in executor.map(run_user, range(num_users)) for latency in latencies]
+
+
+def main(arguments):
+    # Read command line arguments   ------------------------------------------------------------------------------------
+    args_parser = ArgumentParser()
+    # Model paths arguments
+    args_parser.add_argument('--model_weights_path', type=str, required=True,
+                             help="Path to the h5 file hosting PATHOSnet model weights.")
+    args_parser.add_argument('--vggish_weights_path', type=str, required=True,
+                             help="Path to the h5 file hosting VGGish model weights.")
+    args_parser.add_argument('--ghostvlad_weights_path', type=str, required=True,
+                             help="Path to the h5 file hosting GhostVlad model weights.")
+    args_parser.add_argument('--word_embeddings_path', type=str,
+                             help="Path to the file hosting the word embeddings, used only by the multimodal model.")
+    args_parser.add_argument('--modality', type=str, default='multimodal', choices=['multimodal', 'voice'],
+                             help="Modality of the PATHOSnet model.")
+    # Benchmark arguments
+    args_parser.add_argument('--max_workers', type=int, default=os.cpu_count(),
+                             help="Largest number of worker processes, the pools from 1 to max_workers are measured.")
+    args_parser.add_argument('--num_users', type=int, default=8,
+                             help="Number of concurrent users, each sending its utterances one after the other.")
+    args_parser.add_argument('--num_utterances', type=int, default=64,
+                             help="Number of classified utterances for each pool.")
+    args_parser.add_argument('--duration', type=float, default=3.,
+                             help="Duration of the utterances, in seconds.")
+    args_parser.add_argument('--intra_op_parallelism_threads', type=int, default=1,
+                             help="Threads of the TensorFlow intra-op pool of each worker.")
+    args_parser.add_argument('--inter_op_parallelism_threads', type=int, default=1,
+                             help="Threads of the TensorFlow inter-op pool of each worker.")
+    args_parser.add_argument('--prefork', action='store_true',
+                             help="Fork the workers from a process preloading the shared models (see WorkerPool).")
+
+    args = args_parser.parse_args(arguments)
+    if args.modality == 'multimodal' and args.word_embeddings_path is None:
+        args_parser.error("the multimodal model requires --word_embeddings_path")
+
+    classifier_args = (args.model_weights_path,) + \
+        ((args.word_embeddings_path,) if args.modality == 'multimodal' else ()) + \
+        (args.vggish_weights_path, args.ghostvlad_weights_path)
+    data_path = tempfile.mkdtemp(prefix='pathosnet-workers-benchmark-')
+    try:
+        audio_file_paths = _noise_files(data_path, args.num_utterances, args.duration)
+
+        # Measure the pools  -------------------------------------------------------------------------------------------
+        results = []
+        for num_workers in range(1, args.max_workers + 1):
+            start = time.perf_counter()
+            pool = WorkerPool(num_workers, args.modality, classifier_args,
+                              intra_op_parallelism_threads=args.intra_op_parallelism_threads,
+                              inter_op_parallelism_threads=args.inter_op_parallelism_threads, prefork=args.prefork)
+            startup_time = time.perf_counter() - start
+            try:
+                start = time.perf_counter()
+                latencies = _run_users(pool, audio_file_paths, args.num_users, args.modality)
+                total = time.perf_counter() - start
+                # Memory after serving, once the workers have written what inference writes
+                memory_usage = pool.memory_usage()
+                memory_saved = pool.memory_saved()
+            finally:
+                pool.close()
+            worker_rss = [memory['rss'] for name, memory in memory_usage.items() if name.startswith('worker')]
+            results.append({'workers': num_workers, 'startup (s)': startup_time,
+                            'throughput (utterances/s)': len(latencies) / total,
+                            'median latency (s)': np.median(latencies),
+                            '95th percentile latency (s)': np.percentile(latencies, 95),
+                            'worker RSS (MB)': np.mean(worker_rss) / 2 ** 20,
+                            'total PSS (MB)': sum(memory['pss'] for memory in memory_usage.values()) / 2 ** 20,
+                            'saved (MB)': memory_saved / 2 ** 20})
+            print("{} worker(s): {:.2f} utterances/s".format(num_workers, results[-1]['throughput (utterances/s)']))
+    finally:
+        shutil.rmtree(data_path, ignore_errors=True)
+
+    results_df = pd.DataFrame(results).set_index('workers')
+    results_df['speedup'] = results_df['throughput (utterances/s)'] / results_df['throughput (utterances/s)'].iloc[0]
+    print(results_df.to_string(float_format='{:.3f}'.format))
+
+    return 0
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
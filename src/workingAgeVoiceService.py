@@ -1 +1 @@
-#! /usr/bin/env python3# -*- coding: UTF-8 -*-"""Main script handling voice.Author : R. Tedesco, V. Scotti - Politecnico di MilanoDate   : 2021-01-13Version: v0.6The whole software stack is composed by:- This script, usually run as a systemd service (see info files)- PerVoice Audioma ASR: service and configuration files (see Audioma manual)- PATHOSnet classifier- AUD classifierDESCRIPTION:    THREAD Receive    - do        - get new file list from folder Voice        - for each file            - if the sensor who sent the file is not in "stop"                - move to folder ASR            - else                - delete the file            - sleep so that, in total, the current loop lasts 1 second    - while not STOP    THREAD Classify    - do        - get new file list from folders ASR        - for each pair of wav and txt files            - read wav and txt files            - move (asynchronously) the files to folder ClassifierTempStorage            - use classifier            - send class to app            - sleep so that, in total, the current loop lasts 1 second    - while not STOP    THREAD UserRegistration    - do        - wait for message of new user        - update data structure        - update Pickle file    - while not STOP    THERAD StartStop    -do        - wait for start/stop message about a sensor group        - update "start/stop" status for a given sensor group    - while not STOPTO STOP THE PROCESS (see: https://www.gnu.org/software/libc/manual/html_node/Termination-Signals.html):- use the SIGTERM signal (command: "kill -15 [PID of the process]) or use the "jobs" command for managing jobs- or press CTRL-C, when in foreground mode (i.e., SIGINT)NOTICE:All data folders must be placed into the LUKS partition, mounted at: /securestorageSEE ALSO:https://docs.python.org/2/library/signal.htmlhttps://stackoverflow.com/questions/1112343/how-do-i-capture-sigint-in-pythonhttps://realpython.com/intro-to-python-threading/https://stackoverflow.com/a/46098711https://docs.python.org/3/library/logging.htmlhttps://stackoverflow.com/a/24862213http://effbot.org/zone/thread-synchronization.htmhttps://stackoverflow.com/questions/6953351/thread-safety-in-pythons-dictionaryhttps://stackoverflow.com/questions/16249440/changing-file-permission-in-pythonREQUIRED LIBRARIES/PACKETS:- Python library: PyCryptodome - Handles encryption- Python library: Pyzmq - Communication with Apps- Packet FFmpeg (the "ffmpeg" command must be in PATH) - Transcodes FLAC into WAV"""import loggingimport subprocessimport osimport statimport signalimport sysimport threadingimport timefrom os import listdirimport shutilfrom os import pathimport pickleimport dataclassesfrom Crypto.Cipher import PKCS1_OAEPfrom Crypto.PublicKey import RSAimport base64import reimport zmq  # The ZeroMQ libraryimport jsonfrom datetime import datetimefrom typing import Dict# Path extension to include PoliMI and AUD classifierssys.path.extend(["/home/workingage/WACode/polimi", "/home/workingage/WACode"])  # TODO uncommentfrom pathosnet import pathosnet_multimodal_classifier, \    pathosnet_voice_classifier  # The PATHOSnet library # TODO remove polimifrom aud import aud_classifier  # The Audeering library#################################### BEGIN CONFIGURATION ######################################## LOGGING MODE ####date_time_experiment = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')  # date-time as unique identifier of the logrunAs = "systemd"  # could be "background", "systemd", "foreground"; if "systemd", be sure to properly set the corresponding systemd service definition fileloggingFileAbsolutePath = f"/home/workingage/WACode/logs/workingAgeVoiceService_{date_time_experiment}.log"  # used by "background" and "systemd"LogFileAppendMode = False  # could be True or False; False means that whenever the script restarts, the log file is overwritten# Logging level: you’re telling the library you want to handle all events from that level on up# Levels: CRITICAL > ERROR > WARNING > INFO > DEBUG > NOTSETloggingLevel = logging.DEBUG# loggingLevel = logging.INFO#### SECURE STORAGE PATHS AND POLLING TIME ####voiceFolderAbsolutePath = "/securestorage/voice/"  # contains FLAC files copied by Raspberry PIs ("voice" is lowercase)textFolderAbsolutePath = "/securestorage/text/"  # contains .pvt files generated by ASR ("text" is lowercase)ASRVoiceFolderAbsolutePath = "/securestorage/ASRVoice/"  # contains WAV files transcoded from FLAC filesASRTextFolderAbsolutePath = "/securestorage/ASRText/"  # contains transcribed XMLclassificationFolderAbsolutePath = "/securestorage/Classification/"  # contains EMO files with classstorageFolderAbsolutePath = "/securestorage/Storage/"  # contains FLAC, TXT and EMO files for long-term storagecheckPeriod = 2  # Checks the folder every 2 seconds max#### SENSOR-USER ASSOCIATION FILE ####userDataPickleFileAbsolutePathName = "/home/workingage/WACode/user_data.pkl"  # DO NOT CHANGE THE FILE NAME !!!#### ZEROMQ PROXY ####zeroMQProxyHostName = "zeromqproxy.workingage.eu"zeroMQProxyPortNumberForPub = "5560"  # DO NOT CHANGE THE PORT NUMBER !!!zeroMQProxyPortNumberForSub = "5559"  # DO NOT CHANGE THE PORT NUMBER !!!#### TIMER FOR ASSUMING STOP MODE ##### If a user leaves without stopping its data recordings, "stop" is assumed after this time thresholdstopThreshold = 10 * 60  # seconds to wait between two "start" messages, before assuming "stop"#### PATHOSNET CONFIGURATION ####PATHOSnetVGGisAcousticFeaturesModelAbsolutePath = "/home/workingage/WACode/polimi/checkpoints/weights_vggish.h5"  # Path to the model for acoustic features VGGishPATHOSnetGhostVladAcousticFeaturesModelAbsolutePath = "/home/workingage/WACode/polimi/ghostvlad/pretrained_models/ghostvlad_weights.h5"  # Path to the model for acoustic features GhostVladPATHOSnetEspModelWeightsAbsolutePath = "/home/workingage/WACode/polimi/checkpoints/pathosnet_esp_multimodal.h5"  # Path to the weights of the model for Spanish emotion recognition from voice and textPATHOSnetEspWordEmbeddingsAbsolutePath = "/home/workingage/WACode/polimi/MUSE/data/wiki.es.vec"  # Path to the spanish word embeddingsPATHOSnetElModelWeightsAbsolutePath = "/home/workingage/WACode/polimi/checkpoints/pathosnet_el_audio.h5"  # Path to the weights of the model for Greek emotion recognition from voicePATHOSnetModelLang = "Eng"  # Language code to interact with the dict, either "Esp", "El" or "Eng" (Greek and English does not work with transcription)#### CLASSIFICATION MODE ####classificationMode = "binary"  # should be either "binary" or "multilabel";  holds for both AUD and POLIMI classifiers#################################### END CONFIGURATION ##################################### Classification constants ---------------------------------------------------------------------------------------------LABELS = ['Happiness', 'Anger', 'Sadness', 'Neutral']AUDEERING_LABELS = ['happy', 'angry', 'sad', 'neutral']AUDEERING_LABELS_CONVERSION_DICT = dict(zip(LABELS, AUDEERING_LABELS))BINARY_LABELS = ['Positive', 'Negative']LABELS_CONVERSION_DICT = {'Positive': ['Happiness', 'Neutral'], 'Negative': ['Anger', 'Sadness']}BINARY_CONVERSION_DICT = {'Happiness': 'Positive', 'Anger': 'Negative', 'Sadness': 'Negative', 'Neutral': 'Positive'}LANG = PATHOSnetModelLangPOLIMI_WEIGHTS_DICT = {"Esp": 0.466, "El": 0.469, "Eng": 0.0}POLIMI_PREDICTION_WEIGHT = POLIMI_WEIGHTS_DICT[LANG]AUD_WEIGHTS_DICT = {"Esp": 0.534, "El": 0.531, "Eng": 1.0}AUD_PREDICTION_WEIGHT = AUD_WEIGHTS_DICT[LANG]ENSEBMBLE_BINARY_CLASSIFICATION_THRESHOLD_DICT = {"Esp": 0.4, "El": 0.4, "Eng": 0.4}ENSEBMBLE_BINARY_CLASSIFICATION_THRESHOLD = ENSEBMBLE_BINARY_CLASSIFICATION_THRESHOLD_DICT[LANG]# End classification constants -----------------------------------------------------------------------------------------# PATHOSnet initialization# Dictionary to retrieve the functions and arguments to instantiate a model starting from the languagePATHOSnetModelGetterDict = {"Esp": {"model_getter": pathosnet_multimodal_classifier,                                    "args": (                                    PATHOSnetEspModelWeightsAbsolutePath, PATHOSnetEspWordEmbeddingsAbsolutePath,                                    PATHOSnetVGGisAcousticFeaturesModelAbsolutePath,                                    PATHOSnetGhostVladAcousticFeaturesModelAbsolutePath)},                            "El": {"model_getter": pathosnet_voice_classifier,                                   "args": (                                   PATHOSnetElModelWeightsAbsolutePath, PATHOSnetVGGisAcousticFeaturesModelAbsolutePath,                                   PATHOSnetGhostVladAcousticFeaturesModelAbsolutePath)},                            "Eng": {"model_getter": pathosnet_voice_classifier,                                    "args": (PATHOSnetElModelWeightsAbsolutePath,                                             PATHOSnetVGGisAcousticFeaturesModelAbsolutePath,                                             PATHOSnetGhostVladAcousticFeaturesModelAbsolutePath)}}  # For English we use ony a dummy model, predictions will be done only using Audeering voice model# Instance of a PATHOSnet model for emotion classificationimport tensorflow as tf  # Needed; otherwise, TF does not make the graph available on another threadgraph = tf.get_default_graph()  # see: https://stackoverflow.com/a/50467697PATHOSnetClassifier = PATHOSnetModelGetterDict[PATHOSnetModelLang]["model_getter"](*PATHOSnetModelGetterDict[PATHOSnetModelLang]["args"], verbose=True)# Thread statusreceiverThreadStatus = "stop"classifierThreadStatus = "stop"userRegistrationThreadStatus = "stop"userConsentThreadStatus = "stop"startStopThreadStatus = "stop"# Data structure containing inf in users and sensors; stored into the Pickle file; see: userDataPickleFileAbsolutePathName@dataclasses.dataclassclass UserDatumType:  # Data class type: info known for each user    userPseudoID: str    encryptor: PKCS1_OAEP.PKCS1OAEP_Cipher    publickey: RSA.RsaKey    consentDataCollection: bool = True  # Default consent flag of a user    consentHeadsetAndCamera: bool = False  # Default consent flag of a user    consentScientificPurposes: bool = False  # Default consent flag of a user    consentPublication: bool = False  # Default consent flag of a useruserData: Dict[str, UserDatumType] = {}  # key is the SensorGroupID, value is the UserDatum typeuserDataLock = threading.Lock()  # because userData is used by different threadsuserFileLock = threading.Lock()  # because user data file is used by different threads# the state of each user: start or stop; if a user is not into the dictionary, default is STOPuserState = {}  # key is the UserPseudoID, value is "start:"+timestamp; if a SensorGroupID is not here, it is in "stop" stateuserStateLock = threading.Lock()  # because userState is used by different threads# misccurrentTimestamp = datetime.now().strftime("%Y%m%d%H%M%S")global LOG############# THREADS #############def receiverThread():    """    Wait for FLAC files copied (via scp) by the AUC noiseBox device, and move them to the folder there ASR waits for them.    :return: Nothing.    """    global receiverThreadStatus, currentTimestamp, voiceFolderAbsolutePath, \        ASRVoiceFolderAbsolutePath, userStateLock, userState, userData    receiverThreadStatus = "run"    LOG.info("receiverThread() - Thread receiver running...")    alreadyLoggedWarning = False    while not receiverThreadStatus == "requestToStop":        startTime = time.time()        flacFiles = [f for f in listdir(voiceFolderAbsolutePath) if f.endswith("flac")]  # only file names, without path        if flacFiles != [] and not userData:            if not alreadyLoggedWarning:                LOG.warning("receiverThread() - FLAC files present but Pickle file empty: I can't process any FLAC file. Waiting...")                alreadyLoggedWarning = True  # To avoid logging a lot of time the same warning...            time.sleep(checkPeriod)        else:            for flacFile in flacFiles:                LOG.info("receiverThread() - received FLAC file: " + flacFile)                # Set sensorGroupID from file name like: S4188c841-e28a-4865-b233-d39a465358ff_20201022T23_23_45_345656.flac                sensorGroupID = re.search('^(S[^_]+)_', flacFile).group(1)  # like S4188c841-e28a-4865-b233-d39a465358ff                # Is sensorGroupID known?                userDataLock.acquire()                LOG.debug("receiverThread() - User data lock acquired to search for sensorGroupID")                found = userData.get(sensorGroupID)                userDataLock.release()                LOG.debug("receiverThread() - User data lock released")                if found is not None:                    # process sensor group if it is "start"                    userStateLock.acquire()                    LOG.debug("receiverThread() - User state lock acquired to search for userPseudoID")                    state = userState.get(found.userPseudoID, "notfound")                    if "start" in state:  # user is registered and is in start mode                        lastStart = int(state.split(":")[1])  # extract timestamp of the last start message                        if (datetime.now() - datetime.strptime(str(lastStart), "%Y%m%d%H%M%S")).total_seconds() <= stopThreshold:                            currentTimestamp = datetime.now().strftime("%Y%m%d%H%M%S")                            LOG.debug("receiverThread() - Received FLAC file: " + flacFile)                            pre, _ = os.path.splitext(flacFile)                            wavFile = pre + '.wav'                            result = None                            try:                                # ffmpeg must be in PATH                                result = subprocess.check_output('ffmpeg -y -i %s %s' % (voiceFolderAbsolutePath + flacFile, voiceFolderAbsolutePath + wavFile), stderr=subprocess.STDOUT, shell=True)                                LOG.debug("receiverThread() - Converted into WAV file: " + wavFile)                            except subprocess.CalledProcessError as e:                                result = None                                LOG.error("receiverThread() - Command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))                            except BaseException as e:                                result = None                                LOG.error("receiverThread() - Generic error occurred, output: '{}'".format(e))                            except:                                result = None                                LOG.error("receiverThread() - Generic unknown error occurred")                            # check whether the FLAC file was empty or not correct                            if result is None or "Output file is empty" in result.decode('utf-8') or "not contain any stream" in result.decode('utf-8'):                                os.remove(voiceFolderAbsolutePath + flacFile)  # remove void/corrupted FLAC file                                if path.exists(voiceFolderAbsolutePath + wavFile):                                    os.remove(voiceFolderAbsolutePath + wavFile)  # remove void WAV file, if created                            else:                                shutil.move(voiceFolderAbsolutePath + wavFile, ASRVoiceFolderAbsolutePath + wavFile)  # Move wav file to the next step                                # shutil.move(voiceFolderAbsolutePath + flacFile, storageFolderAbsolutePath + flacFile)  # Move flac file to the storage TODO remove this line                                os.remove(voiceFolderAbsolutePath + flacFile)  # Delete flac file if the user did not give consent to store TODO uncomment this line                                LOG.debug("receiverThread() - Moved WAV file: %s and removed FLAC file: %s" % (wavFile, flacFile))                        else:  # user is registered but is inferred in stop mode                            userState.pop(found.userPseudoID)  # remove sensorGroupID, since it is inferred as stopped                            # shutil.move(voiceFolderAbsolutePath + flacFile, storageFolderAbsolutePath + flacFile)  # Move flac file to the storage TODO remove this line                            os.remove(voiceFolderAbsolutePath + flacFile)  # FLAC file removed as the sensor group is in "stop" mode TODO uncomment this line                            LOG.info("receiverThread() - sensorGroupID '{}' assumed as stopped: no 'start' messages received within time threshold".format(sensorGroupID))                    else:  # user is registered but is in stop mode (i.e., "notfound", means user is in stop mode)                        # shutil.move(voiceFolderAbsolutePath + flacFile, storageFolderAbsolutePath + flacFile)  # Move flac file to the storage TODO remove this line                        os.remove(voiceFolderAbsolutePath + flacFile)  # FLAC file removed as the sensor group is in "stop" mode TODO uncomment this line                        LOG.info("receiverThread() - FLAC file: {} deleted, as {} is in 'stop' mode".format(flacFile, sensorGroupID))                    userStateLock.release()                    LOG.debug("receiverThread() - User state lock released")                else:  # user is not registered                    LOG.error("receiverThread() - Received sensor ID '{}' not found in data structure containing the Pickle file: ignoring it".format(sensorGroupID))        delta = checkPeriod - (time.time() - startTime)        time.sleep(delta if delta > 0 else 0)  # wait no longer than checkPeriod seconds    LOG.info("receiverThread() - Thread receiver stopped.")    receiverThreadStatus = "stop"# def simulatedASRThread():#     """#     This thread simulates the ASR: waits for a new wav file and creates the corresponding txt file with transcription.#     NB: this simulation creates multiple txt for the same wav; the actual ASR should run only on NEW wav arrival#     :return: Nothing.#     """#     global simulatedASRThreadStatus, ASRVoiceFolderAbsolutePath, ASRTextFolderAbsolutePath##     simulatedASRThreadStatus = "run"#     LOG.info("simulatedASRThread() - Thread ASR running...")#     while not simulatedASRThreadStatus == "requestToStop":#         wavFiles = [f for f in listdir(ASRVoiceFolderAbsolutePath) if f.endswith("wav")]#         for wavFile in wavFiles:##             #  BEGIN ASR SIMULATION#             pre, _ = os.path.splitext(wavFile) # only file names, without path#             time.sleep(2)#             with open(ASRTextFolderAbsolutePath + pre + '.txt', 'w', encoding='utf-8') as f:#                 f.write("pippo\n")#             #  END ASR SIMULATION##     LOG.info("simulatedASRThread() - Thread ASR stopped.")#     simulatedASRThreadStatus = "stop"def classifierThread():    """    Waits for txt and wav files on the ASR folder, read them, runs the emotion classifier code,    and copy the wav, txt and emo files to the temporary folder for encryption.    :return: Nothing.    """    global classifierThreadStatus, currentTimestamp, \        ASRTextFolderAbsolutePath, classificationFolderAbsolutePath, \        userData, userDataLock    classifierThreadStatus = "run"    LOG.info("classifierThread() - Thread classifier running...")    # Connect to ZeroMQ as a PUBLISHER    context = zmq.Context()    publisher = context.socket(zmq.PUB)    publisher.connect("tcp://{}:{}".format(zeroMQProxyHostName, zeroMQProxyPortNumberForPub))  # Connect to ZeroMQ proxy server    while not classifierThreadStatus == "requestToStop":        startTime = time.time()        # If Spanish, work on each transcribed XML files        if PATHOSnetModelLang == "Esp":            pvtFiles = [f for f in listdir(ASRTextFolderAbsolutePath) if f.endswith("pvt")]  # only file names, without path            for pvtFile in pvtFiles:                # Get XML file and extract words                with open(ASRTextFolderAbsolutePath + pvtFile, 'r', encoding='utf-8') as f:                    xmlContent = f.readlines()                    transcription = ""                    for line in xmlContent:                        if "<Token time=" in line:                            search = re.search('<Token time="[\d\.]+" length="[\d\.]+" data="(.+)"/>', line)                            if search:                                transcription = transcription + search.group(1) if transcription == "" else transcription + " " + search.group(1)                    # LOG.info("classifierThread() - Transcription: {}".format(transcription))  # TODO remove this line                    LOG.info("classifierThread() - Transcription received: {} characters long".format(len(transcription)))                pre, _ = os.path.splitext(pvtFile)                wavFile = pre + ".wav"                # if pvt exists, I'm sure the corresponding wav file exists, too. In any case, just check...                if not path.exists(ASRVoiceFolderAbsolutePath + wavFile):                    LOG.warning("classifierThread() - WAV file '{}' should exist but was not found".format(                        ASRVoiceFolderAbsolutePath + wavFile))                else:                    try:                        LOG.info("classifierThread() - Classifying '{}' file '{}'".format(PATHOSnetModelLang, ASRVoiceFolderAbsolutePath + wavFile))                        label, probability = classify(wavFile, transcription)                        LOG.info("classifierThread() - Class is '{}' with probability '{}'".format(label, probability))                        sensorGroupID = re.search('^(S[^_]+)_', pvtFile).group(1)  # like S4188c841-e28a-4865-b233-d39a465358ff                        sendHighLevelInfo(sensorGroupID, currentTimestamp, label, probability, publisher)  # send message with emotion to the App                        userDataLock.acquire()                        LOG.debug("classifierThread() - User data lock acquired to search for sensorGroupID")                        found = userData.get(sensorGroupID)                        userDataLock.release()                        LOG.debug("classifierThread() - User data lock released")                        if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                            os.remove(ASRVoiceFolderAbsolutePath + wavFile)  # WAV file not needed anymore; the FLAC is already into the storage folder                        if found is not None:                            # shutil.move(ASRTextFolderAbsolutePath + pvtFile, storageFolderAbsolutePath + pvtFile)  # TODO remove this line                            os.remove(ASRTextFolderAbsolutePath + pvtFile)  # Delete pvt file if the user did not give consent to store transcriptions  # TODO uncomment this line                        else:                            os.remove(ASRTextFolderAbsolutePath + pvtFile)  # Delete pvt file if the user is not found                            LOG.error("classifierThread() - Received sensor ID '{}' not found in data structure containing the Pickle file: ignoring it".format(                                    sensorGroupID))                    except BaseException as e:                        LOG.error("classifierThread() - Generic error occurred, failed to classify file '{}'. Error output: '{}'".format(wavFile, e))                        if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                            os.remove(ASRVoiceFolderAbsolutePath + wavFile)                    except:                        LOG.error("classifierThread() - Generic unknown error occurred, failed to classify file '{}'.".format(wavFile))                        if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                            os.remove(ASRVoiceFolderAbsolutePath + wavFile)        # If Greek, work on each wav files        elif PATHOSnetModelLang == "El" or PATHOSnetModelLang == "Eng":            wavFiles = [f for f in listdir(ASRVoiceFolderAbsolutePath) if f.endswith("wav")]            for wavFile in wavFiles:                try:                    LOG.info("classifierThread() - Classifying '{}' file '{}'".format(PATHOSnetModelLang, ASRVoiceFolderAbsolutePath + wavFile))                    label, probability = classify(wavFile)                    LOG.info("classifierThread() - Class is '{}' with probability '{}'".format(label, probability))                    sensorGroupID = re.search('^(S[^_]+)_', wavFile).group(1)  # like S4188c841-e28a-4865-b233-d39a465358ff                    sendHighLevelInfo(sensorGroupID, currentTimestamp, label, probability, publisher)  # send message with emotion to the App                except BaseException as e:                    LOG.error("classifierThread() - Generic error occurred, failed to classify file '{}'. Error output: '{}'".format(wavFile, e))                    if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                        os.remove(ASRVoiceFolderAbsolutePath + wavFile)                except:                    LOG.error("classifierThread() - Generic unknown error occurred, failed to classify file '{}'.".format(wavFile))                    if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                        os.remove(ASRVoiceFolderAbsolutePath + wavFile)                if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                    os.remove(ASRVoiceFolderAbsolutePath + wavFile)  # WAV file not needed anymore; the FLAC is already into the storage folder        delta = checkPeriod - (time.time() - startTime)        time.sleep(delta if delta > 0 else 0)  # wait no longer than checkPeriod seconds    LOG.info("classifierThread() - Thread classifier stopped.")    classifierThreadStatus = "stop"def userRegistrationThread():    """    Subscribes for messages of new user registration, and handles the Pickle file (and the userData structure)    :return: Nothing.    """    global userData, userRegistrationThreadStatus, userDataPickleFileAbsolutePathName, userDataLock, userFileLock    LOG.info("userRegistrationThread() - Thread for App registration running...")    userRegistrationThreadStatus = "run"    # Connect to ZeroMQ as a SUBSCRIBER    context = zmq.Context()    subscriber = context.socket(zmq.SUB)    subscriber.connect(        "tcp://{}:{}".format(zeroMQProxyHostName, zeroMQProxyPortNumberForSub))  # Connect to ZeroMQ proxy server    subscriber.setsockopt_string(zmq.SUBSCRIBE, "adduser")  # receives messages with topic like: "adduser/S4188c841-e28a-4865-b233-d39a465358ff"    # Connect as publisher for the "ack" message    publisher = context.socket(zmq.PUB)    publisher.connect(        "tcp://{}:{}".format(zeroMQProxyHostName, zeroMQProxyPortNumberForPub))  # Connect to ZeroMQ proxy server    while not userRegistrationThreadStatus == "requestToStop":        try:            message_as_utf8 = subscriber.recv_multipart()  # Blocking receive; this is not encrypted; it's an array of 2 UTF-8 encoded byte sequences            # Check if it is a user photo message and skip it (these messages have topic adduser/photo)            topic_as_utf8 = message_as_utf8[0]  # consider the topic; e.g.: adduser/S4188c841-e28a-4865-b233-d39a465358ff            topic = topic_as_utf8.decode('utf-8')  # get Python3 string            sub_topic = topic.split("/")[1]  # extract the sub-topi, like sensor group ID; e.g.: S4188c841-e28a-4865-b233-d39a465358ff or user picture: i.e. photo            if not sub_topic.strip().startswith('S'):  # If the sub-topic is a sensor group ID the message can be ignored                LOG.info("userRegistrationThread() - Received registartion message not concerning Sensor Groud IDs: {}. Skipping.".format(message_as_utf8))            else:                # Continue with usual processing                LOG.info("userRegistrationThread() - Registering new App: {}".format(message_as_utf8))                payload_as_utf8 = message_as_utf8[1]  # only consider the payload                payload = payload_as_utf8.decode('utf-8')  # get Python3 string                # Example payload sent with the "adduser" topic                # {                #   "userpseudoid": "U550e8400-e29b-41d4-a716-446655440000",                #   "sensorgroupid": "S4188c841-e28a-4865-b233-d39a465358ff",                #   "rsa4096publickey": "ssh-rsa AAAAB3NzaC1yc2…GgtShbs9649r/Loufhl…"                # }                newUserInfo = json.loads(payload)                # If the userData structure is still empty (i.e., the Pickle file didn't exist when the script was launched)                if not userData:                    userDatum = UserDatumType(newUserInfo["userpseudoid"],                                              PKCS1_OAEP.new(RSA.importKey(newUserInfo["rsa4096publickey"])),                                              RSA.importKey(newUserInfo["rsa4096publickey"]))                    userDataLock.acquire()                    LOG.debug("userRegistrationThread() - User data lock acquired to search for sensorGroupID")                    userData[newUserInfo["sensorgroupid"]] = userDatum                    userDataLock.release()                    LOG.debug("userRegistrationThread() - User data lock released")                # the userData exists, just modify it                else:                    userDataLock.acquire()                    LOG.debug("userRegistrationThread() - User data lock acquired to search for sensorGroupID")                    # if the new user pseudo ID is already present in userData, remove its entry and its sensor group ID                    remove_sensorGroupID = None                    for sensorGroupID, userDatum in userData.items():                        if userDatum.userPseudoID == newUserInfo["userpseudoid"]:                            remove_sensorGroupID = sensorGroupID                    if remove_sensorGroupID is not None:                        LOG.warning("userRegistrationThread() - UserPseudoID '{}' already present. Removing".format(userData[newUserInfo["sensorgroupid"]].userPseudoID))                        userData.pop(remove_sensorGroupID, None)                    # if the sensor group ID was already assigned, update it with the data of the new user pseudo ID                    if newUserInfo["sensorgroupid"] in userData:                        if userData[newUserInfo["sensorgroupid"]].userPseudoID != newUserInfo["userpseudoid"]:                            LOG.warning(                                "userRegistrationThread() - SensorGroupID '{}' already assigned (to UserPseudoID '{}'). Substituting".format(newUserInfo["sensorgroupid"],userData[newUserInfo["sensorgroupid"]].userPseudoID))                            # update the info for the sensor group ID                            LOG.info("userRegistrationThread() - Executing PKCS1_OAEP.new()")                            updatedUserData = UserDatumType(newUserInfo["userpseudoid"], PKCS1_OAEP.new(RSA.importKey(newUserInfo["rsa4096publickey"])), RSA.importKey(newUserInfo["rsa4096publickey"]))                            # userData[sensorGroupID] = updatedUserData                            LOG.info("userRegistrationThread() - Completed PKCS1_OAEP.new()")                            userData[newUserInfo["sensorgroupid"]] = updatedUserData                        else:                            LOG.warning(                                "userRegistrationThread() - SensorGroupID '{}' already assigned to UserPseudoID '{}'. Skipping".format(newUserInfo["sensorgroupid"], userData[newUserInfo["sensorgroupid"]].userPseudoID))                    # else, simply add the new user                    else:                        userDatum = UserDatumType(newUserInfo["userpseudoid"],                                                  PKCS1_OAEP.new(RSA.importKey(newUserInfo["rsa4096publickey"])),                                                  RSA.importKey(newUserInfo["rsa4096publickey"]))                        userData[newUserInfo["sensorgroupid"]] = userDatum                    userDataLock.release()                    LOG.debug("userRegistrationThread() - User data lock released")                # Pickle file to be re-created or just modified                write_user_data_file()                LOG.info("userRegistrationThread() - Users Pickle file written")                LOG.info("userRegistrationThread() - New App registered with user pseudo ID: '{}', sensor group ID: '{}', public key: '{}'".format(newUserInfo["userpseudoid"], newUserInfo["sensorgroupid"], newUserInfo["rsa4096publickey"]))                # send back an "ack" message                topic = newUserInfo["userpseudoid"] + "/addeduser"                payload = json.dumps({                    'sender': 'voice.workingage.eu'                })                LOG.debug("userRegistrationThread() - To send 'ack' to the registraton message, with topic: '{}', payload: '{}'".format(topic, payload))                publisher.send_multipart([bytes(topic, encoding='utf-8'), bytes(payload, encoding='utf-8')])  # two sequences of bytes encoded in UTF-8                LOG.debug("userRegistrationThread() - Sent 'ack' to the registraton message")        except zmq.ZMQError as e:  # if any error, discard the message and restart from the beginning of the loop            LOG.warning("userRegistrationThread() - recv_multipart() error: '{}'".format(e))        # No sleep here! Just go waiting for the next message    # Actually, since the thread is usually blocked int the recv_multipart() call, this code is unlikely to be executed...    LOG.info("userRegistrationThread() - Thread for App registration stopped.")    userRegistrationThreadStatus = "stop"def userConsentThread():    """    Subscribes for messages of user consent forms, and handles the Pickle file (and the userData structure)    :return: Nothing.    """    global userData, userConsentThreadStatus, userDataPickleFileAbsolutePathName, userFileLock    LOG.info("userConsentThread() - Thread for User consent running...")    userConsentThreadStatus = "run"    # Connect to ZeroMQ as a SUBSCRIBER    context = zmq.Context()    subscriber = context.socket(zmq.SUB)    subscriber.connect(        "tcp://{}:{}".format(zeroMQProxyHostName, zeroMQProxyPortNumberForSub))  # Connect to ZeroMQ proxy server    subscriber.setsockopt_string(zmq.SUBSCRIBE, "privacy")  # receives messages with topic like: "privacy/S4188c841-e28a-4865-b233-d39a465358ff"    # Connect as publisher for the "ack" message    publisher = context.socket(zmq.PUB)    publisher.connect(        "tcp://{}:{}".format(zeroMQProxyHostName, zeroMQProxyPortNumberForPub))  # Connect to ZeroMQ proxy server    while not userConsentThreadStatus == "requestToStop":        try:            message_as_utf8 = subscriber.recv_multipart()  # Blocking receive; this is not encrypted; it's an array of 2 UTF-8 encoded byte sequences            LOG.info("userConsentThread() - Registering User consent: {}".format(message_as_utf8))            topic_as_utf8 = message_as_utf8[                0]  # consider the topic; e.g.: sensor.management/S4188c841-e28a-4865-b233-d39a465358ff            topic = topic_as_utf8.decode('utf-8')  # get Python3 string            sensorGroupID = topic.split("/")[1]            payload_as_utf8 = message_as_utf8[1]  # only consider the payload            payload = payload_as_utf8.decode('utf-8')  # get Python3 string            # Example payload sent with the "privacy" topic            # {            #   "userpseudoid": "U550e8400-e29b-41d4-a716-446655440000",            #   "datacollection": true,            #   "headsetandcamera": true,            #   "scientificpurposes": true,            #   "publication": false            # }            newUserConsentInfo = json.loads(payload)            # NOTE: no "ack" message is required            # If the userData structure is still empty (i.e., the Pickle file didn't exist when the script was launched)            if not userData:                LOG.warning("userConsentThread() - No user data available. Skipping consent update of  SensorGroupID '{}'".format(sensorGroupID))  # In this case we cannot do anything because the user data structure is empty or does not exist            # the userData exists, just modify it            else:                userDataLock.acquire()                LOG.debug("userConsentThread() - User data lock acquired to update user consents")                try:                    assert newUserConsentInfo["userpseudoid"] == userData[sensorGroupID].userPseudoID                    # Look for the user connected to the sensor in the topic of the message and update its consent data                    userData[sensorGroupID].consentDataCollection = newUserConsentInfo["datacollection"]                    userData[sensorGroupID].consentHeadsetAndCamera = newUserConsentInfo["headsetandcamera"]                    userData[sensorGroupID].consentScientificPurposes = newUserConsentInfo["scientificpurposes"]                    userData[sensorGroupID].consentPublication = newUserConsentInfo["publication"]                    LOG.info("userConsentThread() - New User consent info registered with sensor group ID: '{}'. Updated values: Consent to data collection '{}', Consent to Headset and Camera '{}', Consent to Scientific Purposes '{}', Consent to Publication '{}'".format(sensorGroupID, newUserConsentInfo["datacollection"], newUserConsentInfo["headsetandcamera"], newUserConsentInfo["scientificpurposes"], newUserConsentInfo["publication"]))                except KeyError:                    LOG.warning("userConsentThread() - No user with SensorGroupID '{}' was found. Skipping this consent".format(sensorGroupID))  # In this case we cannot do anything because the user registration still has not happened, it will go with default consent.                except AssertionError:                    LOG.warning("userConsentThread() - Mismatch between registered UserPseudoID {} and received UserPseudoID {} for SensorGroupID '{}'. Skipping this consent".format(userData[sensorGroupID].userPseudoID, newUserConsentInfo["userpseudoid"], sensorGroupID))                userDataLock.release()                LOG.debug("userConsentThread() - User data lock released")                # Write Pickle file to be re-created                write_user_data_file()                LOG.info("userConsentThread() - Pickle file written")        except zmq.ZMQError as e:  # if any error, discard the message and restart from the beginning of the loop            LOG.warning("userConsentThread() - recv_multipart() error: '{}'".format(e))        # No sleep here! Just go waiting for the next message    # Actually, since the thread is usually blocked int the recv_multipart() call, this code is unlikely to be executed...    LOG.info("userConsentThread() - Thread for User consent stopped.")    userConsentThreadStatus = "stop"def startStopThread():    """    Subscribes for messages require the voice server to start/stop processing a given SensorGroupID    :return: Nothing.    """    global startStopThreadStatus, userState, userStateLock    LOG.info("startStopThread() - Thread for start/stop running...")    startStopThreadStatus = "run"    # Connect to ZeroMQ as a SUBSCRIBER    context = zmq.Context()    subscriber = context.socket(zmq.SUB)    subscriber.connect(        "tcp://{}:{}".format(zeroMQProxyHostName, zeroMQProxyPortNumberForSub))  # Connect to ZeroMQ proxy server    subscriber.setsockopt_string(zmq.SUBSCRIBE, "sensor.management")  # receives messages for starting/stopping    while not startStopThreadStatus == "requestToStop":        try:            message_as_utf8 = subscriber.recv_multipart()  # Blocking receive; this is not encrypted; it's an array of 2 UTF-8 encoded byte sequences            LOG.info("startStopThread() - Receiving start/stop: {}".format(message_as_utf8))            topic_as_utf8 = message_as_utf8[0]  # consider the topic; e.g.: sensor.management/S4188c841-e28a-4865-b233-d39a465358ff            topic = topic_as_utf8.decode('utf-8')  # get Python3 string            sensorGroupID = topic.split("/")[1]  # extract sensor group ID; e.g.: S4188c841-e28a-4865-b233-d39a465358ff            payload_as_utf8 = message_as_utf8[1]  # consider the payload            payload = payload_as_utf8.decode('utf-8')  # get Python3 string            # Example payload sent with the "sensor.management" topic            # {            #   "action": "stop",            #   "userpseudoid": "U550e8400-e29b-41d4-a716-446655440000"            # }            sensorManagementInfo = json.loads(payload)            userStateLock.acquire()            LOG.debug("startStopThread() - User state lock acquired to search for userPseudoID")            try:                assert sensorManagementInfo["userpseudoid"] == userData[sensorGroupID].userPseudoID                if sensorManagementInfo["action"] == "start":  # "start" received                    userState[sensorManagementInfo["userpseudoid"]] = "start:" + datetime.now().strftime(                        "%Y%m%d%H%M%S")  # insert or update, with current timestamp                elif sensorManagementInfo["action"] == "stop":  # "stop" received                    userState.pop(sensorManagementInfo["userpseudoid"], None)  # remove userPseudoID, if present                else:                    LOG.warning("startStopThread() - Receiving unknown/wrong action: {}".format(message_as_utf8))            except AssertionError:                LOG.error("startStopThread() - Receiving message with mismatch between userPseudoID and SensorGroupID: {}".format(message_as_utf8))            except KeyError:                LOG.error("startStopThread() - Receiving message with unregistered SensorGroupID: {}, skipping".format(message_as_utf8))            userStateLock.release()            LOG.debug("startStopThread() - User state lock released")        except zmq.ZMQError as e:  # if any error, discard the message and restart from the beginning of the loop            LOG.warning("startStopThread() - recv_multipart() error: '{}'".format(e))    # Actually, since the thread is usually blocked int the recv_multipart() call, this code is unlikely to be executed...    LOG.info("startStopThread() - Thread for start/stop stopped.")    startStopThreadStatus = "stop"############# UTILITY FUNCTIONS #############def sendHighLevelInfo(currentSensorGroupID, currentTimestamp, label, probability, publisher):    """    Send emotion to the right user App, via ZeroMQ.    :param currentSensorGroupID: the SensorGroupID of the sensor that sent the WAV file with voice    :param currentTimestamp: the timestamp to use    :param label: the emotion    :param probability: the probability of the emotion    :param publisher: the ZeroMQ publisher object    :return: Nothing.    """    userDataLock.acquire()    LOG.debug("userConsentThread() - User data lock acquired  to search for currentSensorGroupID")    userDatum = userData.get(currentSensorGroupID)    userDataLock.release()    LOG.debug("sendHighLevelInfo() - User data lock released")    if userDatum is not None:  # it should be there because I checked into receiverThread(), but just in case...        topic = userDatum.userPseudoID        payload = json.dumps({'probability': probability,                              'timeStamp': currentTimestamp,                              'sensorType': 'Microphone',                              'values': {'sensor': 'EmoState',                                         'value': label                                         }                              })        LOG.debug("classifierThread() - To send topic: '{}', payload: '{}'".format(topic, payload))        payload_as_utf8 = payload.encode('utf-8')        encrypted_payload_as_bytes = userDatum.encryptor.encrypt(payload_as_utf8)        encrypted_payload_base64 = base64.standard_b64encode(encrypted_payload_as_bytes).decode('utf-8')        publisher.send_multipart([bytes(topic, encoding='utf-8'), bytes(encrypted_payload_base64, encoding='utf-8')])  # two sequences of bytes encoded in UTF-8        LOG.debug("classifierThread() - Sent topic: '{}', encrypted payload: '{}'".format(topic, encrypted_payload_base64))    else:  # if not found, it... disappeared! Something unexpected happened        LOG.error("classifierThread() - ERROR Received sensor ID '{}' no longer in data structure containing the Pickle file".format(currentSensorGroupID))def audeeringClassifier(audio_file_path):    """    Audeering Classifier    :param audio_file_path: the WAV file containing voice    :return: Multilabel and binary-label predictions    """    # Perform the classification    prediction = aud_classifier.classify(audio_file_path)    if "no_speech" in prediction:        prob = 1 - prediction["no_speech"]        prediction["neutral"] = prediction["no_speech"]        prediction.pop("no_speech")        prediction["happy"] = prob / 3        prediction["angry"] = prob / 3        prediction["sad"] = prob / 3    multilabel_prediction = dict([(l, prediction[AUDEERING_LABELS_CONVERSION_DICT[l]]) for l in LABELS])    binary_prediction = {k: sum([multilabel_prediction[l] for l in LABELS_CONVERSION_DICT[k]]) for k in BINARY_LABELS}    return multilabel_prediction, binary_predictiondef classifier_timeout_wrapper(classification_func, timer=5):    """    Wrapper to set a timeout on the classfication function and reload the classifiers    (this should solve the Keras issue that causes model suspending)    :param classification_func: the function to classify the audio files    :param timer: the optional time to wait before restarting the model    :return: the output of the classification function (label, probability)    """    # Code partially taken from https://www.geeksforgeeks.org/function-wrappers-in-python/    # Timeout implemented partially following https://stackoverflow.com/questions/492519/timeout-on-a-function-call (see Alex answer on 11 Dec 2012)    def handler(signum, frame):        raise TimeoutError()    def wrapper(*args, **kwargs):        try:            # Set timer            signal.signal(signal.SIGALRM, handler)            signal.alarm(timer)            # Call classification function            output = classification_func(*args, **kwargs)            # Stop timer in case of success            signal.alarm(0)        except TimeoutError:            LOG.debug("classifier_timeout_wrapper() - timeout of {} second(s) triggered model is being restarted".format(timer))            # Reset graph and classifier            global graph, PATHOSnetClassifier            graph = tf.get_default_graph()            PATHOSnetClassifier = PATHOSnetModelGetterDict[PATHOSnetModelLang]["model_getter"](*PATHOSnetModelGetterDict[PATHOSnetModelLang]["args"], verbose=True)            LOG.debug("classifier_timeout_wrapper() - PATHOSnet model restarted, running again classification".format(timer))            # Run again classification            output = classification_func(*args, **kwargs)        return output    return wrapper@classifier_timeout_wrapperdef classify(wavFile, transcription=""):    """    Classify wavfile and transcription    :param wavFile: the WAV file containing voice    :param transcription: the optional transcription    :return: label, probability    """    global classificationFolderAbsolutePath, classificationMode    # Begin classification ---------------------------------------------------------------------------------------------    LOG.debug("classify() - Started classification of wav file '{}'".format(wavFile))    # Run PATHOSnet    LOG.debug("classify() - Started PATHOSnet classifier")    with graph.as_default():  # Needed; otherwise, TF does not retrieve the graph from this thread        if PATHOSnetModelLang == 'Esp':            multilabelPredictionProbabilitiesPolimi, binaryPredictionProbabilitiesPolimi = PATHOSnetClassifier(                ASRVoiceFolderAbsolutePath + wavFile, transcription)  # transcription is ignored, if Greek        elif PATHOSnetModelLang == 'El':            multilabelPredictionProbabilitiesPolimi, binaryPredictionProbabilitiesPolimi = PATHOSnetClassifier(                ASRVoiceFolderAbsolutePath + wavFile)  # transcription is ignored, if Greek        elif PATHOSnetModelLang == 'Eng':            multilabelPredictionProbabilitiesPolimi = {l: 0.0 for l in LABELS}            binaryPredictionProbabilitiesPolimi = {l: 0.0 for l in BINARY_LABELS}    LOG.debug("classify() - Completed PATHOSnet classifier")    LOG.debug("classify() - Started AUD classifier")    # Run Audeering model    multilabelPredictionProbabilitiesAud, binaryPredictionProbabilitiesAud = audeeringClassifier(        ASRVoiceFolderAbsolutePath + wavFile)    LOG.debug("classify() - Completed AUD classifier")    # Compute ensemble    multilabelPredictionProbabilitiesEnsemble = {        l: (POLIMI_PREDICTION_WEIGHT * multilabelPredictionProbabilitiesPolimi[l]) + (                    AUD_PREDICTION_WEIGHT * multilabelPredictionProbabilitiesAud[l]) for l in LABELS}    binaryPredictionProbabilitiesEnsemble = {l: (POLIMI_PREDICTION_WEIGHT * binaryPredictionProbabilitiesPolimi[l]) + (                AUD_PREDICTION_WEIGHT * binaryPredictionProbabilitiesAud[l]) for l in BINARY_LABELS}    if classificationMode == "binary":        label = 'Positive' if binaryPredictionProbabilitiesEnsemble[                                  'Positive'] > ENSEBMBLE_BINARY_CLASSIFICATION_THRESHOLD else 'Negative'        probability = binaryPredictionProbabilitiesEnsemble[label]    elif classificationMode == "multilabel":        label = sorted(multilabelPredictionProbabilitiesEnsemble, key=lambda k: -multilabelPredictionProbabilitiesEnsemble[k])[0]        probability = multilabelPredictionProbabilitiesEnsemble[label]    # End classification -----------------------------------------------------------------------------------------------    # Save classified emotion to a .emo textual file    pre, _ = os.path.splitext(wavFile)    emoFile = pre + '.emo'    with open(classificationFolderAbsolutePath + emoFile, 'w', encoding='utf-8') as f:        f.write(label + "\t" + str(probability) + "\n")    shutil.move(classificationFolderAbsolutePath + emoFile,                storageFolderAbsolutePath + emoFile)  # move emo file to the storage area    return label, probabilitydef read_user_data_file():    """    Try to reads the Pickle file, once. Beware that external editing of the Pickle file will not be read by the script until next start    :return: Nothing.    """    global userData, userDataLock, userFileLock    # Try to read Pickle file with user data    if os.path.exists(userDataPickleFileAbsolutePathName):        # userDataLock.acquire()  # protects the userData structure from concurrent access, while filling it        # userFileLock.acquire()  # protects the user data file from concurrent access, while reading it        LOG.info("userRegistrationThread() - Reading Pickle file")        with open(userDataPickleFileAbsolutePathName, "rb") as pickleFile:            userDataRaw = pickle.load(pickleFile)        userData = {key: UserDatumType(            userpseudoid,            PKCS1_OAEP.new(RSA.importKey(publickey)),            RSA.importKey(publickey),            *consent        ) for key, (userpseudoid, publickey, *consent) in userDataRaw.items()}        # userFileLock.release()        # userDataLock.release()    else:        LOG.warning("user_data_read_file() - Pickle file does not exist; will be created")def write_user_data_file():    """        Try to write the Pickle file, once.        :return: Nothing.    """    global userData, userDataLock, userFileLock    # Try to write Pickle file with user data            LOG.info("userRegistrationThread() - Reading Pickle file")    userDataLock.acquire()  # protects the userData structure from concurrent access, while filling it    LOG.debug("write_user_data_file() - User data lock acquired to update file")    userFileLock.acquire()  # protects the user data file from concurrent access, while reading it    LOG.debug("write_user_data_file() - User file lock acquired to update file")    writeData = {key: (        userData.userPseudoID,        userData.publickey.exportKey(),        userData.consentDataCollection,        userData.consentHeadsetAndCamera,        userData.consentScientificPurposes,        userData.consentPublication    ) for key, userData in userData.items()}    with open(userDataPickleFileAbsolutePathName, "wb") as pickleFile:        pickle.dump(writeData, pickleFile)    # the file is writable/readable/executable only by the owner    os.chmod(userDataPickleFileAbsolutePathName, stat.S_IWUSR | stat.S_IRUSR | stat.S_IXUSR)    userFileLock.release()    LOG.debug("write_user_data_file() - User file lock released")    userDataLock.release()    LOG.debug("write_user_data_file() - User data lock released")def signal_handler(sig, frame):    """    Handles the SIGINT signal: stops threads and quits the process.    :param sig:  the signal number.    :param frame: the current stack frame.    :return: nothing.    """    global receiverThreadStatus, userConsentThreadStatus, simulatedASRThreadStatus, classifierThreadStatus, userRegistrationThreadStatus, startStopThreadStatus    LOG.info('signal_handler() - SIGINT/SIGTERM RECEIVED. Stopping threads...')    # ask threads to stop    receiverThreadStatus = "requestToStop"    userConsentThreadStatus = "requestToStop"    classifierThreadStatus = "requestToStop"    userRegistrationThreadStatus = "requestToStop"    startStopThreadStatus = "requestToStop"    # wait until all thread are stopped or until a timer (5 seconds) fires    currTime = datetime.now()    while (receiverThreadStatus != "stop" or userConsentThreadStatus != "stop" or classifierThreadStatus != "stop"           or userRegistrationThreadStatus != "stop" or startStopThreadStatus != "stop") \            and (datetime.now() - currTime).total_seconds() <= 5:        time.sleep(1)    # userRegistrationThread(), userConsentThread() and startStopThread() are likely to be blocked into the recv-multipart() function;    # if so, they do not terminate their 'while' loop, their status is still "requestToStop" and no    # logging message is generated by them.    if userRegistrationThreadStatus != "stop":        LOG.info("signal_handler() - userRegistrationThread() blocked into recv_multipart(); will be killed.")    if userConsentThreadStatus != "stop":        LOG.info("signal_handler() - userConsentThread() blocked into recv_multipart(); will be killed.")    if startStopThreadStatus != "stop":        LOG.info("signal_handler() - startStopThread() blocked into recv_multipart(); will be killed.")    # exit and terminate all threads still running    LOG.info('signal_handler() - SIGINT/SIGTERM RECEIVED. Exiting 👋🏻')    logging.shutdown()    sys.exit(0)def init_logging(log_file=None, append=False, loglevel=logging.INFO):    """    Initialize the logger    :param log_file: the file where the log should be written; if None, the log is written on stderr    :param append: when writing to a file, append or not.    :param loglevel: the log level.    :return: Nothing.    """    global LOG    class StdIOLogger(object):        """        Custom object to enable writing stdout and stderr to log file.        Adapted from https://stackoverflow.com/questions/19425736/how-to-redirect-stdout-and-stderr-to-logger-in-python        """        def __init__(self, logger, log_level):            self.logger = logger            self.log_level = log_level            self.linebuf = ''        def write(self, buf):            for line in buf.rstrip().splitlines():                self.logger.log(self.log_level, line.rstrip())        def flush(self):            pass    # adapted from: https://www.programcreek.com/python/example/136/logging.basicConfig    # define a Handler which writes to a file    if log_file is not None:        logging.basicConfig(level=loglevel,                            format="%(asctime)s %(levelname)s %(threadName)s %(name)s %(message)s",                            filename=log_file,                            filemode='a' if append else 'w')    # define a Handler which writes messages to sys.stderr    else:        logging.basicConfig(level=loglevel, format="%(asctime)s %(levelname)s %(threadName)s %(name)s %(message)s")    LOG = logging.getLogger("WALog")    # Redirect stdout as log INFO    # sys.stdout = StdIOLogger(LOG, logging.INFO)    # Redirect stderr as log ERROR    # sys.stderr = StdIOLogger(LOG, logging.ERROR)############# THE MAIN ############## BACKGROUND mode: issue the command:#     nohup python3 workingAgeVoiceService.py &# SYSTEMD mode: for starting workingAgeVoiceService.py as a systemd service, see:#     https://tecadmin.net/setup-autorun-python-script-using-systemd/#     https://www.golinuxcloud.com/run-systemd-service-specific-user-group-linux/## Commands:#     sudo systemctl status/start/stop/enable/disable workingage.service#     journalctl -u workingage# Service configuration in file:#     /lib/systemd/system/workingage.service# FOREGROUND mode: just for testing. Be sure that neither the BACKGROUND nor the SYSTEMD modes are used.# Issue the command:#     python3 workingAgeVoiceService.py# During tests, when using a local ZeroMQ proxy, to check its status issue the command:#     netstat -a | grep -e:5559 -e:5560def main():    # Configuring the logger    if runAs == "background":        init_logging(log_file=loggingFileAbsolutePath, append=LogFileAppendMode, loglevel=loggingLevel)        LOG.info('Running as background job; PID: ' + str(os.getpid()))    elif runAs == "systemd":        init_logging(log_file=loggingFileAbsolutePath, append=LogFileAppendMode, loglevel=loggingLevel)        LOG.info(            'Running as systemd service; use "journalctl -u workingage" and "sudo systemctl status workingage.service" to check status.')        LOG.info('Running as systemd job; PID: ' + str(os.getpid()))    elif runAs == "foreground":        init_logging(loglevel=loggingLevel)        LOG.info('Running as foreground process.')    LOG.info("Edge Cloud Voice manager. Press CTRL-C or send SIGINT/SIGTERM to stop.")    # try reading the Pickle file, if already present, just once    read_user_data_file()    # Starting the thread that will wait for new user registrations    userRegistration = threading.Thread(target=userRegistrationThread, daemon=True)    userRegistration.start()    # Starting the thread that will wait for user consent message    userConsent = threading.Thread(target=userConsentThread, daemon=True)    userConsent.start()    # Starting the receiver thread: waits for FLAC files copied by the AUD noiseBox    receiver = threading.Thread(target=receiverThread, daemon=True)    receiver.start()    # Starting the thread handling the start/stop message    startStop = threading.Thread(target=startStopThread, daemon=True)    startStop.start()    # Starting the thread that will run the classifier    classifier = threading.Thread(target=classifierThread, daemon=True)    classifier.start()    # The app will terminate on SIGINT or SIGTERM signals    signal.signal(signal.SIGINT, signal_handler)  # i.e., CTRL-C    signal.signal(signal.SIGTERM, signal_handler)  # from systemd, on service stopping    signal.pause()  # just wait for signals, foreverif __name__ == "__main__":    main()
\ No newline at end of file
+#! /usr/bin/env python3# -*- coding: UTF-8 -*-"""Main script handling voice.Author : R. Tedesco, V. Scotti - Politecnico di MilanoDate   : 2021-01-13Version: v0.6The whole software stack is composed by:- This script, usually run as a systemd service (see info files)- PerVoice Audioma ASR: service and configuration files (see Audioma manual)- PATHOSnet classifier- AUD classifierDESCRIPTION:    The service runs on a single asyncio event loop, with ZeroMQ asyncio sockets (zmq.asyncio);    the classification runs in a thread pool, off the event loop; with classificationProcesses > 0, PATHOSnet runs in    worker processes (ZeroMQ PUSH/PULL, the files of a user always go to the same worker).    TASK Receive    - do        - get new file list from folder Voice        - for each file            - if the sensor who sent the file is not in "stop"                - transcode (asynchronously) to WAV and move to folder ASR            - else                - delete the file            - sleep so that, in total, the current loop lasts checkPeriod seconds    - while not STOP    TASK Schedule    - do        - get new file list from folders ASR        - for each pair of wav and txt files (or wav file, if no transcription is used) not yet scheduled            - put it into the (bounded) classification queue; if the queue is full, leave it for the next loop            - sleep so that, in total, the current loop lasts checkPeriod seconds    - while not STOP    TASK Classify (classificationWorkers of them)    - do        - get the next files from the classification queue        - use classifier (in the thread pool, with timeout on PATHOSnet)        - send class to app    - while not STOP    TASK Control    - do        - wait for messages of new user, user consent and start/stop of a sensor group (single subscriber)        - update data structures        - update Pickle file        - send "ack" message to new users    - while not STOP    Control messages never wait for the classification: a slow inference only delays the classification queue.TO STOP THE PROCESS (see: https://www.gnu.org/software/libc/manual/html_node/Termination-Signals.html):- use the SIGTERM signal (command: "kill -15 [PID of the process]) or use the "jobs" command for managing jobs- or press CTRL-C, when in foreground mode (i.e., SIGINT)NOTICE:All data folders must be placed into the LUKS partition, mounted at: /securestorageSEE ALSO:https://docs.python.org/2/library/signal.htmlhttps://stackoverflow.com/questions/1112343/how-do-i-capture-sigint-in-pythonhttps://realpython.com/intro-to-python-threading/https://stackoverflow.com/a/46098711https://docs.python.org/3/library/logging.htmlhttps://stackoverflow.com/a/24862213http://effbot.org/zone/thread-synchronization.htmhttps://stackoverflow.com/questions/6953351/thread-safety-in-pythons-dictionaryhttps://stackoverflow.com/questions/16249440/changing-file-permission-in-pythonREQUIRED LIBRARIES/PACKETS:- Python library: PyCryptodome - Handles encryption- Python library: Pyzmq - Communication with Apps- Packet FFmpeg (the "ffmpeg" command must be in PATH) - Transcodes FLAC into WAV"""import loggingimport subprocessimport osimport statimport signalimport sysimport threadingimport timeimport asynciofrom os import listdirimport shutilfrom os import pathimport pickleimport dataclassesfrom Crypto.Cipher import PKCS1_OAEPfrom Crypto.PublicKey import RSAimport base64import reimport zmq  # The ZeroMQ libraryimport zmq.asyncio  # The ZeroMQ sockets for asyncioimport jsonfrom concurrent.futures import ThreadPoolExecutorfrom datetime import datetimefrom typing import Dict# Path extension to include PoliMI and AUD classifierssys.path.extend(["/home/workingage/WACode/polimi", "/home/workingage/WACode"])  # TODO uncommentfrom pathosnet import pathosnet_multimodal_classifier, \    pathosnet_voice_classifier  # The PATHOSnet library # TODO remove polimifrom aud import aud_classifier  # The Audeering library#################################### BEGIN CONFIGURATION ######################################## LOGGING MODE ####date_time_experiment = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')  # date-time as unique identifier of the logrunAs = "systemd"  # could be "background", "systemd", "foreground"; if "systemd", be sure to properly set the corresponding systemd service definition fileloggingFileAbsolutePath = f"/home/workingage/WACode/logs/workingAgeVoiceService_{date_time_experiment}.log"  # used by "background" and "systemd"LogFileAppendMode = False  # could be True or False; False means that whenever the script restarts, the log file is overwritten# Logging level: you’re telling the library you want to handle all events from that level on up# Levels: CRITICAL > ERROR > WARNING > INFO > DEBUG > NOTSETloggingLevel = logging.DEBUG# loggingLevel = logging.INFO#### SECURE STORAGE PATHS AND POLLING TIME ####voiceFolderAbsolutePath = "/securestorage/voice/"  # contains FLAC files copied by Raspberry PIs ("voice" is lowercase)textFolderAbsolutePath = "/securestorage/text/"  # contains .pvt files generated by ASR ("text" is lowercase)ASRVoiceFolderAbsolutePath = "/securestorage/ASRVoice/"  # contains WAV files transcoded from FLAC filesASRTextFolderAbsolutePath = "/securestorage/ASRText/"  # contains transcribed XMLclassificationFolderAbsolutePath = "/securestorage/Classification/"  # contains EMO files with classstorageFolderAbsolutePath = "/securestorage/Storage/"  # contains FLAC, TXT and EMO files for long-term storagecheckPeriod = 2  # Checks the folder every 2 seconds max#### SENSOR-USER ASSOCIATION FILE ####userDataPickleFileAbsolutePathName = "/home/workingage/WACode/user_data.pkl"  # DO NOT CHANGE THE FILE NAME !!!#### ZEROMQ PROXY ####zeroMQProxyHostName = "zeromqproxy.workingage.eu"zeroMQProxyPortNumberForPub = "5560"  # DO NOT CHANGE THE PORT NUMBER !!!zeroMQProxyPortNumberForSub = "5559"  # DO NOT CHANGE THE PORT NUMBER !!!#### TIMER FOR ASSUMING STOP MODE ##### If a user leaves without stopping its data recordings, "stop" is assumed after this time thresholdstopThreshold = 10 * 60  # seconds to wait between two "start" messages, before assuming "stop"#### PATHOSNET CONFIGURATION ####PATHOSnetVGGisAcousticFeaturesModelAbsolutePath = "/home/workingage/WACode/polimi/checkpoints/weights_vggish.h5"  # Path to the model for acoustic features VGGishPATHOSnetGhostVladAcousticFeaturesModelAbsolutePath = "/home/workingage/WACode/polimi/ghostvlad/pretrained_models/ghostvlad_weights.h5"  # Path to the model for acoustic features GhostVladPATHOSnetEspModelWeightsAbsolutePath = "/home/workingage/WACode/polimi/checkpoints/pathosnet_esp_multimodal.h5"  # Path to the weights of the model for Spanish emotion recognition from voice and textPATHOSnetEspWordEmbeddingsAbsolutePath = "/home/workingage/WACode/polimi/MUSE/data/wiki.es.vec"  # Path to the spanish word embeddingsPATHOSnetElModelWeightsAbsolutePath = "/home/workingage/WACode/polimi/checkpoints/pathosnet_el_audio.h5"  # Path to the weights of the model for Greek emotion recognition from voicePATHOSnetModelLang = "Eng"  # Language code to interact with the dict, either "Esp", "El" or "Eng" (Greek and English does not work with transcription)#### CLASSIFICATION MODE ####classificationMode = "binary"  # should be either "binary" or "multilabel";  holds for both AUD and POLIMI classifiers#### TENSORFLOW RUNTIME ##### Thread pools of the TensorFlow session hosting the PATHOSnet models (0 means one thread per core); keep them small, since the classifier shares the cores with librosa/numba and the ZeroMQ threadstensorFlowIntraOpThreads = 2  # threads running a single optensorFlowInterOpThreads = 1  # threads running independent opstensorFlowCPUOnly = True  # could be True or False; True hides GPUs from TensorFlow#### CLASSIFICATION QUEUE ####classificationQueueSize = 16  # files waiting for classification; when the queue is full, new files wait on disk for the next checkclassificationWorkers = 4  # concurrent classifications; the AUD classifier runs one file at a time, the PATHOSnet networks on batches of the concurrent onesclassificationTimeout = 5  # seconds, PATHOSnet classifier only (the AUD one is not included); on timeout the PATHOSnet models are reloaded and the PATHOSnet classifier is run againclassificationBatchMaxWait = 0.01  # seconds; longest wait for other concurrent classifications to batch the PATHOSnet networks withclassificationBatchMaxSize = 8  # largest number of files in a PATHOSnet batch; 1 disables the batchingclassificationProcesses = 0  # PATHOSnet worker processes (see polimi/workers.py), each file of a user goes to the same one; 0 runs PATHOSnet in the service processclassificationPrefork = False  # could be True or False; True forks the worker processes from one preloading the shared models (modules, word embeddings), saving memory and startup time#################################### END CONFIGURATION ##################################### Classification constants ---------------------------------------------------------------------------------------------LABELS = ['Happiness', 'Anger', 'Sadness', 'Neutral']AUDEERING_LABELS = ['happy', 'angry', 'sad', 'neutral']AUDEERING_LABELS_CONVERSION_DICT = dict(zip(LABELS, AUDEERING_LABELS))BINARY_LABELS = ['Positive', 'Negative']LABELS_CONVERSION_DICT = {'Positive': ['Happiness', 'Neutral'], 'Negative': ['Anger', 'Sadness']}BINARY_CONVERSION_DICT = {'Happiness': 'Positive', 'Anger': 'Negative', 'Sadness': 'Negative', 'Neutral': 'Positive'}LANG = PATHOSnetModelLangPOLIMI_WEIGHTS_DICT = {"Esp": 0.466, "El": 0.469, "Eng": 0.0}POLIMI_PREDICTION_WEIGHT = POLIMI_WEIGHTS_DICT[LANG]AUD_WEIGHTS_DICT = {"Esp": 0.534, "El": 0.531, "Eng": 1.0}AUD_PREDICTION_WEIGHT = AUD_WEIGHTS_DICT[LANG]ENSEBMBLE_BINARY_CLASSIFICATION_THRESHOLD_DICT = {"Esp": 0.4, "El": 0.4, "Eng": 0.4}ENSEBMBLE_BINARY_CLASSIFICATION_THRESHOLD = ENSEBMBLE_BINARY_CLASSIFICATION_THRESHOLD_DICT[LANG]# End classification constants -----------------------------------------------------------------------------------------# PATHOSnet initialization# Dictionary to retrieve the functions and arguments to instantiate a model starting from the languagePATHOSnetModelGetterDict = {"Esp": {"model_getter": pathosnet_multimodal_classifier,                                    "modality": "multimodal",                                    "args": (                                    PATHOSnetEspModelWeightsAbsolutePath, PATHOSnetEspWordEmbeddingsAbsolutePath,                                    PATHOSnetVGGisAcousticFeaturesModelAbsolutePath,                                    PATHOSnetGhostVladAcousticFeaturesModelAbsolutePath)},                            "El": {"model_getter": pathosnet_voice_classifier,                                   "modality": "voice",                                   "args": (                                   PATHOSnetElModelWeightsAbsolutePath, PATHOSnetVGGisAcousticFeaturesModelAbsolutePath,                                   PATHOSnetGhostVladAcousticFeaturesModelAbsolutePath)},                            "Eng": {"model_getter": pathosnet_voice_classifier,                                    "modality": "voice",                                    "args": (PATHOSnetElModelWeightsAbsolutePath,                                             PATHOSnetVGGisAcousticFeaturesModelAbsolutePath,                                             PATHOSnetGhostVladAcousticFeaturesModelAbsolutePath)}}  # For English we use ony a dummy model, predictions will be done only using Audeering voice model# Instance of a PATHOSnet model for emotion classificationimport runtime  # TensorFlow graph, session and thread pools shared by the PATHOSnet modelsPATHOSnetRuntime = runtime.configure(intra_op_parallelism_threads=tensorFlowIntraOpThreads, inter_op_parallelism_threads=tensorFlowInterOpThreads, cpu_only=tensorFlowCPUOnly)import registry  # Models shared by the PATHOSnet classifiers, loaded once per weights path (VGGish and GhostVlad are shared by voice and multimodal classifiers)PATHOSnetRegistry = registry.ModelRegistry(PATHOSnetRuntime)import batching  # Networks run on batches of the concurrent classifications (of different users)if classificationProcesses > 0 and PATHOSnetModelLang != "Eng":  # English uses no PATHOSnet model    import workers  # PATHOSnet worker processes, each with its own models and TensorFlow runtime    PATHOSnetWorkers = workers.WorkerPool(classificationProcesses, PATHOSnetModelGetterDict[PATHOSnetModelLang]["modality"], PATHOSnetModelGetterDict[PATHOSnetModelLang]["args"], intra_op_parallelism_threads=tensorFlowIntraOpThreads, inter_op_parallelism_threads=tensorFlowInterOpThreads, cpu_only=tensorFlowCPUOnly, prefork=classificationPrefork)  # workers load (and warm up) their models before returning    PATHOSnetClassifier = Noneelse:    PATHOSnetWorkers = None    PATHOSnetClassifier = batching.BatchingClassifier(PATHOSnetModelGetterDict[PATHOSnetModelLang]["model_getter"](*PATHOSnetModelGetterDict[PATHOSnetModelLang]["args"], registry=PATHOSnetRegistry, verbose=True), max_wait=classificationBatchMaxWait, max_batch_size=classificationBatchMaxSize)    PATHOSnetClassifier.warm_up()  # First call costs (numba compilation, cached in params.NUMBA_CACHE_DIR across restarts, and TensorFlow initialisation) paid before serving# Service statusstopEvent = None  # asyncio event set on SIGINT/SIGTERM, created by serve()zmqContext = None  # ZeroMQ asyncio context, created by serve()scheduledFiles = set()  # (pvt file or None, wav file) pairs waiting for classification or being classified# Data structure containing inf in users and sensors; stored into the Pickle file; see: userDataPickleFileAbsolutePathName@dataclasses.dataclassclass UserDatumType:  # Data class type: info known for each user    userPseudoID: str    encryptor: PKCS1_OAEP.PKCS1OAEP_Cipher    publickey: RSA.RsaKey    consentDataCollection: bool = True  # Default consent flag of a user    consentHeadsetAndCamera: bool = False  # Default consent flag of a user    consentScientificPurposes: bool = False  # Default consent flag of a user    consentPublication: bool = False  # Default consent flag of a useruserData: Dict[str, UserDatumType] = {}  # key is the SensorGroupID, value is the UserDatum typeuserDataLock = threading.Lock()  # because userData is used by different threadsuserFileLock = threading.Lock()  # because user data file is used by different threads# the state of each user: start or stop; if a user is not into the dictionary, default is STOPuserState = {}  # key is the UserPseudoID, value is "start:"+timestamp; if a SensorGroupID is not here, it is in "stop" stateuserStateLock = threading.Lock()  # because userState is used by different tasks (never held across an await)classifierReloadLocks = {}  # key of the PATHOSnet models (see polimi_models_key) -> lock, because the PATHOSnet models are reloaded from the classification threadsPATHOSnetGenerations = {}  # key of the PATHOSnet models -> reloads of the models, so that concurrent timeouts reload them onceaudeeringLock = threading.Lock()  # because the AUD classifier is not known to be thread-safe# misccurrentTimestamp = datetime.now().strftime("%Y%m%d%H%M%S")global LOG############# TASKS #############async def receiverTask():    """    Wait for FLAC files copied (via scp) by the AUC noiseBox device, and move them to the folder there ASR waits for them.    :return: Nothing.    """    global currentTimestamp, voiceFolderAbsolutePath, \        ASRVoiceFolderAbsolutePath, userStateLock, userState, userData    LOG.info("receiverTask() - Task receiver running...")    alreadyLoggedWarning = False    while not stopEvent.is_set():        startTime = time.time()        flacFiles = [f for f in listdir(voiceFolderAbsolutePath) if f.endswith("flac")]  # only file names, without path        if flacFiles != [] and not userData:            if not alreadyLoggedWarning:                LOG.warning("receiverTask() - FLAC files present but Pickle file empty: I can't process any FLAC file. Waiting...")                alreadyLoggedWarning = True  # To avoid logging a lot of time the same warning...            await asyncio.sleep(checkPeriod)        else:            for flacFile in flacFiles:                LOG.info("receiverTask() - received FLAC file: " + flacFile)                # Set sensorGroupID from file name like: S4188c841-e28a-4865-b233-d39a465358ff_20201022T23_23_45_345656.flac                sensorGroupID = re.search('^(S[^_]+)_', flacFile).group(1)  # like S4188c841-e28a-4865-b233-d39a465358ff                # Is sensorGroupID known?                userDataLock.acquire()                LOG.debug("receiverTask() - User data lock acquired to search for sensorGroupID")                found = userData.get(sensorGroupID)                userDataLock.release()                LOG.debug("receiverTask() - User data lock released")                if found is not None:                    # process sensor group if it is "start"                    userStateLock.acquire()                    LOG.debug("receiverTask() - User state lock acquired to search for userPseudoID")                    state = userState.get(found.userPseudoID, "notfound")                    userStateLock.release()  # released before transcoding: the lock cannot be held while other tasks run                    LOG.debug("receiverTask() - User state lock released")                    if "start" in state:  # user is registered and is in start mode                        lastStart = int(state.split(":")[1])  # extract timestamp of the last start message                        if (datetime.now() - datetime.strptime(str(lastStart), "%Y%m%d%H%M%S")).total_seconds() <= stopThreshold:                            currentTimestamp = datetime.now().strftime("%Y%m%d%H%M%S")                            LOG.debug("receiverTask() - Received FLAC file: " + flacFile)                            pre, _ = os.path.splitext(flacFile)                            wavFile = pre + '.wav'                            # ffmpeg must be in PATH; it runs as a subprocess, without blocking the event loop                            result = await transcode(voiceFolderAbsolutePath + flacFile, voiceFolderAbsolutePath + wavFile)                            if result is not None:                                LOG.debug("receiverTask() - Converted into WAV file: " + wavFile)                            # check whether the FLAC file was empty or not correct                            if result is None or "Output file is empty" in result.decode('utf-8') or "not contain any stream" in result.decode('utf-8'):                                os.remove(voiceFolderAbsolutePath + flacFile)  # remove void/corrupted FLAC file                                if path.exists(voiceFolderAbsolutePath + wavFile):                                    os.remove(voiceFolderAbsolutePath + wavFile)  # remove void WAV file, if created                            else:                                shutil.move(voiceFolderAbsolutePath + wavFile, ASRVoiceFolderAbsolutePath + wavFile)  # Move wav file to the next step                                # shutil.move(voiceFolderAbsolutePath + flacFile, storageFolderAbsolutePath + flacFile)  # Move flac file to the storage TODO remove this line                                os.remove(voiceFolderAbsolutePath + flacFile)  # Delete flac file if the user did not give consent to store TODO uncomment this line                                LOG.debug("receiverTask() - Moved WAV file: %s and removed FLAC file: %s" % (wavFile, flacFile))                        else:  # user is registered but is inferred in stop mode                            userState.pop(found.userPseudoID, None)  # remove sensorGroupID, since it is inferred as stopped                            # shutil.move(voiceFolderAbsolutePath + flacFile, storageFolderAbsolutePath + flacFile)  # Move flac file to the storage TODO remove this line                            os.remove(voiceFolderAbsolutePath + flacFile)  # FLAC file removed as the sensor group is in "stop" mode TODO uncomment this line                            LOG.info("receiverTask() - sensorGroupID '{}' assumed as stopped: no 'start' messages received within time threshold".format(sensorGroupID))                    else:  # user is registered but is in stop mode (i.e., "notfound", means user is in stop mode)                        # shutil.move(voiceFolderAbsolutePath + flacFile, storageFolderAbsolutePath + flacFile)  # Move flac file to the storage TODO remove this line                        os.remove(voiceFolderAbsolutePath + flacFile)  # FLAC file removed as the sensor group is in "stop" mode TODO uncomment this line                        LOG.info("receiverTask() - FLAC file: {} deleted, as {} is in 'stop' mode".format(flacFile, sensorGroupID))                else:  # user is not registered                    LOG.error("receiverTask() - Received sensor ID '{}' not found in data structure containing the Pickle file: ignoring it".format(sensorGroupID))        delta = checkPeriod - (time.time() - startTime)        await asyncio.sleep(delta if delta > 0 else 0)  # wait no longer than checkPeriod seconds    LOG.info("receiverTask() - Task receiver stopped.")async def schedulerTask(classificationQueue):    """    Waits for txt and wav files on the ASR folder and puts them into the classification queue.    Files that do not fit into the (bounded) queue stay on disk and are scheduled at the next check.    :param classificationQueue: the asyncio queue of the files to classify, as (pvt file or None, wav file) pairs    :return: Nothing.    """    LOG.info("schedulerTask() - Task scheduler running...")    alreadyLoggedWarning = False    while not stopEvent.is_set():        startTime = time.time()        # If Spanish, work on each transcribed XML files (with the corresponding wav file)        if PATHOSnetModelLang == "Esp":            pvtFiles = [f for f in listdir(ASRTextFolderAbsolutePath) if f.endswith("pvt")]  # only file names, without path            newFiles = [(pvtFile, os.path.splitext(pvtFile)[0] + ".wav") for pvtFile in pvtFiles]        # If Greek, work on each wav files        else:            wavFiles = [f for f in listdir(ASRVoiceFolderAbsolutePath) if f.endswith("wav")]            newFiles = [(None, wavFile) for wavFile in wavFiles]        queueFull = False        for files in newFiles:            if files in scheduledFiles:  # already waiting for classification or being classified                continue            try:                classificationQueue.put_nowait(files)            except asyncio.QueueFull:                queueFull = True                break            scheduledFiles.add(files)        if queueFull and not alreadyLoggedWarning:            LOG.warning("schedulerTask() - Classification queue full ({} files): new files will be scheduled later".format(classificationQueueSize))        alreadyLoggedWarning = queueFull  # To avoid logging a lot of time the same warning...        delta = checkPeriod - (time.time() - startTime)        await asyncio.sleep(delta if delta > 0 else 0)  # wait no longer than checkPeriod seconds    LOG.info("schedulerTask() - Task scheduler stopped.")async def classifierTask(classificationQueue, publisher):    """    Gets the files from the classification queue, runs the emotion classifier code and sends the class to the App.    :param classificationQueue: the asyncio queue of the files to classify, as (pvt file or None, wav file) pairs    :param publisher: the ZeroMQ publisher socket    :return: Nothing.    """    LOG.info("classifierTask() - Task classifier running...")    while not stopEvent.is_set():        files = await classificationQueue.get()        try:            await classifyFiles(*files, publisher)        finally:            scheduledFiles.discard(files)            classificationQueue.task_done()    LOG.info("classifierTask() - Task classifier stopped.")async def classifyFiles(pvtFile, wavFile, publisher):    """    Reads the txt (if any) and wav files, runs the emotion classifier code (in a thread, off the event loop),    sends the class to the App and removes the files.    :param pvtFile: the pvt file with the transcription, None if no transcription is used    :param wavFile: the WAV file containing voice    :param publisher: the ZeroMQ publisher socket    :return: Nothing.    """    if pvtFile is not None:        # Get XML file and extract words        with open(ASRTextFolderAbsolutePath + pvtFile, 'r', encoding='utf-8') as f:            xmlContent = f.readlines()            transcription = ""            for line in xmlContent:                if "<Token time=" in line:                    search = re.search('<Token time="[\d\.]+" length="[\d\.]+" data="(.+)"/>', line)                    if search:                        transcription = transcription + search.group(1) if transcription == "" else transcription + " " + search.group(1)            # LOG.info("classifyFiles() - Transcription: {}".format(transcription))  # TODO remove this line            LOG.info("classifyFiles() - Transcription received: {} characters long".format(len(transcription)))        pre, _ = os.path.splitext(pvtFile)        wavFile = pre + ".wav"        # if pvt exists, I'm sure the corresponding wav file exists, too. In any case, just check...        if not path.exists(ASRVoiceFolderAbsolutePath + wavFile):            LOG.warning("classifyFiles() - WAV file '{}' should exist but was not found".format(                ASRVoiceFolderAbsolutePath + wavFile))        else:            try:                LOG.info("classifyFiles() - Classifying '{}' file '{}'".format(PATHOSnetModelLang, ASRVoiceFolderAbsolutePath + wavFile))                label, probability = await classify_with_timeout(wavFile, transcription)                LOG.info("classifyFiles() - Class is '{}' with probability '{}'".format(label, probability))                sensorGroupID = re.search('^(S[^_]+)_', pvtFile).group(1)  # like S4188c841-e28a-4865-b233-d39a465358ff                await sendHighLevelInfo(sensorGroupID, currentTimestamp, label, probability, publisher)  # send message with emotion to the App                userDataLock.acquire()                LOG.debug("classifyFiles() - User data lock acquired to search for sensorGroupID")                found = userData.get(sensorGroupID)                userDataLock.release()                LOG.debug("classifyFiles() - User data lock released")                if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                    os.remove(ASRVoiceFolderAbsolutePath + wavFile)  # WAV file not needed anymore; the FLAC is already into the storage folder                if found is not None:                    # shutil.move(ASRTextFolderAbsolutePath + pvtFile, storageFolderAbsolutePath + pvtFile)  # TODO remove this line                    os.remove(ASRTextFolderAbsolutePath + pvtFile)  # Delete pvt file if the user did not give consent to store transcriptions  # TODO uncomment this line                else:                    os.remove(ASRTextFolderAbsolutePath + pvtFile)  # Delete pvt file if the user is not found                    LOG.error("classifyFiles() - Received sensor ID '{}' not found in data structure containing the Pickle file: ignoring it".format(                            sensorGroupID))            except asyncio.CancelledError:  # the service is stopping: leave the files for the next run                raise            except BaseException as e:                LOG.error("classifyFiles() - Generic error occurred, failed to classify file '{}'. Error output: '{}'".format(wavFile, e))                if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                    os.remove(ASRVoiceFolderAbsolutePath + wavFile)            except:                LOG.error("classifyFiles() - Generic unknown error occurred, failed to classify file '{}'.".format(wavFile))                if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                    os.remove(ASRVoiceFolderAbsolutePath + wavFile)    else:        try:            LOG.info("classifyFiles() - Classifying '{}' file '{}'".format(PATHOSnetModelLang, ASRVoiceFolderAbsolutePath + wavFile))            label, probability = await classify_with_timeout(wavFile)            LOG.info("classifyFiles() - Class is '{}' with probability '{}'".format(label, probability))            sensorGroupID = re.search('^(S[^_]+)_', wavFile).group(1)  # like S4188c841-e28a-4865-b233-d39a465358ff            await sendHighLevelInfo(sensorGroupID, currentTimestamp, label, probability, publisher)  # send message with emotion to the App        except asyncio.CancelledError:  # the service is stopping: leave the files for the next run            raise        except BaseException as e:            LOG.error("classifyFiles() - Generic error occurred, failed to classify file '{}'. Error output: '{}'".format(wavFile, e))            if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                os.remove(ASRVoiceFolderAbsolutePath + wavFile)        except:            LOG.error("classifyFiles() - Generic unknown error occurred, failed to classify file '{}'.".format(wavFile))            if path.exists(ASRVoiceFolderAbsolutePath + wavFile):                os.remove(ASRVoiceFolderAbsolutePath + wavFile)        if path.exists(ASRVoiceFolderAbsolutePath + wavFile):            os.remove(ASRVoiceFolderAbsolutePath + wavFile)  # WAV file not needed anymore; the FLAC is already into the storage folderasync def controlTask(publisher):    """    Subscribes for the control messages (new user registrations, user consent forms and start/stop of a given    SensorGroupID) and handles each of them on arrival; no classification runs in this task, so control messages    are never delayed by a slow inference.    :param publisher: the ZeroMQ publisher socket, used for the "ack" messages    :return: Nothing.    """    LOG.info("controlTask() - Task for control messages running...")    # Connect to ZeroMQ as a SUBSCRIBER    subscriber = zmqContext.socket(zmq.SUB)    subscriber.connect(        "tcp://{}:{}".format(zeroMQProxyHostName, zeroMQProxyPortNumberForSub))  # Connect to ZeroMQ proxy server    subscriber.setsockopt_string(zmq.SUBSCRIBE, "adduser")  # receives messages with topic like: "adduser/S4188c841-e28a-4865-b233-d39a465358ff"    subscriber.setsockopt_string(zmq.SUBSCRIBE, "privacy")  # receives messages with topic like: "privacy/S4188c841-e28a-4865-b233-d39a465358ff"    subscriber.setsockopt_string(zmq.SUBSCRIBE, "sensor.management")  # receives messages for starting/stopping    try:        while not stopEvent.is_set():            try:                message_as_utf8 = await subscriber.recv_multipart()  # this is not encrypted; it's an array of 2 UTF-8 encoded byte sequences                messageType = message_as_utf8[0].decode('utf-8').split("/")[0]  # e.g.: adduser, privacy or sensor.management                if messageType == "adduser":                    await handleUserRegistration(message_as_utf8, publisher)                elif messageType == "privacy":                    handleUserConsent(message_as_utf8)                elif messageType == "sensor.management":                    handleStartStop(message_as_utf8)            except zmq.ZMQError as e:  # if any error, discard the message and restart from the beginning of the loop                LOG.warning("controlTask() - recv_multipart() error: '{}'".format(e))            except asyncio.CancelledError:                raise            except Exception as e:  # a malformed message must not stop the handling of the following ones                LOG.error("controlTask() - Generic error occurred, discarding message. Error output: '{}'".format(e))    finally:        subscriber.close(linger=0)    LOG.info("controlTask() - Task for control messages stopped.")async def handleUserRegistration(message_as_utf8, publisher):    """    Handles a message of new user registration, updating the Pickle file (and the userData structure)    :param message_as_utf8: the received message, as topic and payload    :param publisher: the ZeroMQ publisher socket, used for the "ack" message    :return: Nothing.    """    global userData, userDataPickleFileAbsolutePathName, userDataLock, userFileLock    # Check if it is a user photo message and skip it (these messages have topic adduser/photo)    topic_as_utf8 = message_as_utf8[0]  # consider the topic; e.g.: adduser/S4188c841-e28a-4865-b233-d39a465358ff    topic = topic_as_utf8.decode('utf-8')  # get Python3 string    sub_topic = topic.split("/")[1]  # extract the sub-topi, like sensor group ID; e.g.: S4188c841-e28a-4865-b233-d39a465358ff or user picture: i.e. photo    if not sub_topic.strip().startswith('S'):  # If the sub-topic is a sensor group ID the message can be ignored        LOG.info("handleUserRegistration() - Received registartion message not concerning Sensor Groud IDs: {}. Skipping.".format(message_as_utf8))    else:        # Continue with usual processing        LOG.info("handleUserRegistration() - Registering new App: {}".format(message_as_utf8))        payload_as_utf8 = message_as_utf8[1]  # only consider the payload        payload = payload_as_utf8.decode('utf-8')  # get Python3 string        # Example payload sent with the "adduser" topic        # {        #   "userpseudoid": "U550e8400-e29b-41d4-a716-446655440000",        #   "sensorgroupid": "S4188c841-e28a-4865-b233-d39a465358ff",        #   "rsa4096publickey": "ssh-rsa AAAAB3NzaC1yc2…GgtShbs9649r/Loufhl…"        # }        newUserInfo = json.loads(payload)        # If the userData structure is still empty (i.e., the Pickle file didn't exist when the script was launched)        if not userData:            userDatum = UserDatumType(newUserInfo["userpseudoid"],                                      PKCS1_OAEP.new(RSA.importKey(newUserInfo["rsa4096publickey"])),                                      RSA.importKey(newUserInfo["rsa4096publickey"]))            userDataLock.acquire()            LOG.debug("handleUserRegistration() - User data lock acquired to search for sensorGroupID")            userData[newUserInfo["sensorgroupid"]] = userDatum            userDataLock.release()            LOG.debug("handleUserRegistration() - User data lock released")        # the userData exists, just modify it        else:            userDataLock.acquire()            LOG.debug("handleUserRegistration() - User data lock acquired to search for sensorGroupID")            # if the new user pseudo ID is already present in userData, remove its entry and its sensor group ID            remove_sensorGroupID = None            for sensorGroupID, userDatum in userData.items():                if userDatum.userPseudoID == newUserInfo["userpseudoid"]:                    remove_sensorGroupID = sensorGroupID            if remove_sensorGroupID is not None:                LOG.warning("handleUserRegistration() - UserPseudoID '{}' already present. Removing".format(userData[newUserInfo["sensorgroupid"]].userPseudoID))                userData.pop(remove_sensorGroupID, None)            # if the sensor group ID was already assigned, update it with the data of the new user pseudo ID            if newUserInfo["sensorgroupid"] in userData:                if userData[newUserInfo["sensorgroupid"]].userPseudoID != newUserInfo["userpseudoid"]:                    LOG.warning(                        "handleUserRegistration() - SensorGroupID '{}' already assigned (to UserPseudoID '{}'). Substituting".format(newUserInfo["sensorgroupid"],userData[newUserInfo["sensorgroupid"]].userPseudoID))                    # update the info for the sensor group ID                    LOG.info("handleUserRegistration() - Executing PKCS1_OAEP.new()")                    updatedUserData = UserDatumType(newUserInfo["userpseudoid"], PKCS1_OAEP.new(RSA.importKey(newUserInfo["rsa4096publickey"])), RSA.importKey(newUserInfo["rsa4096publickey"]))                    # userData[sensorGroupID] = updatedUserData                    LOG.info("handleUserRegistration() - Completed PKCS1_OAEP.new()")                    userData[newUserInfo["sensorgroupid"]] = updatedUserData                else:                    LOG.warning(                        "handleUserRegistration() - SensorGroupID '{}' already assigned to UserPseudoID '{}'. Skipping".format(newUserInfo["sensorgroupid"], userData[newUserInfo["sensorgroupid"]].userPseudoID))            # else, simply add the new user            else:                userDatum = UserDatumType(newUserInfo["userpseudoid"],                                          PKCS1_OAEP.new(RSA.importKey(newUserInfo["rsa4096publickey"])),                                          RSA.importKey(newUserInfo["rsa4096publickey"]))                userData[newUserInfo["sensorgroupid"]] = userDatum            userDataLock.release()            LOG.debug("handleUserRegistration() - User data lock released")        # Pickle file to be re-created or just modified        write_user_data_file()        LOG.info("handleUserRegistration() - Users Pickle file written")        LOG.info("handleUserRegistration() - New App registered with user pseudo ID: '{}', sensor group ID: '{}', public key: '{}'".format(newUserInfo["userpseudoid"], newUserInfo["sensorgroupid"], newUserInfo["rsa4096publickey"]))        # send back an "ack" message        topic = newUserInfo["userpseudoid"] + "/addeduser"        payload = json.dumps({            'sender': 'voice.workingage.eu'        })        LOG.debug("handleUserRegistration() - To send 'ack' to the registraton message, with topic: '{}', payload: '{}'".format(topic, payload))        await publisher.send_multipart([bytes(topic, encoding='utf-8'), bytes(payload, encoding='utf-8')])  # two sequences of bytes encoded in UTF-8        LOG.debug("handleUserRegistration() - Sent 'ack' to the registraton message")def handleUserConsent(message_as_utf8):    """    Handles a message of user consent form, updating the Pickle file (and the userData structure)    :param message_as_utf8: the received message, as topic and payload    :return: Nothing.    """    global userData, userDataPickleFileAbsolutePathName, userFileLock    LOG.info("handleUserConsent() - Registering User consent: {}".format(message_as_utf8))    topic_as_utf8 = message_as_utf8[        0]  # consider the topic; e.g.: sensor.management/S4188c841-e28a-4865-b233-d39a465358ff    topic = topic_as_utf8.decode('utf-8')  # get Python3 string    sensorGroupID = topic.split("/")[1]    payload_as_utf8 = message_as_utf8[1]  # only consider the payload    payload = payload_as_utf8.decode('utf-8')  # get Python3 string    # Example payload sent with the "privacy" topic    # {    #   "userpseudoid": "U550e8400-e29b-41d4-a716-446655440000",    #   "datacollection": true,    #   "headsetandcamera": true,    #   "scientificpurposes": true,    #   "publication": false    # }    newUserConsentInfo = json.loads(payload)    # NOTE: no "ack" message is required    # If the userData structure is still empty (i.e., the Pickle file didn't exist when the script was launched)    if not userData:        LOG.warning("handleUserConsent() - No user data available. Skipping consent update of  SensorGroupID '{}'".format(sensorGroupID))  # In this case we cannot do anything because the user data structure is empty or does not exist    # the userData exists, just modify it    else:        userDataLock.acquire()        LOG.debug("handleUserConsent() - User data lock acquired to update user consents")        try:            assert newUserConsentInfo["userpseudoid"] == userData[sensorGroupID].userPseudoID            # Look for the user connected to the sensor in the topic of the message and update its consent data            userData[sensorGroupID].consentDataCollection = newUserConsentInfo["datacollection"]            userData[sensorGroupID].consentHeadsetAndCamera = newUserConsentInfo["headsetandcamera"]            userData[sensorGroupID].consentScientificPurposes = newUserConsentInfo["scientificpurposes"]            userData[sensorGroupID].consentPublication = newUserConsentInfo["publication"]            LOG.info("handleUserConsent() - New User consent info registered with sensor group ID: '{}'. Updated values: Consent to data collection '{}', Consent to Headset and Camera '{}', Consent to Scientific Purposes '{}', Consent to Publication '{}'".format(sensorGroupID, newUserConsentInfo["datacollection"], newUserConsentInfo["headsetandcamera"], newUserConsentInfo["scientificpurposes"], newUserConsentInfo["publication"]))        except KeyError:            LOG.warning("handleUserConsent() - No user with SensorGroupID '{}' was found. Skipping this consent".format(sensorGroupID))  # In this case we cannot do anything because the user registration still has not happened, it will go with default consent.        except AssertionError:            LOG.warning("handleUserConsent() - Mismatch between registered UserPseudoID {} and received UserPseudoID {} for SensorGroupID '{}'. Skipping this consent".format(userData[sensorGroupID].userPseudoID, newUserConsentInfo["userpseudoid"], sensorGroupID))        userDataLock.release()        LOG.debug("handleUserConsent() - User data lock released")        # Write Pickle file to be re-created        write_user_data_file()        LOG.info("handleUserConsent() - Pickle file written")def handleStartStop(message_as_utf8):    """    Handles a message requiring the voice server to start/stop processing a given SensorGroupID    :param message_as_utf8: the received message, as topic and payload    :return: Nothing.    """    global userState, userStateLock    LOG.info("handleStartStop() - Receiving start/stop: {}".format(message_as_utf8))    topic_as_utf8 = message_as_utf8[0]  # consider the topic; e.g.: sensor.management/S4188c841-e28a-4865-b233-d39a465358ff    topic = topic_as_utf8.decode('utf-8')  # get Python3 string    sensorGroupID = topic.split("/")[1]  # extract sensor group ID; e.g.: S4188c841-e28a-4865-b233-d39a465358ff    payload_as_utf8 = message_as_utf8[1]  # consider the payload    payload = payload_as_utf8.decode('utf-8')  # get Python3 string    # Example payload sent with the "sensor.management" topic    # {    #   "action": "stop",    #   "userpseudoid": "U550e8400-e29b-41d4-a716-446655440000"    # }    sensorManagementInfo = json.loads(payload)    userStateLock.acquire()    LOG.debug("handleStartStop() - User state lock acquired to search for userPseudoID")    try:        assert sensorManagementInfo["userpseudoid"] == userData[sensorGroupID].userPseudoID        if sensorManagementInfo["action"] == "start":  # "start" received            userState[sensorManagementInfo["userpseudoid"]] = "start:" + datetime.now().strftime(                "%Y%m%d%H%M%S")  # insert or update, with current timestamp        elif sensorManagementInfo["action"] == "stop":  # "stop" received            userState.pop(sensorManagementInfo["userpseudoid"], None)  # remove userPseudoID, if present        else:            LOG.warning("handleStartStop() - Receiving unknown/wrong action: {}".format(message_as_utf8))    except AssertionError:        LOG.error("handleStartStop() - Receiving message with mismatch between userPseudoID and SensorGroupID: {}".format(message_as_utf8))    except KeyError:        LOG.error("handleStartStop() - Receiving message with unregistered SensorGroupID: {}, skipping".format(message_as_utf8))    userStateLock.release()    LOG.debug("handleStartStop() - User state lock released")############# UTILITY FUNCTIONS #############async def sendHighLevelInfo(currentSensorGroupID, currentTimestamp, label, probability, publisher):    """    Send emotion to the right user App, via ZeroMQ.    :param currentSensorGroupID: the SensorGroupID of the sensor that sent the WAV file with voice    :param currentTimestamp: the timestamp to use    :param label: the emotion    :param probability: the probability of the emotion    :param publisher: the ZeroMQ publisher socket    :return: Nothing.    """    userDataLock.acquire()    LOG.debug("sendHighLevelInfo() - User data lock acquired to search for currentSensorGroupID")    userDatum = userData.get(currentSensorGroupID)    userDataLock.release()    LOG.debug("sendHighLevelInfo() - User data lock released")    if userDatum is not None:  # it should be there because I checked into receiverTask(), but just in case...        topic = userDatum.userPseudoID        payload = json.dumps({'probability': probability,                              'timeStamp': currentTimestamp,                              'sensorType': 'Microphone',                              'values': {'sensor': 'EmoState',                                         'value': label                                         }                              })        LOG.debug("sendHighLevelInfo() - To send topic: '{}', payload: '{}'".format(topic, payload))        payload_as_utf8 = payload.encode('utf-8')        encrypted_payload_as_bytes = userDatum.encryptor.encrypt(payload_as_utf8)        encrypted_payload_base64 = base64.standard_b64encode(encrypted_payload_as_bytes).decode('utf-8')        await publisher.send_multipart([bytes(topic, encoding='utf-8'), bytes(encrypted_payload_base64, encoding='utf-8')])  # two sequences of bytes encoded in UTF-8        LOG.debug("sendHighLevelInfo() - Sent topic: '{}', encrypted payload: '{}'".format(topic, encrypted_payload_base64))    else:  # if not found, it... disappeared! Something unexpected happened        LOG.error("sendHighLevelInfo() - ERROR Received sensor ID '{}' no longer in data structure containing the Pickle file".format(currentSensorGroupID))async def transcode(flacFileAbsolutePath, wavFileAbsolutePath):    """    Transcode a FLAC file into a WAV file with ffmpeg, run as a subprocess without blocking the event loop.    :param flacFileAbsolutePath: the FLAC file to transcode    :param wavFileAbsolutePath: the WAV file to write    :return: the ffmpeg output (stdout and stderr), None if ffmpeg failed.    """    command = 'ffmpeg -y -i %s %s' % (flacFileAbsolutePath, wavFileAbsolutePath)    try:        process = await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)        output, _ = await process.communicate()    except asyncio.CancelledError:        raise    except BaseException as e:        LOG.error("transcode() - Generic error occurred, output: '{}'".format(e))        return None    if process.returncode != 0:        LOG.error("transcode() - Command '{}' return with error (code {}): {}".format(command, process.returncode, output))        return None    return outputdef audeeringClassifier(audio_file_path):    """    Audeering Classifier    :param audio_file_path: the WAV file containing voice    :return: Multilabel and binary-label predictions    """    # Perform the classification    with audeeringLock:  # one file at a time, whatever the number of classification workers        prediction = aud_classifier.classify(audio_file_path)    if "no_speech" in prediction:        prob = 1 - prediction["no_speech"]        prediction["neutral"] = prediction["no_speech"]        prediction.pop("no_speech")        prediction["happy"] = prob / 3        prediction["angry"] = prob / 3        prediction["sad"] = prob / 3    multilabel_prediction = dict([(l, prediction[AUDEERING_LABELS_CONVERSION_DICT[l]]) for l in LABELS])    binary_prediction = {k: sum([multilabel_prediction[l] for l in LABELS_CONVERSION_DICT[k]]) for k in BINARY_LABELS}    return multilabel_prediction, binary_predictiondef polimiClassifier(wavFile, transcription=""):    """    PATHOSnet Classifier (Polimi)    :param wavFile: the WAV file containing voice    :param transcription: the optional transcription    :return: Multilabel and binary-label predictions    """    # The classifier runs in the graph and session of PATHOSnetRuntime, whatever the calling thread    if PATHOSnetWorkers is not None and PATHOSnetModelLang in ('Esp', 'El'):        sensorGroupID = re.search('^(S[^_]+)_', wavFile).group(1)  # the files of a user go to the same worker        classifierArgs = (ASRVoiceFolderAbsolutePath + wavFile, transcription) if PATHOSnetModelLang == 'Esp' else (ASRVoiceFolderAbsolutePath + wavFile,)        return PATHOSnetWorkers.classify(sensorGroupID, *classifierArgs)    elif PATHOSnetModelLang == 'Esp':        return PATHOSnetClassifier(ASRVoiceFolderAbsolutePath + wavFile, transcription)    elif PATHOSnetModelLang == 'El':        return PATHOSnetClassifier(ASRVoiceFolderAbsolutePath + wavFile)  # transcription is ignored, if Greek    elif PATHOSnetModelLang == 'Eng':        return {l: 0.0 for l in LABELS}, {l: 0.0 for l in BINARY_LABELS}def polimi_models_key(wavFile):    """    Key of the PATHOSnet models classifying a file    :param wavFile: the WAV file containing voice    :return: the index of the worker process of the user, None if the models are in the service process    """    if PATHOSnetWorkers is None or PATHOSnetModelLang not in ('Esp', 'El'):        return None    return PATHOSnetWorkers.worker_index(re.search('^(S[^_]+)_', wavFile).group(1))def reload_classifier(modelsKey, generation):    """    Reset graph and session of the PATHOSnet models and reload them    (this should solve the Keras issue that causes model suspending), unless another timed out classification already    reloaded them    :param modelsKey: the key of the models (see polimi_models_key)    :param generation: the reloads of the models (in PATHOSnetGenerations) when the timed out classification started    :return: Nothing.    """    global PATHOSnetClassifier    with classifierReloadLocks.setdefault(modelsKey, threading.Lock()):  # timeouts of concurrent classifications reload the models one at a time        if PATHOSnetGenerations.get(modelsKey, 0) != generation:            return  # already reloaded since the classification started        PATHOSnetGenerations[modelsKey] = generation + 1        if modelsKey is not None:            PATHOSnetWorkers.restart(modelsKey)  # the suspended models are in the worker process of the user: restart it, the other workers keep serving their users            return        PATHOSnetClassifier.close(wait=False)  # the batching thread may be stuck on the suspended models: its pending classifications fail        PATHOSnetRuntime.reset()        PATHOSnetClassifier = batching.BatchingClassifier(PATHOSnetModelGetterDict[PATHOSnetModelLang]["model_getter"](*PATHOSnetModelGetterDict[PATHOSnetModelLang]["args"], registry=PATHOSnetRegistry, verbose=True), max_wait=classificationBatchMaxWait, max_batch_size=classificationBatchMaxSize)async def pathosnet_with_timeout(wavFile, transcription=""):    """    Run the PATHOSnet classifier in a thread of the default executor, off the event loop, with a timeout; on timeout    reload the models and run again the classifier, as well as when it failed because another timed out    classification reloaded the models in the meantime    :param wavFile: the WAV file containing voice    :param transcription: the optional transcription    :return: Multilabel and binary-label predictions    """    loop = asyncio.get_event_loop()    modelsKey = polimi_models_key(wavFile)    generation = PATHOSnetGenerations.get(modelsKey, 0)    try:        return await asyncio.wait_for(loop.run_in_executor(None, polimiClassifier, wavFile, transcription), classificationTimeout)    except asyncio.TimeoutError:        # A thread cannot be interrupted: the suspended call keeps its thread until it returns (its result is discarded)        LOG.debug("pathosnet_with_timeout() - timeout of {} second(s) triggered model is being restarted".format(classificationTimeout))        await loop.run_in_executor(None, reload_classifier, modelsKey, generation)        LOG.debug("pathosnet_with_timeout() - PATHOSnet model restarted, running again classification")    except asyncio.CancelledError:        raise    except Exception:        if PATHOSnetGenerations.get(modelsKey, 0) == generation:            raise  # failed on its own, not because of a reload        LOG.debug("pathosnet_with_timeout() - PATHOSnet model restarted by another classification, running again classification")    # Run again classification    return await loop.run_in_executor(None, polimiClassifier, wavFile, transcription)async def classify_with_timeout(wavFile, transcription=""):    """    Run the classification off the event loop: PATHOSnet with a timeout (see pathosnet_with_timeout), then the AUD    classifier, which runs one file at a time, without timeout    :param wavFile: the WAV file containing voice    :param transcription: the optional transcription    :return: label, probability    """    LOG.debug("classify_with_timeout() - Started PATHOSnet classifier")    polimiPredictions = await pathosnet_with_timeout(wavFile, transcription)    LOG.debug("classify_with_timeout() - Completed PATHOSnet classifier")    return await asyncio.get_event_loop().run_in_executor(None, classify, wavFile, polimiPredictions)def classify(wavFile, polimiPredictions):    """    Classify wavfile, combining the PATHOSnet predictions with the AUD classifier ones    :param wavFile: the WAV file containing voice    :param polimiPredictions: Multilabel and binary-label predictions of PATHOSnet    :return: label, probability    """    global classificationFolderAbsolutePath, classificationMode    # Begin classification ---------------------------------------------------------------------------------------------    LOG.debug("classify() - Started classification of wav file '{}'".format(wavFile))    multilabelPredictionProbabilitiesPolimi, binaryPredictionProbabilitiesPolimi = polimiPredictions    LOG.debug("classify() - Started AUD classifier")    # Run Audeering model    multilabelPredictionProbabilitiesAud, binaryPredictionProbabilitiesAud = audeeringClassifier(        ASRVoiceFolderAbsolutePath + wavFile)    LOG.debug("classify() - Completed AUD classifier")    # Compute ensemble    multilabelPredictionProbabilitiesEnsemble = {        l: (POLIMI_PREDICTION_WEIGHT * multilabelPredictionProbabilitiesPolimi[l]) + (                    AUD_PREDICTION_WEIGHT * multilabelPredictionProbabilitiesAud[l]) for l in LABELS}    binaryPredictionProbabilitiesEnsemble = {l: (POLIMI_PREDICTION_WEIGHT * binaryPredictionProbabilitiesPolimi[l]) + (                AUD_PREDICTION_WEIGHT * binaryPredictionProbabilitiesAud[l]) for l in BINARY_LABELS}    if classificationMode == "binary":        label = 'Positive' if binaryPredictionProbabilitiesEnsemble[                                  'Positive'] > ENSEBMBLE_BINARY_CLASSIFICATION_THRESHOLD else 'Negative'        probability = binaryPredictionProbabilitiesEnsemble[label]    elif classificationMode == "multilabel":        label = sorted(multilabelPredictionProbabilitiesEnsemble, key=lambda k: -multilabelPredictionProbabilitiesEnsemble[k])[0]        probability = multilabelPredictionProbabilitiesEnsemble[label]    # End classification -----------------------------------------------------------------------------------------------    # Save classified emotion to a .emo textual file    pre, _ = os.path.splitext(wavFile)    emoFile = pre + '.emo'    with open(classificationFolderAbsolutePath + emoFile, 'w', encoding='utf-8') as f:        f.write(label + "\t" + str(probability) + "\n")    shutil.move(classificationFolderAbsolutePath + emoFile,                storageFolderAbsolutePath + emoFile)  # move emo file to the storage area    return label, probabilitydef read_user_data_file():    """    Try to reads the Pickle file, once. Beware that external editing of the Pickle file will not be read by the script until next start    :return: Nothing.    """    global userData, userDataLock, userFileLock    # Try to read Pickle file with user data    if os.path.exists(userDataPickleFileAbsolutePathName):        # userDataLock.acquire()  # protects the userData structure from concurrent access, while filling it        # userFileLock.acquire()  # protects the user data file from concurrent access, while reading it        LOG.info("userRegistrationThread() - Reading Pickle file")        with open(userDataPickleFileAbsolutePathName, "rb") as pickleFile:            userDataRaw = pickle.load(pickleFile)        userData = {key: UserDatumType(            userpseudoid,            PKCS1_OAEP.new(RSA.importKey(publickey)),            RSA.importKey(publickey),            *consent        ) for key, (userpseudoid, publickey, *consent) in userDataRaw.items()}        # userFileLock.release()        # userDataLock.release()    else:        LOG.warning("user_data_read_file() - Pickle file does not exist; will be created")def write_user_data_file():    """        Try to write the Pickle file, once.        :return: Nothing.    """    global userData, userDataLock, userFileLock    # Try to write Pickle file with user data            LOG.info("userRegistrationThread() - Reading Pickle file")    userDataLock.acquire()  # protects the userData structure from concurrent access, while filling it    LOG.debug("write_user_data_file() - User data lock acquired to update file")    userFileLock.acquire()  # protects the user data file from concurrent access, while reading it    LOG.debug("write_user_data_file() - User file lock acquired to update file")    writeData = {key: (        userData.userPseudoID,        userData.publickey.exportKey(),        userData.consentDataCollection,        userData.consentHeadsetAndCamera,        userData.consentScientificPurposes,        userData.consentPublication    ) for key, userData in userData.items()}    with open(userDataPickleFileAbsolutePathName, "wb") as pickleFile:        pickle.dump(writeData, pickleFile)    # the file is writable/readable/executable only by the owner    os.chmod(userDataPickleFileAbsolutePathName, stat.S_IWUSR | stat.S_IRUSR | stat.S_IXUSR)    userFileLock.release()    LOG.debug("write_user_data_file() - User file lock released")    userDataLock.release()    LOG.debug("write_user_data_file() - User data lock released")def init_logging(log_file=None, append=False, loglevel=logging.INFO):    """    Initialize the logger    :param log_file: the file where the log should be written; if None, the log is written on stderr    :param append: when writing to a file, append or not.    :param loglevel: the log level.    :return: Nothing.    """    global LOG    class StdIOLogger(object):        """        Custom object to enable writing stdout and stderr to log file.        Adapted from https://stackoverflow.com/questions/19425736/how-to-redirect-stdout-and-stderr-to-logger-in-python        """        def __init__(self, logger, log_level):            self.logger = logger            self.log_level = log_level            self.linebuf = ''        def write(self, buf):            for line in buf.rstrip().splitlines():                self.logger.log(self.log_level, line.rstrip())        def flush(self):            pass    # adapted from: https://www.programcreek.com/python/example/136/logging.basicConfig    # define a Handler which writes to a file    if log_file is not None:        logging.basicConfig(level=loglevel,                            format="%(asctime)s %(levelname)s %(threadName)s %(name)s %(message)s",                            filename=log_file,                            filemode='a' if append else 'w')    # define a Handler which writes messages to sys.stderr    else:        logging.basicConfig(level=loglevel, format="%(asctime)s %(levelname)s %(threadName)s %(name)s %(message)s")    LOG = logging.getLogger("WALog")    # Redirect stdout as log INFO    # sys.stdout = StdIOLogger(LOG, logging.INFO)    # Redirect stderr as log ERROR    # sys.stderr = StdIOLogger(LOG, logging.ERROR)async def serve():    """    Runs the service tasks on the event loop, until SIGINT/SIGTERM.    :return: Nothing.    """    global stopEvent, zmqContext    loop = asyncio.get_event_loop()    # Each classification may leave a thread on timed out models (until they are reloaded) besides the one running it again, plus the thread reloading the models    loop.set_default_executor(ThreadPoolExecutor(max_workers=2 * classificationWorkers + 1))    stopEvent = asyncio.Event()    # The app will terminate on SIGINT or SIGTERM signals    loop.add_signal_handler(signal.SIGINT, stopEvent.set)  # i.e., CTRL-C    loop.add_signal_handler(signal.SIGTERM, stopEvent.set)  # from systemd, on service stopping    zmqContext = zmq.asyncio.Context()    # Connect to ZeroMQ as a PUBLISHER, shared by the tasks (they all run on the event loop thread)    publisher = zmqContext.socket(zmq.PUB)    publisher.connect("tcp://{}:{}".format(zeroMQProxyHostName, zeroMQProxyPortNumberForPub))  # Connect to ZeroMQ proxy server    # Bounded queue of the files to classify: when classification lags behind, files wait on disk    classificationQueue = asyncio.Queue(maxsize=classificationQueueSize)    tasks = [loop.create_task(controlTask(publisher)),  # waits for new user registrations, user consent and start/stop messages             loop.create_task(receiverTask()),  # waits for FLAC files copied by the AUD noiseBox             loop.create_task(schedulerTask(classificationQueue))]  # waits for files to classify    tasks += [loop.create_task(classifierTask(classificationQueue, publisher)) for _ in range(classificationWorkers)]  # run the classifier    await stopEvent.wait()    LOG.info('serve() - SIGINT/SIGTERM RECEIVED. Stopping tasks...')    # cancel the tasks and wait until all of them are stopped or until a timer (5 seconds) fires    for task in tasks:        task.cancel()    await asyncio.wait(tasks, timeout=5)    publisher.close(linger=0)    zmqContext.term()    if PATHOSnetWorkers is not None:        PATHOSnetWorkers.close()############# THE MAIN ############## BACKGROUND mode: issue the command:#     nohup python3 workingAgeVoiceService.py &# SYSTEMD mode: for starting workingAgeVoiceService.py as a systemd service, see:#     https://tecadmin.net/setup-autorun-python-script-using-systemd/#     https://www.golinuxcloud.com/run-systemd-service-specific-user-group-linux/## Commands:#     sudo systemctl status/start/stop/enable/disable workingage.service#     journalctl -u workingage# Service configuration in file:#     /lib/systemd/system/workingage.service# FOREGROUND mode: just for testing. Be sure that neither the BACKGROUND nor the SYSTEMD modes are used.# Issue the command:#     python3 workingAgeVoiceService.py# During tests, when using a local ZeroMQ proxy, to check its status issue the command:#     netstat -a | grep -e:5559 -e:5560def main():    # Configuring the logger    if runAs == "background":        init_logging(log_file=loggingFileAbsolutePath, append=LogFileAppendMode, loglevel=loggingLevel)        LOG.info('Running as background job; PID: ' + str(os.getpid()))    elif runAs == "systemd":        init_logging(log_file=loggingFileAbsolutePath, append=LogFileAppendMode, loglevel=loggingLevel)        LOG.info(            'Running as systemd service; use "journalctl -u workingage" and "sudo systemctl status workingage.service" to check status.')        LOG.info('Running as systemd job; PID: ' + str(os.getpid()))    elif runAs == "foreground":        init_logging(loglevel=loggingLevel)        LOG.info('Running as foreground process.')    LOG.info("Edge Cloud Voice manager. Press CTRL-C or send SIGINT/SIGTERM to stop.")    for model_key, model_bytes in PATHOSnetRegistry.memory_usage().items():        LOG.info("PATHOSnet model {} loaded, {:.1f} MB".format(model_key, model_bytes / 2 ** 20))    if PATHOSnetWorkers is not None:        LOG.info("PATHOSnet models loaded in {} worker processes{}".format(PATHOSnetWorkers.num_workers, " (prefork)" if PATHOSnetWorkers.prefork else ""))        for process_name, process_memory in sorted(PATHOSnetWorkers.memory_usage().items()):            LOG.info("PATHOSnet {} memory: RSS {:.1f} MB, PSS {:.1f} MB, private {:.1f} MB".format(process_name, process_memory['rss'] / 2 ** 20, process_memory['pss'] / 2 ** 20, process_memory['private'] / 2 ** 20))        LOG.info("PATHOSnet workers memory saved by shared pages: {:.1f} MB".format(PATHOSnetWorkers.memory_saved() / 2 ** 20))    # try reading the Pickle file, if already present, just once    read_user_data_file()    # Run the service tasks until SIGINT/SIGTERM    asyncio.get_event_loop().run_until_complete(serve())    # exit and terminate all threads still running (e.g., a suspended classification)    LOG.info('main() - SIGINT/SIGTERM RECEIVED. Exiting 👋🏻')    logging.shutdown()    os._exit(0)if __name__ == "__main__":    main()
\ No newline at end of file
@@ -0,0 +1,50 @@
+#! /usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+#########################
+# GhostVLAD shared backbone mode against the windowed embeddings
+#########################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'polimi'))
+
+import numpy as np
+import pytest
+
+keras = pytest.importorskip('keras')
+
+
+@pytest.fixture(scope='module')
+def extractors(tmp_path_factory):
+    keras.backend.set_learning_phase(0)
+    from ghostvlad.ghostvlad.ghostvlad_features_extractor import FeaturesExtractor, GhostVladConfig
+    from ghostvlad.ghostvlad import ghostvlad_model
+
+    # Random weights, saved to be loaded by the extractors
+    path = str(tmp_path_factory.mktemp('ghostvlad') / 'ghostvlad_weights.h5')
+    ghostvlad_model.vggvox_resnet2d_icassp(
+        input_dim=(257, None, 1), num_class=5994, mode='eval', args=GhostVladConfig()).save_weights(path)
+    return FeaturesExtractor(path), FeaturesExtractor(path, shared_backbone=True)
+
+
+def test_single_window_matches(extractors):
+    # With a single window the trunk sees the same input in both modes
+    windowed, shared = extractors
+    mag_T = np.abs(np.random.RandomState(0).normal(size=(257, 30))).astype(np.float32)
+    np.testing.assert_allclose(shared.features_from_spectrogram(mag_T), windowed.features_from_spectrogram(mag_T),
+                               rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('time', [29, 31, 45, 200, 1001])
+def test_windows_match(extractors, time):
+    windowed, shared = extractors
+    mag_T = np.abs(np.random.RandomState(time).normal(size=(257, time))).astype(np.float32)
+    feats, reference = shared.features_from_spectrogram(mag_T), windowed.features_from_spectrogram(mag_T)
+    assert len(feats) == len(reference)
+    if len(reference) > 0:
+        assert feats.shape == reference.shape and feats.dtype == reference.dtype
+        # Only the trunk context differs: per window cosine similarity measured >= 0.955 (see README.md)
+        feats, reference = feats.reshape(len(feats), -1), reference.reshape(len(reference), -1)
+        cosine = np.sum(feats * reference, axis=1) / (np.linalg.norm(feats, axis=1) * np.linalg.norm(reference, axis=1))
+        assert np.all(cosine > 0.95), cosine.min()
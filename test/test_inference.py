@@ -0,0 +1,309 @@
+#! /usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+#########################
+# Numerical equivalence of the models rewritten for inference against the original ones
+#########################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'polimi'))
+
+import numpy as np
+import pytest
+
+keras = pytest.importorskip('keras')
+
+import inference
+from model import get_pathosnet_multimodal, get_pathosnet_voice
+
+
+@pytest.fixture(autouse=True)
+def _clear_keras_session():
+    # Each test builds its models in the Keras graph, cleared afterwards so that their weights (about 300 MB for
+    # VGGish) do not add up over the tests
+    yield
+    keras.backend.clear_session()
+
+
+def _randomize_batch_normalization(model, seed=0):
+    # Freshly initialised batch normalization layers are (almost) identities, which would hide folding errors
+    random_state = np.random.RandomState(seed)
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.BatchNormalization):
+            weights = [random_state.uniform(0.5, 1.5, w.shape) for w in layer.get_weights()]
+            weights[-2] -= 1.  # Moving mean, the moving variance stays positive
+            layer.set_weights(weights)
+
+
+def _randomize_biases(model, seed=0):
+    # Freshly initialised biases are zeros, identical constants that the TensorFlow Lite converter stores once, which
+    # breaks the int8 quantization of the layers sharing them (trained biases differ)
+    random_state = np.random.RandomState(seed)
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.Dense) and layer.use_bias:
+            kernel, bias = layer.get_weights()
+            layer.set_weights([kernel, random_state.normal(scale=0.01, size=bias.shape)])
+
+
+def test_pathosnet_voice_optimized_matches():
+    keras.backend.set_learning_phase(0)
+    model = get_pathosnet_voice()
+    _randomize_batch_normalization(model)
+    optimized_model = inference.optimize_for_inference(model)
+    assert not any(isinstance(layer, keras.layers.SpatialDropout1D) for layer in optimized_model.layers)
+    assert not any(isinstance(layer, keras.layers.Lambda) for layer in optimized_model.layers)
+    # Only the batch normalization layers following a max pooling are left
+    assert sum(isinstance(layer, keras.layers.BatchNormalization) for layer in optimized_model.layers) < \
+        sum(isinstance(layer, keras.layers.BatchNormalization) for layer in model.layers)
+
+    random_state = np.random.RandomState(1)
+    x = [random_state.normal(size=(2, 20, 128)), random_state.normal(size=(2, 20, 512))]
+    np.testing.assert_allclose(optimized_model.predict(x), model.predict(x), rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('build_fn', [get_pathosnet_voice, get_pathosnet_multimodal])
+@pytest.mark.parametrize('optimize', [False, True])
+def test_pathosnet_masked_matches(build_fn, optimize):
+    keras.backend.set_learning_phase(0)
+    model = build_fn()
+    _randomize_batch_normalization(model)
+    model = inference.optimize_for_inference(model) if optimize else model
+    masked_model = inference.masked_sequence_model(model)
+    assert len(masked_model.inputs) == 2 * len(model.inputs)
+
+    # Odd and even lengths, padded to 16 steps
+    random_state = np.random.RandomState(1)
+    lengths = [1, 2, 3, 7, 8, 13, 16]
+    sequences = [[random_state.normal(size=(1, n, int(x.shape[-1]))) for x in model.inputs] for n in lengths]
+    padded = [np.zeros((len(lengths), 16, int(x.shape[-1]))) for x in model.inputs]
+    masks = [np.zeros((len(lengths), 16, 1)) for _ in model.inputs]
+    for i, (n, inputs) in enumerate(zip(lengths, sequences)):
+        for batch, mask, x in zip(padded, masks, inputs):
+            batch[i, :n], mask[i, :n] = x[0], 1.
+    expected = np.concatenate([model.predict(inputs) for inputs in sequences])
+    np.testing.assert_allclose(masked_model.predict(padded + masks), expected, rtol=1e-4, atol=1e-5)
+
+
+def test_ghostvlad_optimized_matches():
+    keras.backend.set_learning_phase(0)
+    from ghostvlad.ghostvlad.ghostvlad_features_extractor import GhostVladConfig
+    from ghostvlad.ghostvlad import ghostvlad_model
+
+    model = ghostvlad_model.vggvox_resnet2d_icassp(input_dim=(257, None, 1), num_class=5994, mode='eval',
+                                                   args=GhostVladConfig())
+    _randomize_batch_normalization(model)
+    optimized_model = inference.optimize_for_inference(model)
+    assert not any(isinstance(layer, keras.layers.BatchNormalization) for layer in optimized_model.layers)
+
+    x = np.random.RandomState(1).uniform(size=(2, 257, 30, 1))
+    np.testing.assert_allclose(optimized_model.predict(x), model.predict(x), rtol=1e-4, atol=1e-5)
+
+
+def _frozen_graph_model(path, loading, kind):
+    # Frozen graph loaded on its own, in the graph of a runtime configuration or through a model registry; in the
+    # shared graph another copy is imported first, so the tested one does not take the first scope
+    import registry
+    import runtime
+
+    if loading == 'standalone':
+        return inference.load_model(path, build_fn=None)
+    runtime_config = runtime.RuntimeConfig()
+    inference.load_model(path, build_fn=None, runtime_config=runtime_config)
+    if loading == 'runtime':
+        return inference.load_model(path, build_fn=None, runtime_config=runtime_config)
+    model_registry = registry.ModelRegistry(runtime_config)
+    if kind == 'pathosnet':
+        return model_registry.pathosnet(path, 'voice')
+    if kind == 'vggish':
+        return model_registry.vggish(path)
+    return model_registry.ghostvlad(path).network_eval
+
+
+def _assert_frozen_graph_matches(model, tmp_path, inputs, loading, kind, rtol=1e-4, atol=1e-5):
+    path = str(tmp_path / ('model' + inference.FROZEN_GRAPH_EXTENSION))
+    inference.export_frozen_graph(model, path)
+    frozen_model = _frozen_graph_model(path, loading, kind)
+    assert isinstance(frozen_model, inference.FrozenGraphModel)
+    np.testing.assert_allclose(frozen_model.predict(inputs), model.predict(inputs), rtol=rtol, atol=atol)
+
+
+@pytest.mark.parametrize('loading', ['standalone', 'runtime', 'registry'])
+def test_pathosnet_voice_frozen_graph_matches(tmp_path, loading):
+    keras.backend.set_learning_phase(0)
+    model = get_pathosnet_voice()
+    _randomize_batch_normalization(model)
+    random_state = np.random.RandomState(1)
+    x = [random_state.normal(size=(2, 20, 128)).astype(np.float32),
+         random_state.normal(size=(2, 20, 512)).astype(np.float32)]
+    _assert_frozen_graph_matches(model, tmp_path, x, loading, 'pathosnet')
+
+
+@pytest.mark.parametrize('loading', ['standalone', 'runtime', 'registry'])
+def test_vggish_frozen_graph_matches(tmp_path, loading):
+    keras.backend.set_learning_phase(0)
+    from model import get_vggish
+
+    model = get_vggish()
+    x = np.random.RandomState(1).uniform(size=(3, 96, 64, 1)).astype(np.float32)
+    _assert_frozen_graph_matches(model, tmp_path, x, loading, 'vggish')
+
+
+@pytest.mark.parametrize('loading', ['standalone', 'runtime', 'registry'])
+def test_ghostvlad_frozen_graph_matches(tmp_path, loading):
+    keras.backend.set_learning_phase(0)
+    from ghostvlad.ghostvlad.ghostvlad_features_extractor import GhostVladConfig
+    from ghostvlad.ghostvlad import ghostvlad_model
+
+    model = ghostvlad_model.vggvox_resnet2d_icassp(input_dim=(257, None, 1), num_class=5994, mode='eval',
+                                                   args=GhostVladConfig())
+    _randomize_batch_normalization(model)
+    x = np.random.RandomState(1).uniform(size=(2, 257, 30, 1)).astype(np.float32)
+    _assert_frozen_graph_matches(model, tmp_path, x, loading, 'ghostvlad')
+
+
+def _assert_tflite_matches(model, tmp_path, inputs, input_shapes=None, rtol=1e-4, atol=1e-5):
+    pytest.importorskip('tensorflow.lite')
+    path = str(tmp_path / ('model' + inference.TFLITE_EXTENSION))
+    inference.export_tflite(model, path, input_shapes=input_shapes)
+    tflite_model = inference.load_model(path, build_fn=None)
+    assert isinstance(tflite_model, inference.TFLiteModel)
+    np.testing.assert_allclose(tflite_model.predict(inputs), model.predict(inputs), rtol=rtol, atol=atol)
+
+
+def test_pathosnet_voice_tflite_matches(tmp_path):
+    keras.backend.set_learning_phase(0)
+    model = get_pathosnet_voice()
+    _randomize_batch_normalization(model)
+    random_state = np.random.RandomState(1)
+    x = [random_state.normal(size=(1, 20, 128)).astype(np.float32),
+         random_state.normal(size=(1, 20, 512)).astype(np.float32)]
+    _assert_tflite_matches(model, tmp_path, x, input_shapes=[(20, 128), (20, 512)])
+    # The converter fixes the sequence length
+    tflite_model = inference.load_model(str(tmp_path / ('model' + inference.TFLITE_EXTENSION)), build_fn=None)
+    with pytest.raises(ValueError):
+        tflite_model.predict([x_i[:, :7] for x_i in x])
+
+
+def test_vggish_tflite_matches(tmp_path):
+    keras.backend.set_learning_phase(0)
+    from model import get_vggish
+
+    model = get_vggish()
+    x = np.random.RandomState(1).uniform(size=(3, 96, 64, 1)).astype(np.float32)
+    _assert_tflite_matches(model, tmp_path, x, input_shapes=[(96, 64, 1)])
+
+
+def test_vggish_tflite_empty_batch(tmp_path):
+    pytest.importorskip('tensorflow.lite')
+    keras.backend.set_learning_phase(0)
+    import utils
+    from model import get_vggish
+
+    # Audio shorter than a VGGish example (0.5 s) has no examples
+    x = np.expand_dims(utils.waveform_to_examples(np.zeros(8000, dtype=np.float32), 16000, dtype=np.float32), -1)
+    assert x.shape == (0, 96, 64, 1)
+    model = get_vggish()
+    path = str(tmp_path / ('model' + inference.TFLITE_EXTENSION))
+    inference.export_tflite(model, path, input_shapes=[(96, 64, 1)])
+    tflite_model = inference.load_model(path, build_fn=None)
+    outputs = tflite_model.predict(x)
+    expected = inference.as_callable(model).predict(x)
+    assert outputs.shape == expected.shape == (0, 128) and outputs.dtype == expected.dtype
+    # The interpreter still serves non-empty batches afterwards
+    x = np.random.RandomState(1).uniform(size=(2, 96, 64, 1)).astype(np.float32)
+    np.testing.assert_allclose(tflite_model.predict(x), model.predict(x), rtol=1e-4, atol=1e-5)
+
+
+def test_ghostvlad_tflite_matches(tmp_path):
+    keras.backend.set_learning_phase(0)
+    from ghostvlad.ghostvlad.ghostvlad_features_extractor import GhostVladConfig
+    from ghostvlad.ghostvlad import ghostvlad_model
+
+    model = ghostvlad_model.vggvox_resnet2d_icassp(input_dim=(257, None, 1), num_class=5994, mode='eval',
+                                                   args=GhostVladConfig(tflite_compatible=True))
+    _randomize_batch_normalization(model)
+    x = np.random.RandomState(1).uniform(size=(2, 257, 30, 1)).astype(np.float32)
+    _assert_tflite_matches(model, tmp_path, x, input_shapes=[(257, 30, 1)])
+
+
+@pytest.mark.parametrize('tflite_compatible', [False, True])
+@pytest.mark.parametrize('shape', [(2, 3, 5, 4), (7, 1, 16, 32)])
+def test_vlad_pooling_matches_reference(shape, tflite_compatible):
+    from ghostvlad.ghostvlad.ghostvlad_model import VladPooling
+
+    random_state = np.random.RandomState(0)
+    feat = random_state.normal(size=shape).astype(np.float32)
+    cluster_score = random_state.normal(size=shape[:-1] + (6,)).astype(np.float32)
+    inputs = [keras.layers.Input(shape=feat.shape[1:]), keras.layers.Input(shape=cluster_score.shape[1:])]
+    vlad_pooling = VladPooling(mode='gvlad', k_centers=4, g_centers=2, tflite_compatible=tflite_compatible)
+    model = keras.models.Model(inputs, vlad_pooling(inputs))
+    centers = vlad_pooling.get_weights()[0]
+
+    # GhostVLAD as in the paper (and the original layer): soft-assignment weighted residuals, materialised as a
+    # bz x W x H x clusters x D tensor, ghost clusters dropped, intra-normalization
+    a = np.exp(cluster_score - cluster_score.max(-1, keepdims=True))
+    a /= a.sum(-1, keepdims=True)
+    residuals = np.sum(a[..., None] * (feat[..., None, :] - centers), axis=(1, 2))[:, :4]
+    reference = residuals / np.linalg.norm(residuals, axis=-1, keepdims=True)
+    np.testing.assert_allclose(model.predict([feat, cluster_score]), reference.reshape(shape[0], -1),
+                               rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('quantization', ['dynamic', 'int8'])
+def test_vggish_quantized_tflite(tmp_path, quantization):
+    pytest.importorskip('tensorflow.lite')
+    keras.backend.set_learning_phase(0)
+    from model import get_vggish
+
+    model = get_vggish()
+    _randomize_biases(model)
+    random_state = np.random.RandomState(1)
+    calibration_inputs = random_state.uniform(size=(8, 96, 64, 1)).astype(np.float32)
+    x = random_state.uniform(size=(3, 96, 64, 1)).astype(np.float32)
+    float_path = str(tmp_path / ('float' + inference.TFLITE_EXTENSION))
+    quantized_path = str(tmp_path / ('quantized' + inference.TFLITE_EXTENSION))
+    inference.export_tflite(model, float_path, input_shapes=[(96, 64, 1)])
+    inference.export_tflite(model, quantized_path, input_shapes=[(96, 64, 1)], quantization=quantization,
+                            representative_data=lambda: ([x_i[None]] for x_i in calibration_inputs))
+
+    # int8 weights take (about) a fourth of the float32 ones
+    assert os.path.getsize(quantized_path) < 0.3 * os.path.getsize(float_path)
+    np.testing.assert_allclose(inference.TFLiteModel(quantized_path).predict(x), model.predict(x), atol=1e-2)
+
+
+def test_keras_function_model_matches_predict():
+    keras.backend.set_learning_phase(0)
+    model = get_pathosnet_voice()
+    _randomize_batch_normalization(model)
+    function_model = inference.as_callable(model)
+    assert isinstance(function_model, inference.KerasFunctionModel) and function_model.model is model
+
+    random_state = np.random.RandomState(1)
+    x = [random_state.normal(size=(5, 20, 128)), random_state.normal(size=(5, 20, 512))]
+    reference = model.predict(x)
+    np.testing.assert_allclose(function_model.predict(x), reference, rtol=1e-6)
+    np.testing.assert_allclose(function_model.predict(x, batch_size=2), reference, rtol=1e-6)
+
+
+def test_runtime_config_serves_other_threads():
+    import threading
+
+    import runtime
+
+    runtime_config = runtime.RuntimeConfig(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1)
+    config = runtime_config.session_config()
+    assert config.intra_op_parallelism_threads == 1 and config.inter_op_parallelism_threads == 1
+    with runtime_config.scope():
+        model = get_pathosnet_voice()
+        predictor = inference.as_callable(model)
+    assert model.outputs[0].graph is runtime_config.graph
+
+    random_state = np.random.RandomState(1)
+    x = [random_state.normal(size=(1, 20, 128)), random_state.normal(size=(1, 20, 512))]
+    outputs = []
+    thread = threading.Thread(target=lambda: outputs.append(runtime_config.scoped(predictor.predict)(x)))
+    thread.start()
+    thread.join()
+    with runtime_config.scope():
+        np.testing.assert_allclose(outputs[0], model.predict(x), rtol=1e-6)
@@ -0,0 +1,44 @@
+#! /usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+#########################
+# Low-rank factorization of the VGGish fully connected layers
+#########################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'polimi'))
+
+import numpy as np
+import pytest
+
+keras = pytest.importorskip('keras')
+
+import model
+from vggish_compression import compressed_vggish, factorize_dense
+
+
+def test_factorize_dense_full_rank_is_exact():
+    kernel = np.random.RandomState(0).normal(size=(64, 32))
+    low_rank_kernel, kernel_ = factorize_dense(kernel, 32)
+    assert low_rank_kernel.shape == (64, 32) and kernel_.shape == (32, 32)
+    np.testing.assert_allclose(low_rank_kernel @ kernel_, kernel, atol=1e-10)
+    # Truncation keeps the best approximation of the given rank
+    low_rank_kernel, kernel_ = factorize_dense(kernel, 8)
+    s = np.linalg.svd(kernel, compute_uv=False)
+    np.testing.assert_allclose(np.linalg.norm(low_rank_kernel @ kernel_ - kernel), np.linalg.norm(s[8:]), rtol=1e-8)
+
+
+def test_compressed_vggish_round_trip(tmp_path):
+    keras.backend.set_learning_phase(0)
+    vggish = model.get_vggish()
+    ranks = (256, 64, None)
+    compressed = compressed_vggish(vggish, ranks)
+    assert compressed.count_params() < vggish.count_params()
+
+    path = str(tmp_path / 'vggish_compressed.h5')
+    model.save_vggish_weights(compressed, path, dense_ranks=ranks)
+    assert model.get_vggish_dense_ranks(path) == ranks
+    loaded = model.get_vggish(path)
+    x = np.random.RandomState(1).uniform(size=(2, 96, 64, 1)).astype(np.float32)
+    np.testing.assert_allclose(loaded.predict(x), compressed.predict(x), rtol=1e-5, atol=1e-7)
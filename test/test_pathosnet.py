@@ -0,0 +1,201 @@
+#! /usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+#########################
+# PATHOSnet classifiers: model registry, classifier shared among threads, batched predictions and worker processes
+# against serial calls
+#########################
+
+import os
+import signal
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'polimi'))
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+keras = pytest.importorskip('keras')
+
+
+@pytest.fixture(scope='module')
+def weights_paths(tmp_path_factory):
+    from ghostvlad.ghostvlad.ghostvlad_features_extractor import GhostVladConfig
+    from ghostvlad.ghostvlad import ghostvlad_model
+    import model
+
+    # Random weights (and word embeddings), saved to be loaded by the classifiers
+    path = tmp_path_factory.mktemp('pathosnet')
+    model.get_pathosnet_voice().save_weights(str(path / 'pathosnet_voice_weights.h5'))
+    model.get_pathosnet_multimodal().save_weights(str(path / 'pathosnet_multimodal_weights.h5'))
+    model.save_vggish_weights(model.get_vggish(), str(path / 'vggish_weights.h5'))
+    ghostvlad_model.vggvox_resnet2d_icassp(
+        input_dim=(257, None, 1), num_class=5994, mode='eval', args=GhostVladConfig()).save_weights(
+        str(path / 'ghostvlad_weights.h5'))
+    random_state = np.random.RandomState(0)
+    with open(str(path / 'word_embeddings.vec'), 'w') as f:
+        f.write('2 300\n')
+        for word in ['unknown', 'hola']:
+            f.write(word + ' ' + ' '.join('{:.4f}'.format(v) for v in random_state.normal(size=300)) + '\n')
+    return {name: str(path / (name + extension)) for name, extension in [
+        ('pathosnet_voice_weights', '.h5'), ('pathosnet_multimodal_weights', '.h5'), ('vggish_weights', '.h5'),
+        ('ghostvlad_weights', '.h5'), ('word_embeddings', '.vec')]}
+
+
+@pytest.fixture(scope='module')
+def classifier(weights_paths):
+    import pathosnet
+    import runtime
+
+    # Dedicated runtime, with more than one inter-op thread to let the calls overlap
+    return pathosnet.pathosnet_voice_classifier(
+        weights_paths['pathosnet_voice_weights'], weights_paths['vggish_weights'], weights_paths['ghostvlad_weights'],
+        runtime_config=runtime.RuntimeConfig(inter_op_parallelism_threads=2))
+
+
+@pytest.fixture(scope='module')
+def shared_backbone_classifier(weights_paths):
+    import pathosnet
+    import runtime
+
+    # The GhostVLAD trunk runs while extracting the network inputs, in the thread of the caller
+    return pathosnet.pathosnet_voice_classifier(
+        weights_paths['pathosnet_voice_weights'], weights_paths['vggish_weights'], weights_paths['ghostvlad_weights'],
+        shared_backbone=True, runtime_config=runtime.RuntimeConfig(inter_op_parallelism_threads=2))
+
+
+def test_registry_shares_models(weights_paths):
+    import pathosnet
+    import registry
+    import runtime
+
+    model_registry = registry.ModelRegistry(runtime.RuntimeConfig())
+    voice = pathosnet.pathosnet_voice_classifier(
+        weights_paths['pathosnet_voice_weights'], weights_paths['vggish_weights'], weights_paths['ghostvlad_weights'],
+        registry=model_registry)
+    multimodal = pathosnet.pathosnet_multimodal_classifier(
+        weights_paths['pathosnet_multimodal_weights'], weights_paths['word_embeddings'],
+        weights_paths['vggish_weights'], weights_paths['ghostvlad_weights'], registry=model_registry)
+    assert voice.vggish is multimodal.vggish and voice.ghostvlad is multimodal.ghostvlad
+    assert voice.pathosnet is not multimodal.pathosnet
+    # Two PATHOSnet models, VGGish, GhostVLAD and word embeddings
+    usage = model_registry.memory_usage()
+    assert len(usage) == 5 and all(size > 0 for size in usage.values())
+    # Both classifiers run on the shared models
+    waveform = np.random.RandomState(0).uniform(-1., 1., size=32000).astype(np.float32)
+    voice(waveform, sample_rate=16000)
+    multimodal(waveform, ['hola', 'mundo'], sample_rate=16000)
+    # Reset runtimes drop the loaded models
+    model_registry.runtime_config.reset()
+    assert model_registry.memory_usage() == {}
+    with pytest.raises(ValueError):
+        pathosnet.pathosnet_voice_classifier(
+            weights_paths['pathosnet_voice_weights'], weights_paths['vggish_weights'],
+            weights_paths['ghostvlad_weights'], runtime_config=runtime.RuntimeConfig(), registry=model_registry)
+
+
+def _waveforms():
+    random_state = np.random.RandomState(0)
+    # Noise of different durations (from less than one VGGish example to several GhostVLAD windows)
+    return [random_state.uniform(-1., 1., size=int(duration * 16000)).astype(np.float32)
+            for duration in [0.5, 1., 1.5, 2., 3., 4.]] * 4
+
+
+def _assert_same_predictions(parallel, serial, rtol=1e-5, atol=1e-6):
+    assert len(parallel) == len(serial)
+    for (multilabel, binary), (reference_multilabel, reference_binary) in zip(parallel, serial):
+        assert multilabel.keys() == reference_multilabel.keys() and binary.keys() == reference_binary.keys()
+        np.testing.assert_allclose([multilabel[k] for k in reference_multilabel],
+                                   [reference_multilabel[k] for k in reference_multilabel], rtol=rtol, atol=atol)
+        np.testing.assert_allclose([binary[k] for k in reference_binary],
+                                   [reference_binary[k] for k in reference_binary], rtol=rtol, atol=atol)
+
+
+def test_thread_pool_matches_serial(classifier):
+    waveforms = _waveforms()
+    serial = [classifier(waveform, sample_rate=16000) for waveform in waveforms]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        parallel = list(executor.map(lambda waveform: classifier(waveform, sample_rate=16000), waveforms))
+
+    _assert_same_predictions(parallel, serial)
+
+
+@pytest.mark.parametrize('classifier_name', ['classifier', 'shared_backbone_classifier'])
+def test_batching_matches_serial(request, classifier_name):
+    import batching
+
+    classifier = request.getfixturevalue(classifier_name)
+    waveforms = _waveforms()
+    serial = [classifier(waveform, sample_rate=16000) for waveform in waveforms]
+    # Long wait, so that the requests of the threads end up in the same batches
+    batching_classifier = batching.BatchingClassifier(classifier, max_wait=0.1, max_batch_size=8)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            batched = list(executor.map(lambda waveform: batching_classifier(waveform, sample_rate=16000), waveforms))
+    finally:
+        batching_classifier.close()
+
+    # Batches change the order of the floating point operations
+    _assert_same_predictions(batched, serial, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('classifier_name', ['classifier', 'shared_backbone_classifier'])
+def test_classify_batch_matches_serial(request, classifier_name):
+    classifier = request.getfixturevalue(classifier_name)
+    waveforms = _waveforms()
+    serial = [classifier(waveform, sample_rate=16000) for waveform in waveforms]
+    # Utterances of different lengths run together on the masked PATHOSnet
+    assert classifier.masked_pathosnet is not None
+    _assert_same_predictions(classifier.classify_batch(waveforms, sample_rate=16000), serial, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('prefork', [False, True])
+def test_worker_pool_matches_serial(classifier, weights_paths, tmp_path, prefork):
+    pytest.importorskip('zmq')
+    import soundfile as sf
+    import workers
+
+    audio_file_paths = []
+    for i, waveform in enumerate(_waveforms()[:6]):
+        audio_file_paths.append(str(tmp_path / 'utterance_{}.wav'.format(i)))
+        sf.write(audio_file_paths[-1], waveform, 16000, subtype='FLOAT')
+    serial = [classifier(audio_file_path) for audio_file_path in audio_file_paths]
+
+    pool = workers.WorkerPool(2, 'voice', (weights_paths['pathosnet_voice_weights'], weights_paths['vggish_weights'],
+                                           weights_paths['ghostvlad_weights']), cpu_only=True, prefork=prefork)
+    try:
+        # Keys of each worker
+        assert {pool.worker_index('user-{}'.format(i)) for i in range(16)} == {0, 1}
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            parallel = list(executor.map(lambda args: pool.classify('user-{}'.format(args[0]), args[1], timeout=60),
+                                         enumerate(audio_file_paths)))
+        # Failed classifications are reported to the caller
+        with pytest.raises(RuntimeError):
+            pool.classify('user-0', str(tmp_path / 'missing.wav'), timeout=60)
+        # Restarting the worker of a key fails only its pending requests, the other worker keeps running
+        restarted = pool.worker_index('user-0')
+        pids = list(pool._pids)
+        pool.restart(restarted)
+        assert [pid != old_pid for pid, old_pid in zip(pool._pids, pids)] == [i == restarted for i in range(2)]
+        restarted_prediction = pool.classify('user-0', audio_file_paths[0], timeout=60)
+        # Memory of each process (the preloading one included in prefork mode)
+        usage = pool.memory_usage()
+        assert set(usage) == {'worker 0', 'worker 1'} | ({'preloader'} if prefork else set())
+        assert all(0 < memory['pss'] <= memory['rss'] for memory in usage.values())
+        assert pool.memory_saved() >= 0
+        # Requests to an exited worker fail at once, rather than waiting for the timeout (or blocking the pool)
+        os.kill(pool._pids[restarted], signal.SIGKILL)
+        pool._processes[0 if prefork else restarted].wait(timeout=60)  # The preloader exits with its workers
+        start = time.monotonic()
+        with pytest.raises(RuntimeError):
+            pool.classify('user-0', audio_file_paths[0], timeout=60)
+        assert time.monotonic() - start < 10
+        # Exited processes are left out of the memory usage
+        assert 'worker {}'.format(restarted) not in pool.memory_usage()
+    finally:
+        pool.close()
+    assert pool.memory_usage() == {} and pool.memory_saved() == 0
+
+    _assert_same_predictions(parallel + [restarted_prediction], serial + serial[:1], rtol=1e-4, atol=1e-5)
@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+#########################
+# Numerical equivalence of the shared STFT front end against the original feature extraction
+#########################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'polimi'))
+
+import librosa
+import numpy as np
+
+import mel_features
+import params
+import spectrogram
+import utils
+
+
+def _noise(seconds, seed=0):
+    return np.random.RandomState(seed).uniform(-0.5, 0.5, int(seconds * params.SAMPLE_RATE)).astype(np.float32)
+
+
+def _voiced(seconds, f0, seed=0):
+    # Speech-like harmonic signal, with vibrato and amplitude modulation, over a low noise floor
+    t = np.arange(int(seconds * params.SAMPLE_RATE)) / params.SAMPLE_RATE
+    phase = 2 * np.pi * np.cumsum(f0 * (1 + 0.05 * np.sin(2 * np.pi * 3 * t))) / params.SAMPLE_RATE
+    x = sum(np.sin(h * phase) / h for h in range(1, 20)) * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t) ** 2)
+    x = 0.3 * x / np.abs(x).max() + 0.003 * np.random.RandomState(seed).randn(len(t))
+    return x.astype(np.float32)
+
+
+def test_vggish_examples_match_waveform_to_examples():
+    wav = _noise(3.0)
+    examples = spectrogram.vggish_examples(spectrogram.magnitude_spectrogram(wav))
+    reference = utils.waveform_to_examples(wav, params.SAMPLE_RATE)
+    assert examples.shape == reference.shape
+    np.testing.assert_allclose(examples, reference, rtol=1e-6, atol=1e-6)
+
+
+def test_stft_frames_match_librosa_stft():
+    wav = _noise(2.0)
+    spec = spectrogram.magnitude_spectrogram(wav)
+    # librosa centres the frames on multiples of the hop, shifting the signal by half a window aligns the two grids;
+    # only frames not affected by librosa's padding are compared
+    reference = np.abs(librosa.stft(wav[200:], n_fft=512, win_length=400, hop_length=160)).T
+    n = min(spec.shape[0], reference.shape[0] - 2)
+    np.testing.assert_allclose(spec[2:n], reference[2:n], rtol=1e-4, atol=1e-4 * reference.max())
+
+
+def test_ghostvlad_spectrogram_selects_voiced_frames():
+    silence = np.zeros(params.SAMPLE_RATE, dtype=np.float32)
+    wav = np.concatenate([_noise(1.0, seed=1), silence, _noise(1.0, seed=2)])
+    spec = spectrogram.magnitude_spectrogram(wav)
+    ghost = spectrogram.ghostvlad_spectrogram(spec, wav)
+    intervals = librosa.effects.split(wav, top_db=spectrogram.GHOSTVLAD_TOP_DB)
+    mask = spectrogram.voiced_frames_mask(spec.shape[0], intervals)
+
+    assert ghost.shape == (spec.shape[1], mask.sum())
+    assert ghost.dtype == np.float32
+    np.testing.assert_allclose(ghost, spec[mask].T, rtol=1e-6)
+    # No selected analysis window overlaps the silent second
+    starts = np.flatnonzero(mask) * 160
+    assert not np.any((starts + 400 > 1.5 * params.SAMPLE_RATE) & (starts < 1.5 * params.SAMPLE_RATE))
+
+
+def test_ghostvlad_spectrogram_matches_features_extractor():
+    # The original front end (STFT of the VAD-trimmed waveform) involves no network
+    from ghostvlad.ghostvlad.ghostvlad_features_extractor import FeaturesExtractor
+
+    extractor = FeaturesExtractor.__new__(FeaturesExtractor)
+    extractor.dtype = np.float32
+    silence = (1e-4 * np.random.RandomState(3).randn(params.SAMPLE_RATE // 2)).astype(np.float32)
+    wav = np.concatenate([_voiced(1.2, 140, seed=0), silence, _voiced(0.8, 210, seed=1), silence,
+                          _voiced(1.5, 120, seed=2)])
+    reference = extractor.load_spectrogram(wav)
+    intervals = librosa.effects.split(wav, top_db=spectrogram.GHOSTVLAD_TOP_DB)
+    spec = spectrogram.magnitude_spectrogram(wav)
+    ghost = spectrogram.ghostvlad_spectrogram(spec, wav, intervals=intervals)
+
+    # At most 3 frames are lost around each interval boundary
+    assert reference.shape[1] - 3 * len(intervals) <= ghost.shape[1] <= reference.shape[1]
+    # Each frame is compared with the reference frame closest in time: frame centres on the trimmed waveform
+    mask = spectrogram.voiced_frames_mask(spec.shape[0], intervals)
+    centres = np.flatnonzero(mask) * 160 + 200
+    offsets = np.concatenate([[0], np.cumsum(intervals[:, 1] - intervals[:, 0])])
+    interval = np.searchsorted(intervals[:, 0], centres, side='right') - 1
+    frames = np.round((centres - intervals[interval, 0] + offsets[interval]) / 160.).astype(int)
+    x, y = ghost.T, reference.T[frames]
+    x_norms, y_norms = np.linalg.norm(x, axis=1), np.linalg.norm(y, axis=1)
+    cosine = np.sum(x * y, axis=1) / (x_norms * y_norms)
+    norm_error = np.abs(x_norms / y_norms - 1.)
+    # Frames are shifted by a quarter of the hop; the largest deviations are on low energy frames at the boundaries
+    assert np.median(cosine) > 0.995 and np.percentile(cosine, 5) > 0.95
+    assert np.average(cosine, weights=y_norms) > 0.99
+    assert np.median(norm_error) < 0.05 and np.percentile(norm_error, 95) < 0.1
+    # Long-term spectrum
+    x_mean, y_mean = ghost.mean(axis=1), reference.mean(axis=1)
+    assert np.dot(x_mean, y_mean) / (np.linalg.norm(x_mean) * np.linalg.norm(y_mean)) > 0.9999
+
+
+def test_float32_pipeline_matches_float64():
+    wav = _noise(2.0)
+    examples = utils.waveform_to_examples(wav, params.SAMPLE_RATE, dtype='float32')
+    reference = utils.waveform_to_examples(wav.astype(np.float64), params.SAMPLE_RATE, dtype='float64')
+    assert examples.dtype == np.float32 and reference.dtype == np.float64
+    np.testing.assert_allclose(examples, reference, rtol=1e-4, atol=1e-4)
+
+
+def test_frames_buffer_is_bounded():
+    plan = mel_features.FeaturePlan(params.SAMPLE_RATE, 400, 160, 512, dtype=np.float32, max_buffered_frames=100)
+    for seconds, buffered_frames in [(0.5, 48), (0.9, 88), (5.0, 88), (0.5, 88)]:
+        wav = _noise(seconds, seed=int(seconds * 10))
+        reference = mel_features.stft_magnitude(wav.astype(np.float64), 512, 160, 400)
+        np.testing.assert_allclose(plan.stft_magnitude(wav), reference, rtol=1e-4, atol=1e-4)
+        # Signals longer than max_buffered_frames do not grow the buffer kept by the thread
+        assert plan._buffers.frames.shape[0] == buffered_frames
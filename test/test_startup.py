@@ -0,0 +1,36 @@
+#! /usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+#########################
+# Startup: heavy dependencies are imported on first use
+#########################
+
+import os
+import subprocess
+import sys
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'polimi')
+sys.path.insert(0, SRC_PATH)
+
+
+def _imported_modules(statement, modules):
+    # Modules among the given ones imported by a statement run in a new interpreter
+    script = "import sys\n{}\nprint(' '.join(m for m in {!r} if m in sys.modules))".format(statement, modules)
+    return subprocess.run([sys.executable, '-c', script], cwd=SRC_PATH, check=True, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout.split()
+
+
+def test_pathosnet_import_is_light():
+    heavy_modules = ['tensorflow', 'keras', 'librosa', 'numba', 'scipy.signal']
+    assert _imported_modules("import pathosnet", heavy_modules) == []
+    assert _imported_modules("import ghostvlad.ghostvlad.ghostvlad_features_extractor", heavy_modules) == []
+
+
+def test_numba_cache_dir(tmp_path):
+    # In a new interpreter, not to change the numba configuration of the tests
+    script = "import os, params, startup\nparams.NUMBA_CACHE_DIR = {!r}\nstartup.import_librosa()\n" \
+             "import numba\nprint(numba.config.CACHE_DIR)".format(str(tmp_path / 'numba'))
+    env = {k: v for k, v in os.environ.items() if k != 'NUMBA_CACHE_DIR'}
+    output = subprocess.run([sys.executable, '-c', script], cwd=SRC_PATH, env=env, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    assert output.strip() == str(tmp_path / 'numba') and os.path.isdir(str(tmp_path / 'numba'))